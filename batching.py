@@ -0,0 +1,422 @@
+"""
+Cross-request dynamic batching
+Collects concurrent generation requests and packs them into shared UNet batches
+"""
+
+import math
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from encoding import BIT_DEPTHS, resolve_format
+from latents import save_latents
+
+
+class _PendingRequest:
+    """A generation request waiting for (part of) its images"""
+
+    def __init__(self, num_images, disease_type, sampler, num_inference_steps,
+                 decoder, seeds, progress_callback, bit_depth=8, decode=True,
+                 class_names=None, class_labels=None, guidance_scale=1.0,
+                 batch_size=None, decode_batch_size=None, decode_mode=None):
+        self.num_images = num_images
+        self.disease_type = disease_type
+        self.class_names = class_names or [disease_type] * num_images
+        self.class_labels = class_labels  # Per image, None for an unconditional U-Net
+        self.guidance_scale = guidance_scale
+        self.sampler = sampler
+        self.num_inference_steps = num_inference_steps
+        self.decoder = decoder
+        self.bit_depth = bit_depth
+        self.decode = decode  # False: hand out the denoised latents
+        self.batch_size = batch_size  # Most latents per run this request allows, or None
+        self.decode_batch_size = decode_batch_size
+        self.decode_mode = decode_mode
+        self.seeds = seeds  # Per-image seeds, or None
+        self.progress_callback = progress_callback
+        self.images = []
+        self.scheduled = 0
+        self.runs = 0
+        self.future = Future()
+        # Decoded chunks (or the run's exception) for streaming consumers
+        self.chunks = queue.Queue()
+
+    @property
+    def key(self):
+        """Requests can share a denoising run only if they sample identically"""
+        # Class labels are per latent, so requests for different classes mix
+        return (self.sampler, self.num_inference_steps, self.guidance_scale)
+
+    def seeds_for(self, start, count):
+        """Seeds of the images start..start+count (random for unseeded requests)"""
+        if self.seeds is None:
+            return [random.getrandbits(63) for _ in range(count)]
+        return self.seeds[start:start + count]
+
+    @property
+    def unscheduled(self):
+        return self.num_images - self.scheduled
+
+    def report(self, stage, step, max_batch_size):
+        if self.progress_callback is None:
+            return
+        self.progress_callback({
+            'stage': stage,
+            'batch': self.runs,
+            'num_batches': self.runs + math.ceil(self.unscheduled / max_batch_size),
+            'step': step,
+            'num_steps': self.num_inference_steps,
+            'images_done': len(self.images),
+            'num_images': self.num_images,
+        })
+
+
+class BatchScheduler:
+    """
+    Packs the images of concurrent requests into one latent batch per run
+
+    Requests are collected for a short window, then as many pending images as
+    fit into max_batch_size are denoised and decoded together and handed back
+    to their owners. Only requests with the same sampler, step count and
+    guidance scale share a run; with a class-conditional U-Net every latent
+    carries its own class label, so requests for different disease classes
+    do. Each request still gets exactly its own images, names, files, latent
+    decoder, decode mode and bit depth (or its latents, with storage="latents"):
+    decoding runs per request on its slice of the batch. A request's
+    batch_size caps the size of every run it joins.
+    """
+
+    def __init__(self, generator_factory, max_batch_size=None, window_ms=50):
+        """
+        Initialize the scheduler
+
+        Args:
+            generator_factory: Callable returning the MedicalImageGenerator
+            max_batch_size: Maximum number of latents per denoising run. Uses the
+                generator's memory-based UNet batch size if None
+            window_ms: How long to wait for more requests before starting a run
+        """
+        self.generator_factory = generator_factory
+        self._max_batch_size = max_batch_size
+        self._guided_max_batch_size = None
+        if max_batch_size is not None:
+            # Guided steps run the U-Net on twice the latents
+            self._guided_max_batch_size = max(1, max_batch_size // 2)
+        self.window = window_ms / 1000.0
+        self._pending = deque()
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def submit(self, num_images=1, disease_type="NORMAL", sampler=None,
+               num_inference_steps=None, progress_callback=None, decoder=None,
+               seed=None, image_format=None, storage=None, guidance_scale=None,
+               batch_size=None, decode_batch_size=None, decode_mode=None):
+        """
+        Queue a request
+
+        Args:
+            num_images: Number of images to generate
+            disease_type: Disease class, or a list with one class per image
+            sampler: Sampler name. Uses the generator default if None
+            num_inference_steps: Denoising steps. Uses the sampler default if None
+            progress_callback: Optional callable receiving progress dicts
+            decoder: Latent decoder name. Uses the generator default if None
+            seed: Optional seed; image i uses seed + i, whichever run it lands in
+            image_format: Output format; "png16" decodes 16-bit images
+            storage: "latents" to get the denoised latents instead of images
+            guidance_scale: Classifier-free guidance scale. Uses the generator default if None
+            batch_size: Most latents per denoising run holding this request's
+                images. Uses max_batch_size if None
+            decode_batch_size: VAE decode batch size. Uses the batch plan if None
+            decode_mode: "full", "sliced" or "tiled" VAE decoding. Uses the generator default if None
+
+        Returns:
+            Future resolving to the list of PIL images (or latents)
+        """
+        return self._enqueue(
+            num_images, disease_type, sampler, num_inference_steps, decoder, seed,
+            progress_callback, image_format, storage, guidance_scale,
+            batch_size, decode_batch_size, decode_mode
+        ).future
+
+    def _enqueue(self, num_images, disease_type, sampler, num_inference_steps,
+                 decoder, seed, progress_callback, image_format, storage=None,
+                 guidance_scale=None, batch_size=None, decode_batch_size=None,
+                 decode_mode=None):
+        generator = self.generator_factory()
+        sampler = generator._resolve_sampler(sampler)
+        num_inference_steps = generator._resolve_steps(sampler, num_inference_steps)
+        decoder = generator._resolve_decoder(decoder)
+        generator.get_decoder(decoder)  # Fail before queueing if it cannot be loaded
+        seeds = generator._resolve_seeds(seed, num_images)
+        bit_depth = BIT_DEPTHS[resolve_format(image_format)]
+        decode = generator._resolve_storage(storage) == "images"
+        class_names = generator._class_names(disease_type, num_images)
+        class_labels = generator._resolve_class_labels(class_names)
+        guidance_scale = generator._resolve_guidance_scale(guidance_scale)
+        decode_mode = generator._resolve_decode_mode(decode_mode)
+
+        pending = _PendingRequest(
+            num_images, disease_type, sampler, num_inference_steps, decoder, seeds,
+            progress_callback, bit_depth, decode, class_names, class_labels, guidance_scale,
+            batch_size, decode_batch_size, decode_mode
+        )
+        with self._lock:
+            self._ensure_worker()
+            self._pending.append(pending)
+            self._lock.notify_all()
+        return pending
+
+    def iter_images(self, num_images=1, disease_type="NORMAL", save_path=None,
+                    sampler=None, num_inference_steps=None, progress_callback=None,
+                    batch_size=None, decode_batch_size=None, decode_mode=None,
+                    decoder=None, seed=None, image_format=None, storage=None,
+                    guidance_scale=None):
+        """
+        Drop-in replacement for MedicalImageGenerator.iter_images (same arguments)
+
+        Yields each image as soon as the run containing it is decoded. Images
+        are saved by the generator's encoder pool, not the scheduler thread, so
+        the next run can start meanwhile.
+        """
+        pending = self._enqueue(
+            num_images, disease_type, sampler, num_inference_steps, decoder, seed,
+            progress_callback, image_format, storage, guidance_scale,
+            batch_size, decode_batch_size, decode_mode
+        )
+        generator = self.generator_factory()
+        stored = []
+
+        index = 0
+        while index < num_images:
+            chunk = pending.chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if save_path and not pending.decode:
+                # Rewritten per run, so stored latents can be decoded meanwhile
+                stored.extend(latent.numpy() for latent in chunk)
+                save_latents(
+                    save_path, np.stack(stored), range(len(stored)),
+                    generator.latent_metadata(disease_type, decoder, image_format)
+                )
+            elif save_path:
+                chunk = [
+                    generator.submit_save(image, pending.class_names[index + offset], save_path,
+                                          index + offset, image_format)
+                    for offset, image in enumerate(chunk)
+                ]
+            for image in chunk:
+                if save_path and pending.decode:
+                    image = image.result()
+                yield index, image
+                index += 1
+
+    def generate_images(self, num_images=1, disease_type="NORMAL", save_path=None,
+                        sampler=None, num_inference_steps=None, progress_callback=None,
+                        batch_size=None, decode_batch_size=None, decode_mode=None,
+                        decoder=None, seed=None, image_format=None, storage=None,
+                        guidance_scale=None):
+        """
+        Drop-in replacement for MedicalImageGenerator.generate_images (same arguments)
+
+        Blocks until the request's images are ready.
+        """
+        results = [
+            image for _, image in self.iter_images(
+                num_images=num_images,
+                disease_type=disease_type,
+                save_path=save_path,
+                sampler=sampler,
+                num_inference_steps=num_inference_steps,
+                progress_callback=progress_callback,
+                batch_size=batch_size,
+                decode_batch_size=decode_batch_size,
+                decode_mode=decode_mode,
+                decoder=decoder,
+                seed=seed,
+                image_format=image_format,
+                storage=storage,
+                guidance_scale=guidance_scale
+            )
+        ]
+
+        if save_path:
+            print(f"✓ Saved {len(results)} images to {save_path}")
+        return results
+
+    @property
+    def max_batch_size(self):
+        if self._max_batch_size is None:
+            plan = self.generator_factory().plan_batch_sizes()
+            self._guided_max_batch_size = plan['guided_unet_batch_size']
+            self._max_batch_size = plan['unet_batch_size']
+        return self._max_batch_size
+
+    @property
+    def guided_max_batch_size(self):
+        """Maximum number of latents per run when classifier-free guidance is on"""
+        if self._guided_max_batch_size is None:
+            _ = self.max_batch_size  # Probed together with the unguided size
+        return self._guided_max_batch_size
+
+    def queue_depth(self):
+        """Number of images queued but not yet scheduled into a run"""
+        with self._lock:
+            return sum(pending.unscheduled for pending in self._pending)
+
+    def _ensure_worker(self):
+        # Started lazily so the thread lives in the process that serves requests
+        # (threads do not survive a fork)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._worker, name='batch-scheduler', daemon=True
+            )
+            self._thread.start()
+
+    def _worker(self):
+        while True:
+            try:
+                slots = self._next_run()
+            except Exception as e:
+                # E.g. the batch size probe failed: fail the queued requests
+                # instead of leaving them waiting for a thread that is gone
+                self._fail_pending(e)
+                continue
+            self._execute(slots)
+
+    def _next_run(self):
+        """Wait for requests and pick the (request, first image, count) slots of the next run"""
+        with self._lock:
+            self._lock.wait_for(lambda: self._pending)
+            # Probed on the first run; failures go to the requests waiting for it
+            max_batch_size = self.max_batch_size
+
+            # Give concurrent requests a short window to join this run
+            deadline = time.monotonic() + self.window
+            while True:
+                queued = sum(pending.unscheduled for pending in self._pending)
+                remaining = deadline - time.monotonic()
+                if queued >= max_batch_size or remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+
+            # Fill the batch in arrival order with requests that can share it
+            key = self._pending[0].key
+            slots = []
+            total = 0
+            capacity = max_batch_size
+            if key[2] != 1.0:
+                capacity = self.guided_max_batch_size
+            for pending in list(self._pending):
+                if total == capacity:
+                    break
+                if pending.key != key:
+                    continue
+                if pending.batch_size is not None:
+                    if pending.batch_size <= total:
+                        continue  # The run is already larger than it allows
+                    capacity = min(capacity, pending.batch_size)
+                count = min(pending.unscheduled, capacity - total)
+                slots.append((pending, pending.scheduled, count))
+                pending.scheduled += count
+                pending.runs += 1
+                total += count
+                if pending.unscheduled == 0:
+                    self._pending.remove(pending)
+            return slots
+
+    def _execute(self, slots):
+        """Denoise and decode one packed batch and distribute the images"""
+        total = sum(count for _, _, count in slots)
+        sampler, num_inference_steps, guidance_scale = slots[0][0].key
+
+        try:
+            generator = self.generator_factory()
+            scheduler = generator.make_scheduler(sampler)
+            scheduler.set_timesteps(num_inference_steps, device=generator.device)
+
+            # Per-sample generators keep seeded images independent of their batch
+            # mates; only needed when someone in the run asked for a seed
+            generators = None
+            if any(pending.seeds is not None for pending, _, _ in slots):
+                seeds = []
+                for pending, start, count in slots:
+                    seeds.extend(pending.seeds_for(start, count))
+                generators = generator.make_generators(seeds)
+            latents = generator.sample_latents(total, scheduler, generators)
+
+            # One class label per latent, whichever request it belongs to
+            class_labels = None
+            if slots[0][0].class_labels is not None:
+                class_labels = []
+                for pending, start, count in slots:
+                    class_labels.extend(pending.class_labels[start:start + count])
+
+            def step_callback(step):
+                for pending, _, _ in slots:
+                    pending.report('denoising', step, self.max_batch_size)
+
+            owners = ', '.join(f"{count}x{pending.disease_type}" for pending, _, count in slots)
+            print(f"Batched run: {total} images from {len(slots)} request(s) ({owners})")
+            latents = generator.denoise(
+                latents, scheduler, num_inference_steps,
+                step_callback=step_callback,
+                desc=f"Batched run ({total})",
+                generators=generators,
+                class_labels=class_labels,
+                guidance_scale=guidance_scale
+            )
+
+            # Decode each owner's slice with the decoder it asked for
+            chunks = []
+            offset = 0
+            for pending, _, count in slots:
+                owned = latents[offset:offset + count]
+                if pending.decode:
+                    chunks.append(generator.decode_latents(
+                        owned, decode_batch_size=pending.decode_batch_size,
+                        decode_mode=pending.decode_mode, decoder=pending.decoder,
+                        bit_depth=pending.bit_depth
+                    ))
+                else:
+                    chunks.append(list(owned.float().cpu()))
+                offset += count
+        except Exception as e:
+            self._fail(slots, e)
+            return
+
+        # Hand the decoded images back to their owners
+        for (pending, _, _), chunk in zip(slots, chunks):
+            pending.images.extend(chunk)
+            pending.chunks.put(chunk)
+            pending.report('decoded' if pending.decode else 'denoised', num_inference_steps,
+                           self.max_batch_size)
+            if len(pending.images) == pending.num_images:
+                pending.future.set_result(pending.images)
+
+    def _fail_pending(self, error):
+        """Fail every queued request"""
+        print(f"Batch scheduling failed: {error}")
+        with self._lock:
+            failed = list(self._pending)
+            self._pending.clear()
+        for pending in failed:
+            if not pending.future.done():
+                pending.future.set_exception(error)
+                pending.chunks.put(error)
+
+    def _fail(self, slots, error):
+        """Fail every request in a run, including their not yet scheduled images"""
+        with self._lock:
+            for pending, _, _ in slots:
+                if pending in self._pending:
+                    self._pending.remove(pending)
+        for pending, _, _ in slots:
+            if not pending.future.done():
+                pending.future.set_exception(error)
+                pending.chunks.put(error)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Generation pipeline benchmark
+Times every stage of MedicalImageGenerator with random weights (no checkpoint
+or download): U-Net step, scheduler step, VAE decode, post-processing, PNG
+encoding, whole generations and the /generate route through the Flask test
+client. Results can be saved as JSON and compared against a stored baseline.
+
+Usage:
+    python benchmark.py                                   # default sweep
+    python benchmark.py --batch-sizes 1 4 --steps 10 20 --json bench.json
+    python benchmark.py --baseline bench.json             # exits 1 on a regression
+    python benchmark.py --precision bf16 --memory-format channels_last
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+
+# Stages timed once per batch size; the end-to-end stages also sweep the step count
+COMPONENT_STAGES = ("unet_step", "scheduler_step", "vae_decode", "postprocess", "png_encode")
+END_TO_END_STAGES = ("generate", "http_generate")
+
+
+def print_header(text):
+    """Print a formatted header"""
+    print("\n" + "="*60)
+    print(f"  {text}")
+    print("="*60)
+
+
+def measure(run, repeats, setup=None, warmup=True):
+    """
+    Time a callable
+
+    Args:
+        run: Callable timed on its own; receives setup()'s result if setup is given
+        repeats: Number of timed calls
+        setup: Optional untimed callable preparing run's argument (e.g. a fresh copy)
+        warmup: Make one untimed call first
+
+    Returns:
+        Dict with the median and minimum seconds
+    """
+    def call():
+        if setup is None:
+            start = time.perf_counter()
+            run()
+        else:
+            argument = setup()
+            start = time.perf_counter()
+            run(argument)
+        return time.perf_counter() - start
+
+    if warmup:
+        call()
+    timings = [call() for _ in range(repeats)]
+    return {'seconds': statistics.median(timings), 'min_seconds': min(timings)}
+
+
+def component_rows(generator, batch_size, args):
+    """Time the individual pipeline stages for one batch size"""
+    import torch
+    from PIL import Image
+    from model_inference import Config
+
+    latent_shape = (batch_size, Config.LATENT_CHANNELS, Config.LATENT_SIZE, Config.LATENT_SIZE)
+    latents = torch.randn(latent_shape, device=generator.device)
+    rows = []
+
+    def row(stage, timing):
+        rows.append({'stage': stage, 'batch_size': batch_size, 'steps': None, **timing})
+
+    # U-Net forward, as run by every denoising step
+    timestep = torch.tensor(Config.TIMESTEPS // 2, device=generator.device)
+
+    def unet_step():
+        with torch.no_grad(), generator._autocast():
+            generator.unet_engine(generator._to_memory_format(latents), timestep)
+    row('unet_step', measure(unet_step, args.repeats))
+
+    # Scheduler update, averaged over a whole schedule (multistep solvers
+    # keep state between steps)
+    noise_pred = torch.randn(latent_shape, device=generator.device)
+    num_steps = max(args.steps)
+
+    def scheduler_run(scheduler):
+        sample = latents
+        for t in scheduler.timesteps:
+            sample = scheduler.step(noise_pred, t, sample).prev_sample
+
+    def fresh_scheduler():
+        scheduler = generator.make_scheduler(args.sampler)
+        scheduler.set_timesteps(num_steps, device=generator.device)
+        return scheduler
+    timing = measure(scheduler_run, args.repeats, setup=fresh_scheduler)
+    row('scheduler_step', {key: value / num_steps for key, value in timing.items()})
+
+    # VAE decode (latent decoder only, in the configured decode mode)
+    latent_decoder = generator.get_decoder()
+    decoded = {}
+
+    def vae_decode():
+        with torch.no_grad(), generator._autocast():
+            # decode() applies the VAE scale factor itself, as in decode_latents
+            images = latent_decoder.decode(
+                generator._to_memory_format(latents), generator.decode_mode
+            )
+        decoded['images'] = images.float()
+    row('vae_decode', measure(vae_decode, args.repeats))
+
+    # Post-processing works in place, so every call gets its own copy
+    row('postprocess', measure(
+        generator.postprocess, args.repeats, setup=lambda: decoded['images'].clone()
+    ))
+
+    # PNG encoding of the batch
+    pixels = generator.postprocess(decoded['images'].clone())
+    images = [Image.fromarray(pixels[i]) for i in range(batch_size)]
+
+    def png_encode():
+        for image in images:
+            image.save(BytesIO(), format='PNG')
+    row('png_encode', measure(png_encode, args.repeats))
+
+    return rows
+
+
+def generate_row(generator, batch_size, steps, args):
+    """Time a whole generation through the library API"""
+    timing = measure(
+        lambda: generator.generate_images(
+            num_images=batch_size,
+            sampler=args.sampler,
+            num_inference_steps=steps,
+            seed=args.seed
+        ),
+        args.e2e_repeats,
+        warmup=False
+    )
+    return {'stage': 'generate', 'batch_size': batch_size, 'steps': steps, **timing}
+
+
+def http_row(client, generated_dir, batch_size, steps, args):
+    """Time a POST /generate through the Flask test client (saves the PNGs too)"""
+    payload = {
+        'disease': 'normal',
+        'count': batch_size,
+        'sampler': args.sampler,
+        'steps': steps,
+        'seed': args.seed,
+    }
+
+    def post():
+        response = client.post('/generate', json=payload)
+        data = response.get_json()
+        if response.status_code != 200 or not data.get('success'):
+            raise RuntimeError(f"/generate failed: {data}")
+        # Keep the benchmark from filling static/generated
+        shutil.rmtree(generated_dir / data['session_id'], ignore_errors=True)
+
+    timing = measure(post, args.e2e_repeats, warmup=False)
+    return {'stage': 'http_generate', 'batch_size': batch_size, 'steps': steps, **timing}
+
+
+def make_client(generator):
+    """Flask test client of server.py serving with the given generator"""
+    # Read by server.py at import: measure live generation, not the reservoir or cache
+    os.environ['RESERVOIR_SIZE'] = '0'
+    os.environ['GENERATION_CACHE_MB'] = '0'
+    os.environ['PRELOAD_MODEL'] = '0'
+    import server
+
+    server.model_generator = generator
+    return server.app.test_client(), server.GENERATED_DIR
+
+
+def compare_to_baseline(rows, meta, baseline, tolerance):
+    """
+    Print the change against a baseline run
+
+    Args:
+        rows: Results of this run
+        meta: Environment of this run
+        baseline: Parsed results file of the baseline run
+        tolerance: Allowed relative slowdown
+
+    Returns:
+        Number of timings slower than the baseline by more than tolerance
+    """
+    def key(row):
+        return (row['stage'], row['batch_size'], row['steps'])
+
+    reference = {key(row): row for row in baseline['results']}
+    for field in ('torch', 'threads', 'variant', 'engine'):
+        if baseline['meta'].get(field) != meta.get(field):
+            print(f"⚠ Baseline {field} differs: {baseline['meta'].get(field)} "
+                  f"vs {meta.get(field)}")
+
+    print(f"\n{'stage':<16}{'batch':>6}{'steps':>6}{'baseline s':>12}{'now s':>10}{'change':>9}")
+    regressions = 0
+    for row in rows:
+        base = reference.get(key(row))
+        if base is None:
+            continue
+        change = row['seconds'] / base['seconds'] - 1
+        flag = ""
+        if change > tolerance:
+            flag = "  ✗ slower"
+            regressions += 1
+        print(f"{row['stage']:<16}{row['batch_size']:>6}{row['steps'] or '-':>6}"
+              f"{base['seconds']:>12.4f}{row['seconds']:>10.4f}{change:>+9.1%}{flag}")
+    return regressions
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 2])
+    parser.add_argument('--steps', nargs='+', type=int, default=[5, 10],
+                        help='Step counts of the end-to-end runs')
+    parser.add_argument('--sampler', default='ddim')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Timed calls per stage (the median is reported)')
+    parser.add_argument('--e2e-repeats', type=int, default=1,
+                        help='Timed calls per end-to-end run')
+    parser.add_argument('--stages', nargs='+', default=list(COMPONENT_STAGES + END_TO_END_STAGES),
+                        choices=COMPONENT_STAGES + END_TO_END_STAGES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--precision', default=None)
+    parser.add_argument('--memory-format', default=None)
+    parser.add_argument('--quantization', default=None)
+    parser.add_argument('--engine', default=None)
+    parser.add_argument('--json', type=Path, help='Write the results to this file')
+    parser.add_argument('--baseline', type=Path, help='Compare against this results file')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Allowed slowdown against the baseline (0.15 = 15%%)')
+    args = parser.parse_args()
+
+    import torch
+    from model_inference import MedicalImageGenerator
+
+    print_header("GENERATION PIPELINE BENCHMARK")
+    torch.manual_seed(args.seed)
+    generator = MedicalImageGenerator(
+        device=args.device,
+        pretrained_vae=False,
+        batch_size=max(args.batch_sizes),
+        decode_batch_size=max(args.batch_sizes),
+        quantization=args.quantization,
+        engine=args.engine,
+        precision=args.precision,
+        memory_format=args.memory_format
+    )
+    meta = {
+        'torch': torch.__version__,
+        'threads': torch.get_num_threads(),
+        'cpu': platform.processor() or platform.machine(),
+        'device': str(generator.device),
+        'variant': generator.variant,
+        'engine': generator.unet_engine.active,
+        'sampler': args.sampler,
+        'random_weights': True,
+    }
+    print(f"torch {meta['torch']}, {meta['threads']} threads, "
+          f"variant {meta['variant']}, engine {meta['engine']}")
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        print_header(f"STAGES: batch {batch_size}")
+        rows.extend(
+            row for row in component_rows(generator, batch_size, args)
+            if row['stage'] in args.stages
+        )
+
+    if 'generate' in args.stages:
+        for batch_size in args.batch_sizes:
+            for steps in args.steps:
+                print_header(f"GENERATE: batch {batch_size}, {steps} steps")
+                rows.append(generate_row(generator, batch_size, steps, args))
+
+    if 'http_generate' in args.stages:
+        client, generated_dir = make_client(generator)
+        for batch_size in args.batch_sizes:
+            for steps in args.steps:
+                print_header(f"POST /generate: count {batch_size}, {steps} steps")
+                rows.append(http_row(client, generated_dir, batch_size, steps, args))
+
+    for row in rows:
+        row['seconds_per_image'] = row['seconds'] / row['batch_size']
+
+    print_header("RESULTS")
+    print(f"\n{'stage':<16}{'batch':>6}{'steps':>6}{'median s':>10}{'min s':>10}{'s/image':>10}")
+    for row in rows:
+        print(f"{row['stage']:<16}{row['batch_size']:>6}{row['steps'] or '-':>6}"
+              f"{row['seconds']:>10.4f}{row['min_seconds']:>10.4f}{row['seconds_per_image']:>10.4f}")
+    print("\nunet_step and scheduler_step are per denoising step; the other stages per batch.")
+
+    if args.json:
+        args.json.write_text(json.dumps({'meta': meta, 'results': rows}, indent=2))
+        print(f"✓ Results written to {args.json}")
+
+    if args.baseline:
+        print_header(f"BASELINE: {args.baseline}")
+        regressions = compare_to_baseline(
+            rows, meta, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        if regressions:
+            print(f"\n✗ {regressions} timing(s) more than {args.tolerance:.0%} slower than the baseline")
+            return 1
+        print(f"\n✓ No timing more than {args.tolerance:.0%} slower than the baseline")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+VAE decode benchmark
+Compares the full, sliced and tiled decode modes of MedicalImageGenerator for
+speed, peak memory and output difference across batch sizes.
+
+Usage:
+    python benchmark_decode.py                     # pretrained VAE (downloads once)
+    python benchmark_decode.py --random-weights    # no download, speed/memory only
+    python benchmark_decode.py --batch-sizes 1 4 8 16 --json decode_results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+from pathlib import Path
+
+
+def print_header(text):
+    """Print a formatted header"""
+    print("\n" + "="*60)
+    print(f"  {text}")
+    print("="*60)
+
+
+class PeakMemorySampler:
+    """Samples this process' resident memory in a background thread"""
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self.baseline = self.current()
+
+    @staticmethod
+    def current():
+        """Current resident set size in bytes"""
+        statm = Path('/proc/self/statm')
+        if statm.exists():
+            pages = int(statm.read_text().split()[1])
+            return pages * os.sysconf('SC_PAGE_SIZE')
+        # ru_maxrss is in KiB on Linux and bytes on macOS; only a fallback
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.baseline
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+    @property
+    def growth(self):
+        return self.peak - self.baseline
+
+
+def run_case(mode, batch_size, args, results):
+    """Decode one batch in a fresh process and report time, memory and pixels"""
+    import numpy as np
+    import torch
+    from model_inference import Config, MedicalImageGenerator
+
+    # Seed before building so random-weight VAEs match across processes
+    torch.manual_seed(args.seed)
+    device = torch.device(args.device)
+    generator = MedicalImageGenerator(
+        device=device,
+        pretrained_vae=not args.random_weights,
+        batch_size=1,
+        decode_batch_size=batch_size,
+        decode_mode=mode
+    )
+
+    # Same latents for every mode so the outputs can be compared
+    torch.manual_seed(args.seed)
+    latents = torch.randn(
+        (batch_size, Config.LATENT_CHANNELS, Config.LATENT_SIZE, Config.LATENT_SIZE)
+    ).to(device) * Config.VAE_SCALE_FACTOR
+
+    # Warm-up
+    generator.decode_latents(latents[:1])
+
+    timings = []
+    peak = 0
+    for _ in range(args.repeats):
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+            baseline = torch.cuda.memory_allocated(device)
+            start = time.perf_counter()
+            images = generator.decode_latents(latents)
+            torch.cuda.synchronize(device)
+            timings.append(time.perf_counter() - start)
+            peak = max(peak, torch.cuda.max_memory_allocated(device) - baseline)
+        else:
+            with PeakMemorySampler() as sampler:
+                start = time.perf_counter()
+                images = generator.decode_latents(latents)
+                timings.append(time.perf_counter() - start)
+            peak = max(peak, sampler.growth)
+
+    pixels = np.stack([np.asarray(image) for image in images])
+    results.put({
+        'mode': mode,
+        'batch_size': batch_size,
+        'seconds': min(timings),
+        'seconds_per_image': min(timings) / batch_size,
+        'peak_bytes': peak,
+        'pixels': pixels.tobytes(),
+        'shape': pixels.shape,
+    })
+
+
+def compare(pixels, reference):
+    """Pixel difference between two uint8 image stacks"""
+    import numpy as np
+
+    diff = np.abs(pixels.astype(np.float64) - reference.astype(np.float64))
+    mse = float((diff ** 2).mean())
+    psnr = float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+    return {
+        'max_abs_diff': float(diff.max()),
+        'mean_abs_diff': float(diff.mean()),
+        'psnr_db': psnr,
+    }
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--modes', nargs='+', default=['full', 'sliced', 'tiled'])
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--repeats', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Build the VAE with random weights instead of downloading it')
+    parser.add_argument('--json', type=Path, help='Write the results to this file')
+    args = parser.parse_args()
+
+    import numpy as np
+
+    print_header("VAE DECODE BENCHMARK")
+
+    # Each case runs in its own process so peak memory is not inherited
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for batch_size in args.batch_sizes:
+        reference = None
+        for mode in args.modes:
+            results = context.Queue()
+            process = context.Process(target=run_case, args=(mode, batch_size, args, results))
+            process.start()
+            result = results.get()
+            process.join()
+
+            pixels = np.frombuffer(result.pop('pixels'), dtype=np.uint8)
+            pixels = pixels.reshape(result.pop('shape'))
+            if reference is None:
+                reference = pixels
+                result['reference_mode'] = mode
+            result.update(compare(pixels, reference))
+            rows.append(result)
+
+    print_header("RESULTS")
+    print(f"\n{'mode':<8}{'batch':>6}{'s/batch':>10}{'s/image':>10}"
+          f"{'peak MB':>10}{'max diff':>10}{'PSNR dB':>10}")
+    for row in rows:
+        print(f"{row['mode']:<8}{row['batch_size']:>6}{row['seconds']:>10.3f}"
+              f"{row['seconds_per_image']:>10.3f}{row['peak_bytes'] / 2**20:>10.1f}"
+              f"{row['max_abs_diff']:>10.1f}{row['psnr_db']:>10.1f}")
+    print(f"\nDifferences are against the first mode ({args.modes[0]}) for the same batch.")
+
+    if args.json:
+        args.json.write_text(json.dumps({
+            'device': args.device,
+            'random_weights': args.random_weights,
+            'results': rows,
+        }, indent=2))
+        print(f"✓ Results written to {args.json}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Content-addressed generation cache
+Stores seeded images on disk so repeated requests are served without regenerating
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+
+class GenerationCache:
+    """
+    On-disk image cache with least-recently-used, size-bounded eviction
+
+    Every image is stored under the hash of everything that determines its
+    pixels: the checkpoint hash and model variant (quantization, precision,
+    layout), sampler, step count, disease class, guidance scale, latent
+    decoder, VAE decode mode, bit depth and the image's own seed. Seeds are
+    per image, so overlapping requests (seed 7 with 4 images, then seed 9
+    with 4 images) share entries.
+    Reads refresh a file's modification time, which doubles as its LRU stamp,
+    so several worker processes can share one cache directory.
+    """
+
+    def __init__(self, root, max_bytes=512 * 2**20):
+        """
+        Initialize the cache
+
+        Args:
+            root: Cache directory (created if missing)
+            max_bytes: Total size the cache is trimmed back to after a write
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def make_key(checkpoint_hash, sampler, num_inference_steps, seed, disease_type, decoder,
+                 variant=None, bit_depth=8, guidance_scale=1.0, decode_mode='full'):
+        """Content address of one generated image"""
+        fields = {
+            'checkpoint': checkpoint_hash,
+            'variant': variant,
+            'sampler': sampler,
+            'steps': num_inference_steps,
+            'seed': seed,
+            'class': disease_type.upper(),
+            'decoder': decoder,
+        }
+        if bit_depth != 8:
+            # Only added when set, so 8-bit entries keep their keys
+            fields['bit_depth'] = bit_depth
+        if guidance_scale != 1.0:
+            # Likewise, unguided entries keep their keys
+            fields['guidance_scale'] = guidance_scale
+        if decode_mode != 'full':
+            # Tiled decoding changes pixels; full-decode entries keep their keys
+            fields['decode_mode'] = decode_mode
+        return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        # Two-level fan-out keeps directories small
+        return self.root / key[:2] / f"{key}.png"
+
+    def get(self, key):
+        """
+        Look up a cached image
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            PIL Image, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            image = Image.open(path)
+            image.load()
+            os.utime(path)  # Mark as recently used
+        except OSError:  # Missing, evicted meanwhile or unreadable
+            return None
+        return image
+
+    def put(self, key, image):
+        """
+        Store an image and evict the least recently used entries if the cache is full
+
+        Args:
+            key: Key from make_key
+            image: PIL Image
+        """
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial PNG
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, format='PNG')
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        """Size of the cache as seen by this process (exact after every eviction)"""
+        with self._lock:
+            return {'bytes': self._size, 'max_bytes': self.max_bytes}
+
+    def _entries(self):
+        """(path, size, last use) of every cached image"""
+        entries = []
+        for path in self.root.glob('*/*.png'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue  # Evicted by another process meanwhile
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        """Delete least recently used images until the cache fits max_bytes"""
+        # Rescan: other worker processes may have added or removed entries
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self._size -= size
@@ -0,0 +1,335 @@
+"""
+Gemini chat client
+Sends chat questions to the Gemini generateContent API over a pooled HTTP
+session, with a response cache, coalescing of identical in-flight questions
+and retries with exponential backoff, or streams the answer as it is written
+"""
+
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "topK": 40,
+    "topP": 0.95,
+    "maxOutputTokens": 1024,
+}
+SAFETY_SETTINGS = [
+    {"category": category, "threshold": "BLOCK_MEDIUM_AND_ABOVE"}
+    for category in (
+        "HARM_CATEGORY_HARASSMENT",
+        "HARM_CATEGORY_HATE_SPEECH",
+        "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "HARM_CATEGORY_DANGEROUS_CONTENT",
+    )
+]
+
+# Worth another attempt: rate limiting and server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ChatError(Exception):
+    """A chat call failed; outcome is 'timeout', 'error' or 'interrupted' (mid-stream)"""
+
+    def __init__(self, message, outcome='error', status=None, details=None):
+        super().__init__(message)
+        self.outcome = outcome
+        self.status = status
+        self.details = details
+
+
+def normalize_question(question):
+    """Cache key of a question: case, spacing and trailing punctuation ignored"""
+    return ' '.join(question.casefold().split()).rstrip('?!. ')
+
+
+def extract_text(data):
+    """Text of the first candidate of a generateContent response, or None"""
+    candidates = data.get('candidates') or []
+    if candidates:
+        parts = candidates[0].get('content', {}).get('parts') or []
+        if parts and 'text' in parts[0]:
+            return parts[0]['text']
+    return None
+
+
+def finish_reason(data):
+    """Why the first candidate ended (set on the last chunk of a stream), or None"""
+    candidates = data.get('candidates') or []
+    return candidates[0].get('finishReason') if candidates else None
+
+
+class ResponseCache:
+    """Least-recently-used cache of answers whose entries expire after ttl seconds"""
+
+    def __init__(self, max_entries=256, ttl=3600):
+        """
+        Args:
+            max_entries: Number of answers kept (0 disables the cache)
+            ttl: Seconds an answer is served from the cache
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached answer, or None on a miss or if it expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            answer, expires = entry
+            if time.monotonic() >= expires:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return answer
+
+    def put(self, key, answer):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (answer, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class GeminiClient:
+    """
+    Client of the Gemini generateContent endpoint
+
+    One requests.Session keeps connections to the API alive between
+    questions. Answers are cached under the normalized question, and
+    concurrent callers asking the same question share one API call
+    (single flight). Connection errors, rate limiting and 5xx responses are
+    retried with exponential backoff and jitter; timeouts are not, so a
+    caller waits at most about timeout plus the backoff of failed attempts.
+    stream relays the answer of the streaming endpoint piece by piece.
+    """
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, model=DEFAULT_MODEL,
+                 system_context="", timeout=20, max_retries=2, backoff_seconds=0.5,
+                 max_backoff_seconds=4, cache_size=256, cache_ttl=3600, pool_size=8):
+        """
+        Initialize the client (no network access yet)
+
+        Args:
+            api_key: Gemini API key, sent as the x-goog-api-key header
+            base_url: API root, e.g. a local stand-in server (see mock_gemini.py)
+            model: Model name in the endpoint path
+            system_context: Instructions put in front of every question
+            timeout: Seconds to wait for a response
+            max_retries: Additional attempts after a retryable failure
+            backoff_seconds: Delay before the first retry, doubled for each further one
+            max_backoff_seconds: Upper bound of a retry delay (also of Retry-After)
+            cache_size: Number of cached answers (0 disables the cache)
+            cache_ttl: Seconds an answer is served from the cache
+            pool_size: Connections kept open to the API
+        """
+        model_url = f"{base_url.rstrip('/')}/models/{model}"
+        self.url = f"{model_url}:generateContent"
+        self.stream_url = f"{model_url}:streamGenerateContent?alt=sse"
+        self.system_context = system_context
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.cache = ResponseCache(cache_size, cache_ttl)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        if api_key:
+            self.session.headers['x-goog-api-key'] = api_key
+
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def ask(self, question):
+        """
+        Answer a chat question
+
+        Args:
+            question: The user's message
+
+        Returns:
+            Tuple of (answer, outcome): outcome is 'ok', 'cached' or
+            'empty' (the API returned no text; the answer is None)
+
+        Raises:
+            ChatError: The API could not be reached or kept failing
+        """
+        key = normalize_question(question)
+        answer = self.cache.get(key)
+        if answer is not None:
+            return answer, 'cached'
+
+        # Single flight: the first caller asks, the others wait for its answer
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            answer = self.complete(self._prompt(question))
+            result = (answer, 'ok' if answer is not None else 'empty')
+            if answer is not None:
+                self.cache.put(key, answer)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def cached(self, question):
+        """Cached answer to a question, or None"""
+        return self.cache.get(normalize_question(question))
+
+    def stream(self, question):
+        """
+        Answer a chat question, yielding the text as the API writes it
+
+        Uses the streaming endpoint (server-sent events). Not cached or
+        coalesced while running (see cached); the complete answer is cached
+        at the end. Failures before the first chunk are retried like ask's.
+
+        Args:
+            question: The user's message
+
+        Yields:
+            Pieces of the answer, in order
+
+        Raises:
+            ChatError: The API could not be reached, kept failing, or the
+                stream broke off (outcome 'interrupted')
+        """
+        response = self._post(self.stream_url, self._payload(self._prompt(question)), stream=True)
+        pieces = []
+        finished = False
+        try:
+            # chunk_size=None hands over every chunk as it arrives, not 512-byte blocks
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                # Events are "data: <json chunk>" lines separated by blank lines
+                if not line or not line.startswith('data:'):
+                    continue
+                data = json.loads(line[5:])
+                text = extract_text(data)
+                if text:
+                    pieces.append(text)
+                    yield text
+                if finish_reason(data) is not None:
+                    finished = True
+        except requests.exceptions.RequestException as e:
+            raise ChatError(f"Gemini stream interrupted: {e}", 'interrupted')
+        except ValueError as e:
+            raise ChatError(f"Malformed Gemini stream chunk: {e}", 'interrupted')
+        finally:
+            response.close()
+
+        # A stream cut off between chunks ends like a complete one, minus the finish reason
+        if not finished:
+            raise ChatError("Gemini stream ended before the answer was finished", 'interrupted')
+        if pieces:
+            self.cache.put(normalize_question(question), ''.join(pieces))
+
+    def complete(self, prompt):
+        """
+        Send one prompt, uncached, retrying retryable failures
+
+        Returns:
+            The generated text, or None if the response has none (e.g. blocked)
+
+        Raises:
+            ChatError: The API could not be reached or kept failing
+        """
+        data = self._post(self.url, self._payload(prompt)).json()
+        text = extract_text(data)
+        if text is None and 'promptFeedback' in data:
+            print(f"Prompt feedback: {data['promptFeedback']}")
+        return text
+
+    def _prompt(self, question):
+        return f"{self.system_context}\n\nUser question: {question}\n\nAssistant:"
+
+    @staticmethod
+    def _payload(prompt):
+        return {
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": GENERATION_CONFIG,
+            "safetySettings": SAFETY_SETTINGS,
+        }
+
+    def _post(self, url, payload, stream=False):
+        """
+        POST to the API, retrying retryable failures
+
+        Returns:
+            The successful (200) response; with stream=True its body is not read yet
+
+        Raises:
+            ChatError: The API could not be reached or kept failing
+        """
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout,
+                                             stream=stream)
+            except requests.exceptions.Timeout:
+                raise ChatError(f"Gemini API timed out after {self.timeout}s", 'timeout')
+            except requests.exceptions.ConnectionError as e:
+                error = ChatError(f"Gemini API unreachable: {e}")
+            else:
+                if response.status_code == 200:
+                    return response
+                error = ChatError(
+                    f"Gemini API returned status {response.status_code}",
+                    status=response.status_code, details=response.text
+                )
+                if response.status_code not in RETRY_STATUSES:
+                    raise error
+                retry_after = response.headers.get('Retry-After')
+
+            if attempt == self.max_retries:
+                raise error
+            time.sleep(self._backoff(attempt, retry_after))
+
+    def _backoff(self, attempt, retry_after=None):
+        """Delay before retry number attempt + 1: the server's Retry-After, or exponential with jitter"""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff_seconds)
+            except ValueError:
+                pass  # An HTTP date; use our own delay
+        delay = min(self.backoff_seconds * 2 ** attempt, self.max_backoff_seconds)
+        return delay * random.uniform(0.5, 1.0)
+
+    def stats(self):
+        """Cached answers and questions in flight"""
+        with self._lock:
+            inflight = len(self._inflight)
+        return {'cached_answers': len(self.cache), 'inflight': inflight}
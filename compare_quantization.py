@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+U-Net quantization comparison
+Measures the latency gain of the INT8 U-Net modes and how far their noise
+predictions and generated images drift from the float32 model.
+
+Usage:
+    python compare_quantization.py                      # trained checkpoint
+    python compare_quantization.py --random-weights     # no checkpoint or VAE download
+    python compare_quantization.py --modes static --steps 20 --json quant_results.json
+"""
+
+import argparse
+import copy
+import json
+import sys
+import time
+from pathlib import Path
+
+
+def print_header(text):
+    """Print a formatted header"""
+    print("\n" + "="*60)
+    print(f"  {text}")
+    print("="*60)
+
+
+def unet_latency(model, inputs, repeats):
+    """Best-of-N seconds for one U-Net forward pass on (latents, timestep[, class_labels])"""
+    import torch
+
+    timings = []
+    with torch.no_grad():
+        model(*inputs)  # Warm-up
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(*inputs)
+            timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def prediction_drift(model, reference, batches):
+    """Relative L2 error of the noise prediction against the float model"""
+    import torch
+
+    errors = []
+    with torch.no_grad():
+        for inputs in batches:
+            expected = reference(*inputs).sample
+            actual = model(*inputs).sample
+            errors.append(((actual - expected).norm() / expected.norm()).item())
+    return sum(errors) / len(errors)
+
+
+def image_drift(pixels, reference):
+    """Pixel and intensity-statistics difference between two uint8 image stacks"""
+    import numpy as np
+
+    pixels = pixels.astype(np.float64)
+    reference = reference.astype(np.float64)
+    diff = np.abs(pixels - reference)
+    mse = float((diff ** 2).mean())
+
+    # Total variation distance between the intensity histograms
+    hist = np.histogram(pixels, bins=256, range=(0, 256))[0] / pixels.size
+    ref_hist = np.histogram(reference, bins=256, range=(0, 256))[0] / reference.size
+    return {
+        'max_abs_diff': float(diff.max()),
+        'mean_abs_diff': float(diff.mean()),
+        'psnr_db': float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse),
+        'mean_shift': float(pixels.mean() - reference.mean()),
+        'std_shift': float(pixels.std() - reference.std()),
+        'histogram_tv': float(0.5 * np.abs(hist - ref_hist).sum()),
+    }
+
+
+def main():
+    """Run the comparison"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--modes', nargs='+', default=['dynamic', 'static'])
+    parser.add_argument('--model', type=Path, default=Path('checkpoints/final_unet_model.pth'))
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Use random U-Net and VAE weights instead of the checkpoint')
+    parser.add_argument('--batch-size', type=int, default=2)
+    parser.add_argument('--num-images', type=int, default=4)
+    parser.add_argument('--sampler', default='ddim')
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--calibration-batches', type=int, default=None)
+    parser.add_argument('--json', type=Path, help='Write the results to this file')
+    args = parser.parse_args()
+
+    import numpy as np
+    import torch
+    from model_inference import MedicalImageGenerator
+    from quantization import quantize_unet
+
+    print_header("U-NET QUANTIZATION COMPARISON")
+    print(f"Quantization engine: {torch.backends.quantized.engine}, "
+          f"torch threads: {torch.get_num_threads()}")
+
+    torch.manual_seed(args.seed)
+    generator = MedicalImageGenerator(
+        model_path=None if args.random_weights else args.model,
+        device=torch.device('cpu'),
+        pretrained_vae=not args.random_weights,
+        batch_size=args.batch_size
+    )
+    float_unet = generator.model
+    calibration = generator.calibration_batches(args.calibration_batches)
+    # Evaluation inputs differ from the calibration inputs
+    evaluation = generator.calibration_batches(4, args.batch_size, seed=args.seed + 1)
+    generator.plan_batch_sizes()  # One-time memory probe, kept out of the timings
+
+    rows = []
+    reference_pixels = None
+    for mode in ['none'] + [mode for mode in args.modes if mode != 'none']:
+        print_header(f"MODE: {mode}")
+        start = time.perf_counter()
+        model = quantize_unet(copy.deepcopy(float_unet), mode, calibration)
+        quantize_seconds = time.perf_counter() - start
+
+        generator.set_unet(model)
+        row = {
+            'mode': mode,
+            'quantize_seconds': quantize_seconds,
+            'unet_seconds': unet_latency(model, evaluation[0], args.repeats),
+            'prediction_rel_error': prediction_drift(model, float_unet, evaluation),
+        }
+
+        start = time.perf_counter()
+        images = generator.generate_images(
+            num_images=args.num_images,
+            sampler=args.sampler,
+            num_inference_steps=args.steps,
+            seed=args.seed
+        )
+        row['generate_seconds'] = time.perf_counter() - start
+
+        pixels = np.stack([np.asarray(image) for image in images])
+        if reference_pixels is None:
+            reference_pixels = pixels
+        row.update(image_drift(pixels, reference_pixels))
+        rows.append(row)
+
+    generator.set_unet(float_unet)
+
+    print_header("RESULTS")
+    baseline = rows[0]
+    print(f"\n{'mode':<9}{'unet s':>9}{'speedup':>9}{'gen s':>9}{'pred err':>10}"
+          f"{'max diff':>10}{'mean diff':>11}{'PSNR dB':>9}{'hist TV':>9}")
+    for row in rows:
+        speedup = baseline['unet_seconds'] / row['unet_seconds']
+        print(f"{row['mode']:<9}{row['unet_seconds']:>9.3f}{speedup:>8.2f}x"
+              f"{row['generate_seconds']:>9.2f}{row['prediction_rel_error']:>10.4f}"
+              f"{row['max_abs_diff']:>10.1f}{row['mean_abs_diff']:>11.2f}"
+              f"{row['psnr_db']:>9.1f}{row['histogram_tv']:>9.4f}")
+    print(f"\nU-Net latency for a batch of {args.batch_size}; generation of {args.num_images} "
+          f"images with {args.sampler} ({args.steps} steps).")
+    print("Drift is against the float32 model with the same seeds.")
+
+    if args.json:
+        args.json.write_text(json.dumps({
+            'engine': torch.backends.quantized.engine,
+            'threads': torch.get_num_threads(),
+            'random_weights': args.random_weights,
+            'batch_size': args.batch_size,
+            'sampler': args.sampler,
+            'steps': args.steps,
+            'results': rows,
+        }, indent=2))
+        print(f"✓ Results written to {args.json}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
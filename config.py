@@ -0,0 +1,141 @@
+"""
+Configuration for the latent diffusion model
+Kept free of torch and diffusers imports so the server can validate requests
+without loading the model stack
+"""
+
+from pathlib import Path
+
+
+# INT8 U-Net modes, see quantization.py ("none" keeps the float32 model)
+QUANTIZATION_MODES = ("none", "dynamic", "static")
+
+# Inference engines, see engine.py ("eager" runs the diffusers modules as they are)
+ENGINES = ("eager", "torchscript", "compile", "onnx")
+
+
+class Config:
+    """Configuration for the latent diffusion model"""
+    # Model Parameters
+    VAE_MODEL = "stabilityai/sd-vae-ft-mse"
+    VAE_SCALE_FACTOR = 0.18215
+    # Architecture of VAE_MODEL, used to build it with random weights (benchmarks)
+    VAE_CONFIG = {
+        "in_channels": 3,
+        "out_channels": 3,
+        "latent_channels": 4,
+        "down_block_types": ("DownEncoderBlock2D",) * 4,
+        "up_block_types": ("UpDecoderBlock2D",) * 4,
+        "block_out_channels": (128, 256, 512, 512),
+        "layers_per_block": 2,
+        "norm_num_groups": 32,
+        "sample_size": 256,
+    }
+    # U-Net architecture of the trained checkpoint
+    UNET_CONFIG = {
+        "sample_size": 32,
+        "in_channels": 4,
+        "out_channels": 4,
+        "layers_per_block": 2,
+        "block_out_channels": (128, 256, 512, 512),
+        "down_block_types": ("DownBlock2D", "DownBlock2D", "AttnDownBlock2D", "DownBlock2D"),
+        "up_block_types": ("UpBlock2D", "AttnUpBlock2D", "UpBlock2D", "UpBlock2D"),
+    }
+    LATENT_SIZE = 32  # 256 // 8
+    LATENT_CHANNELS = 4
+    IMAGE_SIZE = 256
+    
+    # Inference Parameters
+    TIMESTEPS = 1000
+    NUM_INFERENCE_STEPS = 50  # Fewer steps for faster generation
+    MIN_INFERENCE_STEPS = 1
+    MAX_INFERENCE_STEPS = 1000
+    
+    # Sampler Parameters
+    DEFAULT_SAMPLER = "ddpm"
+    # Default step count per sampler; the multistep solvers converge in far
+    # fewer UNet passes than ancestral DDPM sampling
+    SAMPLER_STEPS = {
+        "ddpm": NUM_INFERENCE_STEPS,
+        "ddim": 20,
+        "dpm++": 15,
+        "euler": 20,
+    }
+    
+    # Batch sizing: a one-time probe measures the activation memory of one
+    # sample and fills this share of the available memory
+    MEMORY_BUDGET_FRACTION = 0.5
+    ACTIVATION_SAFETY_FACTOR = 2  # CPU: allocator overhead and workspace beyond profiled allocations
+    MAX_UNET_BATCH_SIZE = 32
+    MAX_DECODE_BATCH_SIZE = 16
+    
+    # VAE decoding: "full" decodes whole batches, "sliced" one sample at a time,
+    # "tiled" one sample at a time in overlapping spatial tiles (lowest peak memory)
+    DECODE_MODE = "full"
+    DECODE_MODES = ("full", "sliced", "tiled")
+    DECODE_TILE_SIZE = 16     # Latent pixels per tile side (128 image pixels)
+    DECODE_TILE_OVERLAP = 4   # Latent pixels blended between neighbouring tiles
+    
+    # Latent decoders: "vae" is the full AutoencoderKL decoder, "tiny" a small
+    # distilled decoder (TAESD) loaded from a local weights file, several
+    # times cheaper and good enough for previews
+    DECODER = "vae"
+    DECODERS = ("vae", "tiny")
+    
+    # INT8 U-Net on CPU: "dynamic" quantizes the Linear layers, "static" the
+    # Conv2d and Linear layers with activation ranges calibrated on random latents
+    QUANTIZATION = "none"
+    QUANTIZATION_MODES = QUANTIZATION_MODES
+    CALIBRATION_BATCHES = 8
+    CALIBRATION_BATCH_SIZE = 2
+    
+    # Inference engine for the U-Net and VAE decoder: "eager" diffusers modules,
+    # or a "torchscript", "compile" (Inductor) or "onnx" (ONNX Runtime) graph
+    # exported at load time and cached next to the checkpoint
+    ENGINE = "eager"
+    ENGINES = ENGINES
+    
+    # Numerics and layout: "bf16" runs the U-Net and the decoders under bfloat16
+    # autocast (weights, latents, scheduler math and decoded images stay
+    # float32); "channels_last" keeps conv weights and activations in NHWC
+    PRECISION = "fp32"
+    PRECISIONS = ("fp32", "bf16")
+    MEMORY_FORMAT = "nchw"
+    MEMORY_FORMATS = ("nchw", "channels_last")
+    
+    # Output files: "png" (8-bit), "webp" (lossless WebP) or "png16" (16-bit
+    # PNG quantized from the decoder's float output, for research). Files are
+    # encoded on a thread pool, with small WebP previews for the display grid
+    IMAGE_FORMAT = "png"
+    IMAGE_FORMATS = ("png", "webp", "png16")
+    ENCODE_WORKERS = 4
+    THUMBNAIL_SIZE = 160  # Pixels per side
+    THUMBNAIL_QUALITY = 80  # Lossy WebP quality
+    
+    # What a generation keeps: decoded image files, or the denoised latents
+    # (float16, one file per session) that are decoded when first requested
+    STORAGE = "images"
+    STORAGE_MODES = ("images", "latents")
+    
+    # Class conditioning: a checkpoint whose U-Net has a class embedding table
+    # generates the class it is asked for, label i being CLASS_NAMES[i]. One
+    # extra embedding after the classes is the unconditional label learnt with
+    # label dropout, which enables classifier-free guidance: scales above 1
+    # push images towards their class at the cost of a second U-Net pass per
+    # step (1 runs the conditional prediction alone). Checkpoints without the
+    # table are unconditional and disease types only name the files
+    CLASS_NAMES = ("NORMAL", "PNEUMONIA", "TUBERCULOSIS")
+    GUIDANCE_SCALE = 1.0
+    MIN_GUIDANCE_SCALE = 0.0
+    MAX_GUIDANCE_SCALE = 20.0
+    
+    # Paths
+    CHECKPOINT_DIR = Path("./checkpoints")
+    TINY_DECODER_PATH = CHECKPOINT_DIR / "taesd_decoder.pth"
+    # Offline weight bundle (safetensors U-Net and VAE plus their configs),
+    # written by export_bundle.py and memory-mapped at startup
+    BUNDLE_DIR = CHECKPOINT_DIR / "bundle"
+    OUTPUT_DIR = Path("./static/generated")
+    
+    # Create output directory
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
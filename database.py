@@ -1,7 +1,8 @@
 """
-Database configuration and models for user authentication
+Database configuration and models for user authentication and generation history
 """
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
@@ -27,3 +28,95 @@ class User(db.Model):
     
     def __repr__(self):
         return f'<User {self.username}>'
+
+class GenerationRecord(db.Model):
+    """One generation request: who asked for what, where it is stored and how long it took"""
+    __tablename__ = 'generation_jobs'
+    __table_args__ = (
+        # Per-user history, newest first
+        db.Index('ix_generation_jobs_user_created', 'user_id', 'created_at'),
+        # Time-range queries across all users (capacity planning)
+        db.Index('ix_generation_jobs_created', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    endpoint = db.Column(db.String(20), nullable=False)  # generate, stream or job
+    status = db.Column(db.String(20), nullable=False)  # done or failed
+    error = db.Column(db.Text)
+    
+    # Request, with the sampler, steps and decoder actually used
+    disease = db.Column(db.String(40), nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    sampler = db.Column(db.String(20))
+    steps = db.Column(db.Integer)
+    decoder = db.Column(db.String(20))
+    seed = db.Column(db.BigInteger)
+    image_format = db.Column(db.String(20))
+    storage = db.Column(db.String(20))
+    
+    # Where the images are (folders are evicted after a while, see storage.py)
+    session_id = db.Column(db.String(64))
+    from_reservoir = db.Column(db.Integer, default=0)
+    from_cache = db.Column(db.Integer, default=0)
+    generated = db.Column(db.Integer, default=0)
+    
+    # Timings in seconds
+    queue_seconds = db.Column(db.Float, default=0.0)
+    duration_seconds = db.Column(db.Float)
+    
+    def to_dict(self):
+        """JSON-serializable record"""
+        return {
+            'id': self.id,
+            'created_at': self.created_at.isoformat() + 'Z',
+            'endpoint': self.endpoint,
+            'status': self.status,
+            'error': self.error,
+            'disease': self.disease,
+            'count': self.count,
+            'sampler': self.sampler,
+            'steps': self.steps,
+            'decoder': self.decoder,
+            'seed': self.seed,
+            'format': self.image_format,
+            'storage': self.storage,
+            'session_id': self.session_id,
+            'from_reservoir': self.from_reservoir,
+            'from_cache': self.from_cache,
+            'generated': self.generated,
+            'queue_seconds': self.queue_seconds,
+            'duration_seconds': self.duration_seconds,
+        }
+    
+    def __repr__(self):
+        return f'<GenerationRecord {self.id} {self.disease} x{self.count}>'
+
+def configure_sqlite(engine, busy_timeout_ms=5000):
+    """
+    Set up SQLite connections for concurrent access
+    
+    Write-ahead logging lets readers (history queries, logins) run while the
+    history writer inserts, and a busy timeout makes writers of several worker
+    processes wait for each other instead of failing with "database is locked".
+    Does nothing for other databases.
+    
+    Args:
+        engine: SQLAlchemy engine
+        busy_timeout_ms: Milliseconds a connection waits for a lock
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        # Safe with WAL: a crash can lose the last commits, never corrupt the file
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout_ms)}')
+        cursor.close()
+    
+    # Connections opened before the listener existed lack the pragmas
+    engine.dispose()
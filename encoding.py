@@ -0,0 +1,141 @@
+"""
+Image file encoding
+Writes generated images as PNG, lossless WebP or 16-bit PNG, plus small
+preview thumbnails, on a thread pool off the generation thread
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+from metrics import SAVE_SECONDS
+
+
+FILE_SUFFIXES = {"png": ".png", "webp": ".webp", "png16": ".png"}
+# Pixel depth the decoder has to produce for each format
+BIT_DEPTHS = {"png": 8, "webp": 8, "png16": 16}
+THUMBNAIL_DIR = "thumbs"
+
+
+def resolve_format(image_format):
+    """Return a validated image format name, falling back to Config.IMAGE_FORMAT"""
+    if image_format is None:
+        return Config.IMAGE_FORMAT
+    if image_format not in Config.IMAGE_FORMATS:
+        raise ValueError(
+            f"Unknown image format '{image_format}'. "
+            f"Choose from: {', '.join(Config.IMAGE_FORMATS)}"
+        )
+    return image_format
+
+
+def to_8bit(image):
+    """8-bit grayscale version of an 8- or 16-bit grayscale image"""
+    if image.mode == 'L':
+        return image
+    # v // 257 maps 0..65535 onto 0..255 exactly like the 8-bit quantization
+    pixels = np.asarray(image).astype(np.uint32) // 257
+    return Image.fromarray(pixels.astype(np.uint8))
+
+
+def thumbnail_path(path):
+    """Preview file belonging to a saved image: thumbs/<name>.webp next to it"""
+    path = Path(path)
+    return path.parent / THUMBNAIL_DIR / f"{path.stem}.webp"
+
+
+def _save(image, target, image_format):
+    """Write an image in a file format to a path or file object"""
+    if image_format == "png16":
+        if image.mode == 'L':
+            raise ValueError("16-bit PNG needs a 16-bit image (decode with bit_depth=16)")
+        image.save(target, format='PNG')
+    elif image_format == "webp":
+        to_8bit(image).save(target, format='WEBP', lossless=True)
+    else:
+        to_8bit(image).save(target, format='PNG')
+
+
+def _save_thumbnail(image, target):
+    """Write the lossy WebP preview of an image to a path or file object"""
+    preview = to_8bit(image).copy()  # thumbnail() resizes in place
+    preview.thumbnail((Config.THUMBNAIL_SIZE, Config.THUMBNAIL_SIZE), Image.BILINEAR)
+    preview.save(target, format='WEBP', quality=Config.THUMBNAIL_QUALITY)
+
+
+def encode_image(image, path, image_format, thumbnail=False):
+    """
+    Write one image file (and its thumbnail)
+
+    Args:
+        image: 8-bit ('L') or 16-bit ('I;16') grayscale PIL image
+        path: Output file path, including the format's suffix
+        image_format: One of Config.IMAGE_FORMATS
+        thumbnail: Also write a THUMBNAIL_SIZE lossy WebP preview
+
+    Returns:
+        The path, as a string
+    """
+    with SAVE_SECONDS.time():
+        _save(image, path, image_format)
+        if thumbnail:
+            preview_path = thumbnail_path(path)
+            preview_path.parent.mkdir(exist_ok=True)
+            _save_thumbnail(image, preview_path)
+    return str(path)
+
+
+def encode_bytes(image, image_format, thumbnail=False):
+    """
+    Encode one image in memory, for files that are served without being stored
+
+    Args:
+        image: 8-bit ('L') or 16-bit ('I;16') grayscale PIL image
+        image_format: One of Config.IMAGE_FORMATS
+        thumbnail: Encode the WebP preview instead of the full image
+
+    Returns:
+        The file contents
+    """
+    buffer = BytesIO()
+    with SAVE_SECONDS.time():
+        if thumbnail:
+            _save_thumbnail(image, buffer)
+        else:
+            _save(image, buffer, image_format)
+    return buffer.getvalue()
+
+
+class ImageEncoder:
+    """
+    Thread pool writing image files
+
+    PIL releases the GIL while compressing, so several images are encoded at
+    once, and generation continues while the files of earlier images are
+    written.
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        Args:
+            max_workers: Encoding threads. Uses Config.ENCODE_WORKERS if None
+        """
+        # Threads start on the first submit, so creating the pool before a
+        # fork is safe
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or Config.ENCODE_WORKERS,
+            thread_name_prefix='image-encoder'
+        )
+
+    def submit(self, image, path, image_format, thumbnail=False):
+        """
+        Queue an encode_image call
+
+        Returns:
+            Future resolving to the written path
+        """
+        return self._executor.submit(encode_image, image, path, image_format, thumbnail)
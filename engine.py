@@ -0,0 +1,222 @@
+"""
+Exported-graph inference engines
+Runs the U-Net and VAE decoder through TorchScript, torch.compile or ONNX Runtime
+graphs instead of eager diffusers code, falling back to eager on any failure
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+
+from config import ENGINES
+
+
+class UNetForward(nn.Module):
+    """U-Net forward returning the noise prediction tensor (exportable signature)"""
+
+    def __init__(self, unet):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, sample, timestep, class_labels=None):
+        # Samplers pass integer (DDPM, DDIM) or float (Euler) timesteps; one
+        # dtype keeps a single graph valid for all of them
+        timestep = timestep.to(torch.float32)
+        # class_labels: one int64 label per sample, for class-conditional U-Nets
+        return self.unet(sample, timestep, class_labels, return_dict=False)[0]
+
+
+class VAEDecode(nn.Module):
+    """VAE decoder forward returning the image tensor (exportable signature)"""
+
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, latents):
+        return self.vae.decode(latents, return_dict=False)[0]
+
+
+class InferenceEngine:
+    """
+    Runs a module, eagerly in this base class
+
+    Subclasses run an exported graph of the module. If building the graph
+    fails, build_engine returns this eager engine instead; if the graph fails
+    at run time (e.g. an unsupported input shape), the engine switches to eager
+    for good and logs why.
+    """
+
+    name = "eager"
+
+    def __init__(self, module):
+        """
+        Args:
+            module: Eager module (UNetForward or VAEDecode) used as the fallback
+        """
+        self.module = module
+        self.failed = False
+
+    @property
+    def active(self):
+        """Name of the engine actually running the forward passes"""
+        return "eager" if self.failed else self.name
+
+    def build(self, example_inputs, artifact_path=None):
+        """Export the module; raises if the backend cannot handle it"""
+
+    def __call__(self, *inputs):
+        if not self.failed:
+            try:
+                return self._run(*inputs)
+            except Exception as e:
+                print(f"{self.name} engine failed ({e}), falling back to eager")
+                self.failed = True
+        return self.module(*inputs)
+
+    def _run(self, *inputs):
+        return self.module(*inputs)
+
+
+class TorchScriptEngine(InferenceEngine):
+    """Traced and frozen TorchScript graph, saved as a .pt artifact"""
+
+    name = "torchscript"
+    suffix = ".ts.pt"
+
+    def build(self, example_inputs, artifact_path=None):
+        if artifact_path is not None and artifact_path.exists():
+            self.graph = torch.jit.load(str(artifact_path), map_location=example_inputs[0].device)
+            return
+
+        with torch.no_grad():
+            graph = torch.jit.trace(self.module, example_inputs, check_trace=False)
+            graph = torch.jit.freeze(graph.eval())
+        if artifact_path is not None:
+            torch.jit.save(graph, str(artifact_path))
+        self.graph = graph
+
+    def _run(self, *inputs):
+        return self.graph(*inputs)
+
+
+class CompileEngine(InferenceEngine):
+    """
+    torch.compile (Inductor) graph
+
+    The compiled kernels are cached by Inductor's own on-disk cache; build
+    points it next to the checkpoint so restarts skip most of the compilation.
+    """
+
+    name = "compile"
+    suffix = ".inductor"
+
+    def build(self, example_inputs, artifact_path=None):
+        if artifact_path is not None:
+            artifact_path.mkdir(parents=True, exist_ok=True)
+            # Read by Inductor at compile time; an explicitly configured
+            # cache directory wins
+            os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', str(artifact_path))
+
+        self.graph = torch.compile(self.module, dynamic=True)
+        # Compile now rather than on the first request
+        with torch.no_grad():
+            self.graph(*example_inputs)
+
+    def _run(self, *inputs):
+        return self.graph(*inputs)
+
+
+class OnnxEngine(InferenceEngine):
+    """ONNX graph run by ONNX Runtime on the CPU, saved as a .onnx artifact"""
+
+    name = "onnx"
+    suffix = ".onnx"
+
+    def build(self, example_inputs, artifact_path=None):
+        # Optional dependency: only needed for this engine
+        import onnxruntime
+
+        if example_inputs[0].device.type != 'cpu':
+            raise ValueError("The ONNX engine runs on the CPU only")
+
+        input_names = [f"input_{index}" for index in range(len(example_inputs))]
+        if artifact_path is None or not artifact_path.exists():
+            if artifact_path is None:
+                artifact_path = Path(tempfile.mkdtemp()) / f"model{self.suffix}"
+            # Batch and spatial sizes stay dynamic (tiled decoding uses smaller
+            # inputs); so does the length of the per-sample class labels
+            dynamic_axes = {}
+            for name, tensor in zip(input_names, example_inputs):
+                if tensor.dim() == 4:
+                    dynamic_axes[name] = {0: 'batch', 2: 'height', 3: 'width'}
+                elif tensor.dim() == 1:
+                    dynamic_axes[name] = {0: 'batch'}
+            dynamic_axes['output'] = {0: 'batch', 2: 'height', 3: 'width'}
+            with torch.no_grad():
+                torch.onnx.export(
+                    self.module, example_inputs, str(artifact_path),
+                    input_names=input_names,
+                    output_names=['output'],
+                    dynamic_axes=dynamic_axes,
+                    opset_version=17,
+                    dynamo=False
+                )
+
+        self.session = onnxruntime.InferenceSession(
+            str(artifact_path), providers=['CPUExecutionProvider']
+        )
+        self.input_names = input_names
+
+    def _run(self, *inputs):
+        # Float inputs are float32 only (UNetForward casts the timestep);
+        # class labels stay int64
+        feed = {
+            name: (tensor.detach().to(torch.float32) if tensor.is_floating_point()
+                   else tensor.detach()).cpu().numpy()
+            for name, tensor in zip(self.input_names, inputs)
+        }
+        output = self.session.run(None, feed)[0]
+        return torch.from_numpy(output).to(inputs[0].device)
+
+
+ENGINE_CLASSES = {
+    "eager": InferenceEngine,
+    "torchscript": TorchScriptEngine,
+    "compile": CompileEngine,
+    "onnx": OnnxEngine,
+}
+
+
+def build_engine(name, module, example_inputs, artifact_path=None):
+    """
+    Export a module with the given engine, falling back to eager on failure
+
+    Args:
+        name: One of ENGINES
+        module: UNetForward or VAEDecode module in eval mode
+        example_inputs: Tuple of example input tensors used for tracing/export
+        artifact_path: Where to cache the exported graph (without the engine's
+            suffix). Not cached if None
+
+    Returns:
+        An InferenceEngine (the eager base class if the export failed)
+    """
+    if name not in ENGINE_CLASSES:
+        raise ValueError(f"Unknown engine '{name}'. Choose from: {', '.join(ENGINES)}")
+
+    engine = ENGINE_CLASSES[name](module)
+    if name == "eager":
+        return engine
+
+    if artifact_path is not None:
+        artifact_path = Path(f"{artifact_path}{engine.suffix}")
+    try:
+        engine.build(example_inputs, artifact_path)
+    except Exception as e:
+        print(f"Could not build the {name} engine ({e}), using eager")
+        return InferenceEngine(module)
+    return engine
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Offline weight bundle export
+Writes the trained U-Net and the VAE as memory-mappable safetensors files plus
+their configs, so the server starts without the hub or the .pth checkpoint.
+
+Usage:
+    python export_bundle.py                          # checkpoint + hub VAE -> checkpoints/bundle
+    python export_bundle.py --output /models/bundle  # then run the server with MODEL_BUNDLE=/models/bundle
+    python export_bundle.py --random-weights         # no checkpoint or VAE download
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from config import Config
+
+
+def print_header(text):
+    """Print a formatted header"""
+    print("\n" + "="*60)
+    print(f"  {text}")
+    print("="*60)
+
+
+def main():
+    """Export the bundle and time loading it back"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--model', type=Path, default=Config.CHECKPOINT_DIR / 'final_unet_model.pth')
+    parser.add_argument('--output', type=Path, default=Config.BUNDLE_DIR)
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Use random U-Net and VAE weights instead of the checkpoint')
+    args = parser.parse_args()
+
+    if not args.random_weights and not args.model.exists():
+        print(f"✗ Checkpoint not found: {args.model}")
+        return 1
+
+    from model_inference import MedicalImageGenerator
+
+    print_header("EXPORT")
+    start = time.perf_counter()
+    generator = MedicalImageGenerator(
+        model_path=None if args.random_weights else args.model,
+        device='cpu',
+        pretrained_vae=not args.random_weights
+    )
+    load_seconds = time.perf_counter() - start
+    generator.export_bundle(args.output)
+
+    print_header("BUNDLE LOAD")
+    start = time.perf_counter()
+    bundled = MedicalImageGenerator(device='cpu', bundle_path=args.output)
+    bundle_seconds = time.perf_counter() - start
+
+    print(f"\nCheckpoint load: {load_seconds:.2f}s")
+    print(f"Bundle load:     {bundle_seconds:.2f}s")
+    print(f"✓ Bundle written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,46 @@
+"""
+Gunicorn configuration
+Builds the model once in the master process before forking; forked workers
+share its weights copy-on-write, so resident memory stays close to one model
+for any worker count.
+
+Workers are interchangeable: generation jobs are shared through the job
+files in JOB_STATE_DIR (instance/jobs by default), so a job submitted to one
+worker can be polled and streamed through any other. Requests are only
+co-batched with requests of the same worker, each worker keeps its own image
+reservoir and decoded-image cache, and /metrics reports the worker that
+served the scrape (every series carries its pid label).
+
+Usage:
+    gunicorn -c gunicorn.conf.py server:app
+"""
+
+import os
+
+# Import server.py (and with PRELOAD_MODEL=1 the model) before forking
+preload_app = True
+
+bind = os.getenv('BIND', '127.0.0.1:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('WORKER_THREADS', '4'))
+
+# Generation requests can run for minutes on CPU
+timeout = int(os.getenv('WORKER_TIMEOUT', '600'))
+
+os.environ.setdefault('PRELOAD_MODEL', '1')
+
+
+def post_fork(server, worker):
+    """Per-worker setup after the fork"""
+    from server import app, db
+
+    # Do not reuse database connections opened by the master
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    # Split the cores between workers instead of every worker using all of them
+    try:
+        import torch
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    except ImportError:
+        pass
@@ -0,0 +1,156 @@
+"""
+Generation history writer
+Collects one record per generation request and inserts them into the
+database in batches on a background thread, off the request path
+"""
+
+import atexit
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import insert
+
+
+class HistoryWriter:
+    """
+    Batched, asynchronous inserts of generation records
+
+    Requests only append a dict to an in-memory queue. A background thread
+    inserts the queued records in one statement and one transaction per
+    batch, once batch_size records are waiting or flush_seconds after the
+    oldest one arrived, so a busy server does one write per batch instead of
+    one per request. If the database is unavailable, records are kept and
+    retried; beyond max_pending the oldest are dropped (history is an audit
+    trail, not worth failing or slowing generations for). Records still
+    queued when the process exits are written by an exit handler.
+    """
+
+    def __init__(self, app, db, model, batch_size=50, flush_seconds=2.0, max_pending=10000,
+                 retry_seconds=5.0):
+        """
+        Initialize the writer (the thread starts on the first record)
+
+        Args:
+            app: Flask app, for the application context of the inserts
+            db: Flask-SQLAlchemy instance
+            model: Model class of the records (see database.GenerationRecord)
+            batch_size: Records inserted per statement
+            flush_seconds: Longest time a record waits to be written
+            max_pending: Records kept while the database is unavailable
+            retry_seconds: Pause after a failed insert
+        """
+        self.app = app
+        self.db = db
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.retry_seconds = retry_seconds
+
+        self._pending = deque()
+        self._oldest = None  # Arrival time of the oldest queued record
+        self._counts = {'written': 0, 'dropped': 0, 'failed_batches': 0}
+        self._changed = threading.Condition()
+        self._thread = None
+        # Once per writer: the thread is restarted after a fork, the hook is not
+        atexit.register(self.flush)
+
+    def add(self, record):
+        """
+        Queue one record
+
+        Args:
+            record: Dict of column values of the model
+        """
+        with self._changed:
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(record)
+            while len(self._pending) > self.max_pending:
+                self._pending.popleft()
+                self._counts['dropped'] += 1
+            # Wake the writer to time the first record, or to write a full batch
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._changed.notify()
+        self.start()
+
+    def start(self):
+        """Start the background writer (idempotent)"""
+        with self._changed:
+            # Started lazily so the thread lives in the process that serves
+            # requests (threads do not survive a fork)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._worker, name='history-writer', daemon=True
+                )
+                self._thread.start()
+
+    def flush(self):
+        """
+        Write every queued record now, on the calling thread
+
+        Returns:
+            Number of records written
+        """
+        written = 0
+        while True:
+            batch = self._take(wait=False)
+            if not batch:
+                return written
+            if not self._write(batch):
+                return written
+            written += len(batch)
+
+    def stats(self):
+        """Queued records and totals written, dropped and failed"""
+        with self._changed:
+            return {'pending': len(self._pending), **self._counts}
+
+    def _worker(self):
+        while True:
+            batch = self._take(wait=True)
+            if batch and not self._write(batch):
+                time.sleep(self.retry_seconds)
+
+    def _take(self, wait):
+        """Remove and return the next batch, waiting until one is due if wait is set"""
+        with self._changed:
+            if wait:
+                while True:
+                    if len(self._pending) >= self.batch_size:
+                        break
+                    if self._pending:
+                        remaining = self._oldest + self.flush_seconds - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._changed.wait(remaining)
+                    else:
+                        self._changed.wait()
+            count = min(len(self._pending), self.batch_size)
+            batch = [self._pending.popleft() for _ in range(count)]
+            # The rest is written at most flush_seconds from now
+            if self._pending:
+                self._oldest = time.monotonic()
+            return batch
+
+    def _write(self, batch):
+        """Insert a batch in one transaction; on failure, put it back in the queue"""
+        try:
+            with self.app.app_context():
+                self.db.session.execute(insert(self.model), batch)
+                self.db.session.commit()
+        except Exception as e:
+            print(f"History write of {len(batch)} record(s) failed: {e}")
+            with self._changed:
+                self._counts['failed_batches'] += 1
+                if not self._pending:
+                    self._oldest = time.monotonic()
+                self._pending.extendleft(reversed(batch))
+                while len(self._pending) > self.max_pending:
+                    self._pending.popleft()
+                    self._counts['dropped'] += 1
+            return False
+        with self._changed:
+            self._counts['written'] += len(batch)
+        return True
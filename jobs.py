@@ -0,0 +1,309 @@
+"""
+Background generation jobs
+Runs image generation off the request thread and tracks per-job progress,
+shared with the other worker processes through a directory of job files
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class GenerationJob:
+    """A single generation request with its status, progress and result"""
+
+    def __init__(self, options, owner=None, store=None):
+        """
+        Create a queued job
+
+        Args:
+            options: Validated generation options (see server.parse_generation_request)
+            owner: Id of the user who submitted the job, if any
+            store: Optional JobStore receiving a snapshot on every change
+        """
+        self.id = uuid.uuid4().hex
+        self.options = options
+        self.owner = owner
+        self.status = 'queued'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.store = store
+
+        # Bumped on every change so streaming clients can wait for updates
+        self.version = 0
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def update(self, **fields):
+        """Set job fields and wake up anyone waiting for a change"""
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            # Saved under the lock, so the file never goes back to an older version
+            if self.store is not None:
+                self.store.save(self)
+            self._changed.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        """
+        Block until the job changes past the given version
+
+        Args:
+            version: Last version seen by the caller
+            timeout: Seconds to wait before giving up
+
+        Returns:
+            The current version (unchanged if the wait timed out)
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def to_dict(self):
+        """JSON-serializable snapshot of the job"""
+        with self._changed:
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'progress': dict(self.progress),
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'version': self.version,
+            }
+
+
+class JobStore:
+    """
+    Job snapshots as JSON files in a directory shared by the worker processes
+
+    The worker running a job rewrites its file on every change (atomically,
+    so readers never see a partial file); any other worker answers status
+    and event requests for the job from that file.
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+            root: Directory of the job files (created if missing)
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, job_id):
+        return self.root / f"{job_id}.json"
+
+    def save(self, job):
+        """Write the current snapshot of a job"""
+        data = json.dumps({'owner': job.owner, **job.to_dict()})
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(job.id))
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def load(self, job_id):
+        """Snapshot of a job (with its owner), or None if there is none"""
+        # Ids come from URLs: only ever open files this store wrote
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            return json.loads(self._path(job_id).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def delete(self, job_id):
+        self._path(job_id).unlink(missing_ok=True)
+
+    def prune(self, max_age):
+        """Delete job files not changed for max_age seconds (also of exited workers)"""
+        cutoff = time.time() - max_age
+        for path in self.root.glob('*.json'):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+            except FileNotFoundError:
+                continue  # Pruned by another worker meanwhile
+
+
+class StoredJob:
+    """Read-only view of a job running in another worker process, read from its JobStore file"""
+
+    def __init__(self, store, snapshot, poll_seconds=0.5):
+        """
+        Args:
+            store: JobStore holding the job file
+            snapshot: Snapshot loaded from the store
+            poll_seconds: Interval of file reads while waiting for a change
+        """
+        self.store = store
+        self.snapshot = snapshot
+        self.poll_seconds = poll_seconds
+
+    @property
+    def id(self):
+        return self.snapshot['job_id']
+
+    @property
+    def owner(self):
+        return self.snapshot['owner']
+
+    @property
+    def status(self):
+        return self.snapshot['status']
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def wait_for_change(self, version, timeout=None):
+        """Poll the job file until the job changes past the given version (see GenerationJob)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.store.load(self.id)
+            if snapshot is not None:
+                self.snapshot = snapshot
+            if self.snapshot['version'] != version:
+                return self.snapshot['version']
+            delay = self.poll_seconds
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return version
+                delay = min(delay, remaining)
+            time.sleep(delay)
+
+    def to_dict(self):
+        """JSON-serializable snapshot of the job, as GenerationJob.to_dict"""
+        return {name: value for name, value in self.snapshot.items() if name != 'owner'}
+
+
+class JobManager:
+    """
+    Runs generation jobs on a background executor and keeps recent jobs
+
+    Jobs run in the process that accepted them. With a store, every other
+    process sharing its directory can report their status and progress too,
+    so gunicorn workers are interchangeable for the job routes.
+    """
+
+    def __init__(self, max_workers=4, max_jobs=200, job_ttl=3600, store=None):
+        """
+        Initialize the job manager
+
+        Args:
+            max_workers: Number of jobs running concurrently. With the batch
+                scheduler, the jobs that start within its window (BATCH_WINDOW_MS)
+                share one U-Net run, so at most max_workers jobs are co-batched
+                and 1 batches nothing; without it, concurrent jobs compete for
+                the CPU cores
+            max_jobs: Maximum number of jobs kept for status queries
+            job_ttl: Seconds a finished job stays queryable
+            store: Optional JobStore sharing the jobs with other processes
+        """
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.job_ttl = job_ttl
+        self.store = store
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # ThreadPoolExecutor starts its threads on first submit, so creating the
+        # manager at import time is safe even if the process forks afterwards
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='generation-job'
+        )
+
+    def submit(self, run, options, owner=None):
+        """
+        Queue a job
+
+        Args:
+            run: Callable run(options, progress_callback) returning the job result
+            options: Validated generation options
+            owner: Id of the submitting user, if any
+
+        Returns:
+            The queued GenerationJob
+        """
+        job = GenerationJob(options, owner=owner, store=self.store)
+        if self.store is not None:
+            self.store.save(job)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def get(self, job_id):
+        """Return the job with this id (a StoredJob if another process runs it), or None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            snapshot = self.store.load(job_id)
+            if snapshot is not None:
+                job = StoredJob(self.store, snapshot)
+        return job
+
+    def pending_count(self):
+        """Number of jobs that are queued or running"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _run(self, job, run):
+        """Execute a job on the executor thread"""
+        job.update(status='running', started_at=time.time())
+
+        def progress_callback(progress):
+            job.update(progress=progress)
+
+        try:
+            result = run(job.options, progress_callback)
+            job.update(status='done', result=result, finished_at=time.time())
+        except Exception as e:
+            print(f"Generation job {job.id} failed: {e}")
+            traceback.print_exc()
+            job.update(status='failed', error=str(e), finished_at=time.time())
+
+    def _prune(self):
+        """Drop expired finished jobs and cap the number of kept jobs"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > self.job_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if self.store is not None:
+            self.store.prune(self.job_ttl)
+
+        # Dicts keep insertion order, so the oldest finished jobs go first
+        overflow = len(self._jobs) - self.max_jobs + 1
+        if overflow > 0:
+            finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+            for job_id in finished[:overflow]:
+                del self._jobs[job_id]
+                if self.store is not None:
+                    self.store.delete(job_id)
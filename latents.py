@@ -0,0 +1,141 @@
+"""
+Latent storage
+Keeps the denoised latents of a session in one compact array file, to be
+decoded to images only when they are requested, and caches decoded files
+"""
+
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from encoding import FILE_SUFFIXES, resolve_format
+
+
+LATENT_FILE = "latents.npz"
+
+
+def save_latents(save_path, latents, indices, metadata):
+    """
+    Write (or rewrite) the latent file of a session
+
+    The file is replaced atomically, so it can be rewritten as more images
+    are denoised while readers decode the ones already stored.
+
+    Args:
+        save_path: Session folder
+        latents: Array or tensor of shape (N, C, H, W), stored as float16
+        indices: Position of every latent in its request
+        metadata: JSON-serializable dict of what decoding needs (decoder,
+            format, disease, ...)
+
+    Returns:
+        Path of the latent file
+    """
+    save_path = Path(save_path)
+    save_path.mkdir(parents=True, exist_ok=True)
+    path = save_path / LATENT_FILE
+
+    fd, tmp_path = tempfile.mkstemp(dir=save_path, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(
+                f,
+                latents=np.asarray(latents, dtype=np.float16),
+                indices=np.asarray(indices, dtype=np.int32),
+                metadata=np.array(json.dumps(metadata))
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+    return path
+
+
+def load_latents(save_path):
+    """
+    Read the latent file of a session
+
+    Args:
+        save_path: Session folder
+
+    Returns:
+        Tuple of (dict mapping request position to a float32 latent of shape
+        (C, H, W), metadata dict), or None if the session has no latent file
+    """
+    try:
+        with np.load(Path(save_path) / LATENT_FILE) as data:
+            latents = data['latents'].astype(np.float32)
+            indices = data['indices'].tolist()
+            metadata = json.loads(str(data['metadata']))
+    except FileNotFoundError:
+        return None
+    return dict(zip(indices, latents)), metadata
+
+
+def latent_file_name(metadata, index):
+    """
+    File name of the image a stored latent decodes to
+
+    Args:
+        metadata: Metadata of the latent file. Its disease is one class for
+            every image, or a list with the class of every request position
+        index: Request position of the latent
+
+    Returns:
+        The name the image file would have had, e.g. "normal_1.png"
+    """
+    disease = metadata['disease']
+    if isinstance(disease, list):
+        disease = disease[index]
+    suffix = FILE_SUFFIXES[resolve_format(metadata['format'])]
+    return f"{disease.lower()}_{index + 1}{suffix}"
+
+
+class DecodedCache:
+    """
+    In-memory LRU cache of files decoded from stored latents, bounded in bytes
+
+    Keys are (session id, file name); values are the encoded file contents.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20):
+        """
+        Args:
+            max_bytes: Total size of the cached files
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached file contents, or None on a miss"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        """Store file contents, evicting the least recently used files if full"""
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {'files': len(self._entries), 'bytes': self._size,
+                    'max_bytes': self.max_bytes}
@@ -0,0 +1,278 @@
+"""
+Prometheus metrics
+Counters, gauges and latency histograms for the generation pipeline, rendered
+in the Prometheus text exposition format by the /metrics route
+
+Metrics live in the memory of the process that records them and are not
+aggregated across gunicorn workers. Every series carries a pid label and
+process_start_time_seconds marks restarts, so series of different workers
+never mix into one counter that jumps back and forth. A scrape only sees the
+worker that answers it, so exact totals and rates need WEB_CONCURRENCY=1.
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds in seconds: a PNG save takes milliseconds, a CPU generation minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    """Escape a label value for the text format"""
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """Base class: a named metric with one series per label combination"""
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        """
+        Create and register a metric
+
+        Args:
+            name: Metric name (without the registry prefix)
+            documentation: HELP text
+            labelnames: Names of the labels every observation must provide
+            registry: Registry rendering the metric. Uses REGISTRY if None
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} takes labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self, prefix):
+        """(name, labels, value) tuples of every series"""
+        raise NotImplementedError
+
+    def render(self, prefix, const_labels=()):
+        """Text format lines of this metric, with const_labels added to every series"""
+        lines = [
+            f"# HELP {prefix}{self.name} {self.documentation}",
+            f"# TYPE {prefix}{self.name} {self.type}",
+        ]
+        for name, labels, value in self.samples(prefix):
+            labels = tuple(const_labels) + tuple(labels)
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Add amount (>= 0) to the series of these labels"""
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def samples(self, prefix):
+        with self._lock:
+            return [(f"{prefix}{self.name}_total", key, value)
+                    for key, value in self._series.items()]
+
+
+class Gauge(Metric):
+    """Value that goes up and down, set directly or read from a callback at scrape time"""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._callback = None
+
+    def set(self, value, **labels):
+        """Set the series of these labels"""
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def set_function(self, callback):
+        """
+        Read the gauge from a callable on every scrape
+
+        Args:
+            callback: Returns a number (unlabelled gauge) or a dict mapping
+                label value tuples to numbers
+        """
+        self._callback = callback
+
+    def samples(self, prefix):
+        if self._callback is not None:
+            values = self._callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [(f"{prefix}{self.name}", tuple(zip(self.labelnames, key)), value)
+                    for key, value in values.items() if value is not None]
+        with self._lock:
+            return [(f"{prefix}{self.name}", key, value) for key, value in self._series.items()]
+
+
+class Histogram(Metric):
+    """Distribution of observed values (latencies) in cumulative buckets"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None,
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """Record one observation in the series of these labels"""
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Context manager observing the wall time of its block, also if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self, prefix):
+        name = f"{prefix}{self.name}"
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f"{name}_bucket", key + (('le', bound),), cumulative))
+                samples.append((f"{name}_bucket", key + (('le', '+Inf'),), count))
+                samples.append((f"{name}_sum", key, total))
+                samples.append((f"{name}_count", key, count))
+        return samples
+
+
+class Registry:
+    """Set of metrics rendered together"""
+
+    def __init__(self, prefix='', const_labels=None):
+        """
+        Args:
+            prefix: Prepended to every metric name
+            const_labels: Callable returning (name, value) label pairs added to
+                every series, evaluated on each render
+        """
+        self.prefix = prefix
+        self.const_labels = const_labels
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        const_labels = self.const_labels() if self.const_labels else ()
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(self.prefix, const_labels))
+        return '\n'.join(lines) + '\n'
+
+
+# The pid is read on every render: workers fork after this module is imported
+REGISTRY = Registry(prefix='rdmid_', const_labels=lambda: (('pid', os.getpid()),))
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+PROCESS_START_TIME = Gauge(
+    'process_start_time_seconds', 'Start time of the process serving the scrape, in Unix seconds'
+)
+_process_start = {'time': time.time()}
+# A forked worker reports its own start, not the master's
+os.register_at_fork(after_in_child=lambda: _process_start.update(time=time.time()))
+PROCESS_START_TIME.set_function(lambda: _process_start['time'])
+
+# Pipeline metrics
+MODEL_LOAD_SECONDS = Gauge(
+    'model_load_seconds', 'Duration of each model load phase', ['phase']
+)
+DENOISE_SECONDS = Histogram(
+    'denoise_seconds', 'Duration of one denoising run (one U-Net batch, all steps)', ['scheduler']
+)
+DENOISE_BATCH_SIZE = Histogram(
+    'denoise_batch_size', 'Latents per denoising run', buckets=(1, 2, 4, 8, 16, 32)
+)
+DECODE_SECONDS = Histogram(
+    'decode_seconds', 'Duration of decoding the latents of one denoising run to images', ['decoder']
+)
+SAVE_SECONDS = Histogram(
+    'image_save_seconds', 'Duration of encoding and writing one image file'
+)
+ZIP_SECONDS = Histogram(
+    'zip_seconds', 'Duration of streaming a download archive'
+)
+CHAT_SECONDS = Histogram(
+    'chat_seconds', 'Duration of a Gemini chat call', ['outcome']
+)
+CHAT_FIRST_TOKEN_SECONDS = Histogram(
+    'chat_first_token_seconds', 'Time until the first piece of a streamed chat answer'
+)
+GENERATION_SECONDS = Histogram(
+    'generation_seconds', 'Duration of a generation request until its last image is saved'
+)
+IMAGES = Counter(
+    'images', 'Images served, by where they came from', ['source']
+)
+CACHE_LOOKUPS = Counter(
+    'cache_lookups', 'Generation cache lookups', ['result']
+)
+QUEUE_DEPTH = Gauge(
+    'queue_depth', 'Work waiting to run: queued or running jobs, unscheduled batch latents',
+    ['queue']
+)
+RESERVOIR_IMAGES = Gauge(
+    'reservoir_images', 'Pre-generated images ready per class', ['disease']
+)
+CACHE_BYTES = Gauge(
+    'cache_bytes', 'Size of the generation cache'
+)
+STORAGE_BYTES = Gauge(
+    'storage_bytes', 'Size of the finished generated image sessions'
+)
+HISTORY_PENDING = Gauge(
+    'history_pending', 'Generation history records waiting to be written'
+)
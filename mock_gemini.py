@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Local Gemini stand-in
+Answers generateContent and streamGenerateContent requests with canned text,
+so the chat can be developed and load-tested without an API key or network
+access. Latency and failures (also mid-stream) can be injected to exercise
+the client's caching, coalescing, retries and streaming fallback.
+
+Usage:
+    python mock_gemini.py --port 8765 --delay 0.5 --chunk-delay 0.05
+    GEMINI_BASE_URL=http://127.0.0.1:8765/v1beta python server.py
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PATH_PATTERN = re.compile(
+    r'^/v1beta/models/(?P<model>[^/:]+):(?P<method>generateContent|streamGenerateContent)'
+    r'(\?alt=sse)?$'
+)
+WORDS_PER_CHUNK = 4
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    """Handles POST /v1beta/models/<model>:generateContent and :streamGenerateContent?alt=sse"""
+
+    # Keep-alive, so the client's connection pool is exercised too
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        match = PATH_PATTERN.match(self.path)
+        if match is None:
+            self._reply(404, {'error': {'code': 404, 'message': f'Unknown path {self.path}'}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length))
+            prompt = payload['contents'][0]['parts'][0]['text']
+        except (ValueError, KeyError, IndexError):
+            self._reply(400, {'error': {'code': 400, 'message': 'Malformed request'}})
+            return
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        time.sleep(server.delay)
+        if random.random() < server.fail_rate:
+            self._reply(503, {'error': {'code': 503, 'message': 'Injected failure'}},
+                        headers={'Retry-After': '0'})
+            return
+
+        # Echo the question so callers can tell answers apart
+        question = prompt.rsplit('User question:', 1)[-1].replace('Assistant:', '').strip()
+        text = (f"This is a mock answer from {match.group('model')} about: {question}\n\n"
+                "Key points:\n* Consult a medical professional\n* This text is canned")
+        if match.group('method') == 'generateContent':
+            self._reply(200, self._chunk(text, 'STOP'))
+        else:
+            self._stream(text)
+
+    @staticmethod
+    def _chunk(text, finish_reason=None):
+        candidate = {'content': {'parts': [{'text': text}], 'role': 'model'}}
+        if finish_reason:
+            candidate['finishReason'] = finish_reason
+        return {'candidates': [candidate]}
+
+    def _stream(self, text):
+        """Send the answer a few words per server-sent event, like alt=sse"""
+        words = text.split(' ')
+        pieces = [' '.join(words[i:i + WORDS_PER_CHUNK]) + ' '
+                  for i in range(0, len(words), WORDS_PER_CHUNK)]
+        pieces[-1] = pieces[-1].rstrip(' ')
+        # One HTTP chunk per event, so the client can read each as it is sent
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        fail_at = None
+        if random.random() < self.server.stream_fail_rate:
+            fail_at = len(pieces) // 2
+        for index, piece in enumerate(pieces):
+            if index == fail_at:
+                # Drop the connection mid-answer, without the final chunk
+                self.close_connection = True
+                return
+            last = index == len(pieces) - 1
+            chunk = self._chunk(piece, 'STOP' if last else None)
+            event = f"data: {json.dumps(chunk)}\r\n\r\n".encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+            self.wfile.flush()
+            if not last:
+                time.sleep(self.server.chunk_delay)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(host='127.0.0.1', port=8765, delay=0.0, fail_rate=0.0, chunk_delay=0.0,
+                stream_fail_rate=0.0, quiet=False):
+    """
+    Create the stand-in server (not started)
+
+    Args:
+        host: Interface to listen on
+        port: Port to listen on (0 picks a free one)
+        delay: Seconds before an answer (or its first streamed chunk)
+        fail_rate: Share of requests answered with 503
+        chunk_delay: Seconds between two streamed chunks
+        stream_fail_rate: Share of streams cut off halfway
+        quiet: Do not log requests
+
+    Returns:
+        ThreadingHTTPServer; its requests attribute counts the questions received
+    """
+    server = ThreadingHTTPServer((host, port), MockGeminiHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.fail_rate = fail_rate
+    server.chunk_delay = chunk_delay
+    server.stream_fail_rate = stream_fail_rate
+    server.quiet = quiet
+    server.requests = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def main():
+    """Run the stand-in server until interrupted"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds per answer')
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help='Share of requests failing with 503 (0.2 = 20%%)')
+    parser.add_argument('--chunk-delay', type=float, default=0.05,
+                        help='Seconds between streamed chunks')
+    parser.add_argument('--stream-fail-rate', type=float, default=0.0,
+                        help='Share of streams cut off halfway')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.delay, args.fail_rate,
+                         args.chunk_delay, args.stream_fail_rate, args.quiet)
+    host, port = server.server_address[:2]
+    print(f"Mock Gemini API on http://{host}:{port}/v1beta "
+          f"(delay {args.delay}s, fail rate {args.fail_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,103 +7,823 @@ import torch
 import torch.nn.functional as F
 from PIL import Image
 import numpy as np
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from diffusers import AutoencoderKL, DDPMScheduler, UNet2DModel
+from diffusers import (
+    AutoencoderKL,
+    AutoencoderTiny,
+    DDIMScheduler,
+    DDPMScheduler,
+    DPMSolverMultistepScheduler,
+    EulerDiscreteScheduler,
+    UNet2DModel,
+)
+from diffusers.utils.torch_utils import randn_tensor
+from config import Config
+from quantization import quantize_unet
+from engine import InferenceEngine, UNetForward, VAEDecode, build_engine
+from metrics import DECODE_SECONDS, DENOISE_BATCH_SIZE, DENOISE_SECONDS
+from encoding import BIT_DEPTHS, FILE_SUFFIXES, ImageEncoder, encode_image, resolve_format
+from latents import load_latents, save_latents
 from tqdm import tqdm
 import warnings
 warnings.filterwarnings('ignore')
 
 
-class Config:
-    """Configuration for the latent diffusion model"""
-    # Model Parameters
-    VAE_MODEL = "stabilityai/sd-vae-ft-mse"
-    VAE_SCALE_FACTOR = 0.18215
-    LATENT_SIZE = 32  # 256 // 8
-    LATENT_CHANNELS = 4
-    IMAGE_SIZE = 256
-    
-    # Inference Parameters
-    TIMESTEPS = 1000
-    NUM_INFERENCE_STEPS = 50  # Fewer steps for faster generation
-    
-    # Paths
-    CHECKPOINT_DIR = Path("./checkpoints")
-    OUTPUT_DIR = Path("./static/generated")
-    
-    # Create output directory
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+# Available samplers. All of them are built from the training (DDPM) scheduler
+# config, so they share the same noise schedule as the trained model.
+SAMPLERS = {
+    "ddpm": DDPMScheduler,
+    "ddim": DDIMScheduler,
+    "dpm++": DPMSolverMultistepScheduler,
+    "euler": EulerDiscreteScheduler,
+}
+
+
+def available_memory(device):
+    """
+    Return the number of bytes currently available for new allocations
+    
+    Args:
+        device: torch device the memory is needed on
+        
+    Returns:
+        Available bytes, or None if it cannot be determined
+    """
+    device = torch.device(device)
+    if device.type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+    
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    
+    # Linux without psutil
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def measure_activation_bytes(run, device):
+    """
+    Measure the peak memory allocated during one forward pass
+    
+    On CUDA the allocator's peak counter is used. On CPU the profiler records
+    every allocation and free of the pass in order; their running total peaks
+    where the most tensors are alive at once, including the skip activations a
+    U-Net keeps for its up path. The CPU peak is scaled by
+    Config.ACTIVATION_SAFETY_FACTOR for allocator overhead and kernel
+    workspace the profiler does not see.
+    
+    Args:
+        run: Callable performing the forward pass
+        device: torch device the pass runs on
+        
+    Returns:
+        Peak bytes allocated by the pass
+    """
+    device = torch.device(device)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        baseline = torch.cuda.memory_allocated(device)
+        with torch.no_grad():
+            run()
+        torch.cuda.synchronize(device)
+        return torch.cuda.max_memory_allocated(device) - baseline
+    
+    with torch.no_grad(), torch.profiler.profile(
+        activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True
+    ) as profiler:
+        run()
+    
+    # Self memory: what each op allocated (positive) or freed (negative) itself
+    live = peak = 0
+    for event in sorted(profiler.events(), key=lambda event: event.time_range.start):
+        live += event.self_cpu_memory_usage
+        peak = max(peak, live)
+    return peak * Config.ACTIVATION_SAFETY_FACTOR
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Hex SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _tile_starts(size, tile, stride):
+    """Start offsets of tiles covering [0, size), the last one flush with the end"""
+    if size <= tile:
+        return [0]
+    starts = list(range(0, size - tile, stride))
+    starts.append(size - tile)
+    return starts
+
+
+def _blend_mask(height, width, ramp, top, left, bottom, right, device):
+    """
+    Weight mask for one tile: 1 inside, linear ramps on edges shared with a
+    neighbouring tile
+    """
+    def axis_weights(length, start_ramp, end_ramp):
+        weights = torch.ones(length, device=device)
+        fade = (torch.arange(ramp, device=device) + 0.5) / ramp
+        if start_ramp:
+            weights[:ramp] = fade
+        if end_ramp:
+            weights[-ramp:] = fade.flip(0)
+        return weights
+    
+    rows = axis_weights(height, top, bottom)
+    cols = axis_weights(width, left, right)
+    return (rows[:, None] * cols[None, :])[None, None]
+
+
+class LatentDecoder:
+    """
+    Decodes denoised latents to images
+    
+    Subclasses take latents in the UNet's (scaled) latent space and return RGB
+    images of shape (N, 3, H, W) in [-1, 1]. Register extra backends with
+    MedicalImageGenerator.add_decoder.
+    """
+    
+    def decode(self, latents, decode_mode="full"):
+        """
+        Decode a batch of latents
+        
+        Args:
+            latents: Denoised latents of shape (N, C, h, w)
+            decode_mode: "full", "sliced" or "tiled" (backends may ignore it)
+            
+        Returns:
+            Images of shape (N, 3, H, W) in [-1, 1]
+        """
+        raise NotImplementedError
+
+
+class VAEDecoder(LatentDecoder):
+    """Full AutoencoderKL decoder (the model the UNet was trained against)"""
+    
+    def __init__(self, vae, engine=None):
+        """
+        Args:
+            vae: AutoencoderKL model
+            engine: Optional InferenceEngine running the decoder (see engine.py)
+        """
+        self.vae = vae
+        self.engine = engine or InferenceEngine(VAEDecode(vae))
+    
+    def decode(self, latents, decode_mode="full"):
+        self.vae.eval()
+        latents = latents / Config.VAE_SCALE_FACTOR
+        if decode_mode == "tiled":
+            return self._decode_tiled(latents)
+        return self.engine(latents)
+    
+    def _decode_tiled(self, latents):
+        """
+        Decode latents in overlapping spatial tiles and blend the seams
+        
+        Each tile is decoded on its own, so peak memory depends on the tile
+        size instead of the image size. Overlapping borders are cross-faded
+        with linear weights.
+        
+        Args:
+            latents: Unscaled latents of shape (N, C, h, w)
+            
+        Returns:
+            Decoded images of shape (N, 3, h * 8, w * 8) in [-1, 1]
+        """
+        tile = Config.DECODE_TILE_SIZE
+        overlap = Config.DECODE_TILE_OVERLAP
+        scale = Config.IMAGE_SIZE // Config.LATENT_SIZE
+        n, _, height, width = latents.shape
+        
+        images = None
+        weights = torch.zeros(
+            (1, 1, height * scale, width * scale), device=latents.device
+        )
+        
+        for y in _tile_starts(height, tile, tile - overlap):
+            for x in _tile_starts(width, tile, tile - overlap):
+                tile_latents = latents[:, :, y:y + tile, x:x + tile]
+                decoded = self.engine(tile_latents)
+                if images is None:
+                    images = torch.zeros(
+                        (n, decoded.shape[1], height * scale, width * scale),
+                        device=latents.device, dtype=decoded.dtype
+                    )
+                
+                tile_h, tile_w = decoded.shape[-2:]
+                mask = _blend_mask(
+                    tile_h, tile_w, overlap * scale,
+                    top=y > 0, left=x > 0,
+                    bottom=y + tile < height, right=x + tile < width,
+                    device=latents.device
+                )
+                region = (slice(None), slice(None),
+                          slice(y * scale, y * scale + tile_h),
+                          slice(x * scale, x * scale + tile_w))
+                images[region] += decoded * mask
+                weights[region] += mask
+        
+        return images / weights
+
+
+class TinyDecoder(LatentDecoder):
+    """
+    Distilled tiny decoder (TAESD) loaded from a local weights file
+    
+    Accepts the original taesd_decoder.pth release as well as a diffusers
+    AutoencoderTiny state dict (.pth or .safetensors). TAESD works directly on
+    the scaled latents, so no VAE_SCALE_FACTOR division is needed.
+    """
+    
+    def __init__(self, weights_path, device):
+        """
+        Load the decoder
+        
+        Args:
+            weights_path: Path to the decoder weights
+            device: torch device to run on
+        """
+        weights_path = Path(weights_path)
+        if not weights_path.exists():
+            raise FileNotFoundError(f"Tiny decoder weights not found: {weights_path}")
+        
+        if weights_path.suffix == ".safetensors":
+            from safetensors.torch import load_file
+            state_dict = load_file(str(weights_path))
+        else:
+            state_dict = torch.load(weights_path, map_location="cpu")
+        
+        self.model = AutoencoderTiny(latent_channels=Config.LATENT_CHANNELS)
+        self.model.decoder.load_state_dict(self._decoder_state_dict(state_dict))
+        self.model = self.model.to(device)
+        self.model.eval()
+    
+    @staticmethod
+    def _decoder_state_dict(state_dict):
+        """Map either weight layout onto AutoencoderTiny.decoder keys"""
+        decoder_state = {}
+        for key, value in state_dict.items():
+            if key.startswith("decoder."):
+                # diffusers AutoencoderTiny layout
+                decoder_state[key[len("decoder."):]] = value
+            elif key.split(".", 1)[0].isdigit():
+                # Original TAESD layout: nn.Sequential whose layer 0 is a clamp
+                # that AutoencoderTiny applies in forward() instead
+                index, rest = key.split(".", 1)
+                decoder_state[f"layers.{int(index) - 1}.{rest}"] = value
+        return decoder_state
+    
+    def decode(self, latents, decode_mode="full"):
+        return self.model.decode(latents).sample
 
 
 class MedicalImageGenerator:
     """Generates synthetic medical images using trained latent diffusion model"""
     
-    def __init__(self, model_path=None, device=None):
+    def __init__(self, model_path=None, device=None, sampler=None,
+                 batch_size=None, decode_batch_size=None, decode_mode=None,
+                 pretrained_vae=True, decoder=None, tiny_decoder_path=None,
+                 quantization=None, engine=None, precision=None, memory_format=None,
+                 bundle_path=None, guidance_scale=None):
         """
         Initialize the generator
         
         Args:
             model_path: Path to the trained model checkpoint (.pth file)
             device: torch device (cuda/cpu). Auto-detects if None
+            sampler: Default sampler name (see SAMPLERS). Uses Config.DEFAULT_SAMPLER if None
+            batch_size: UNet batch size. Picked from available memory if None
+            decode_batch_size: VAE decode batch size. Picked from available memory if None
+            decode_mode: VAE decode mode (see Config.DECODE_MODES). Uses Config.DECODE_MODE if None
+            pretrained_vae: Load VAE_MODEL weights. False builds it with random
+                weights (no download), for benchmarks
+            decoder: Default latent decoder (see Config.DECODERS). Uses Config.DECODER if None
+            tiny_decoder_path: Weights of the "tiny" decoder. Uses Config.TINY_DECODER_PATH if None
+            quantization: U-Net quantization mode (see Config.QUANTIZATION_MODES),
+                CPU only. Uses Config.QUANTIZATION if None
+            engine: Inference engine (see Config.ENGINES). Uses Config.ENGINE if None.
+                Falls back to eager if the export fails
+            precision: "fp32" or "bf16" autocast (see Config.PRECISIONS). Uses
+                Config.PRECISION if None
+            memory_format: "nchw" or "channels_last" (see Config.MEMORY_FORMATS).
+                Uses Config.MEMORY_FORMAT if None
+            bundle_path: Weight bundle directory written by export_bundle. Loads
+                the U-Net and VAE from it (memory-mapped, no hub access) instead
+                of model_path and VAE_MODEL
+            guidance_scale: Default classifier-free guidance scale of class-
+                conditional checkpoints. Uses Config.GUIDANCE_SCALE if None
         """
         self.config = Config()
+        self.load_timings = {}  # Seconds per startup phase
+        self.sampler = self._resolve_sampler(sampler)
+        self.batch_size = batch_size
+        self.decode_batch_size = decode_batch_size
+        self.batch_plan = None  # Filled by plan_batch_sizes on first use
+        self.decode_mode = self._resolve_decode_mode(decode_mode)
+        self.quantization = self._resolve_quantization(quantization)
+        self.engine = self._resolve_engine(engine)
+        self.precision = self._resolve_precision(precision)
+        self.memory_format = self._resolve_memory_format(memory_format)
+        if self.precision == "bf16" and self.quantization != "none":
+            raise ValueError("bf16 autocast cannot be combined with INT8 quantization")
         
         # Set device
         if device is None:
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         else:
-            self.device = device
+            self.device = torch.device(device)  # Also accepts "cpu", "cuda:0", ...
             
         print(f"Using device: {self.device}")
+        self.checkpoint_hash = None  # Set by load_checkpoint, keys the generation cache
+        self.num_class_embeds = None  # Class embeddings of the U-Net (None: unconditional)
         
-        # Load VAE (pre-trained encoder/decoder)
-        print("Loading VAE...")
-        self.vae = AutoencoderKL.from_pretrained(
-            self.config.VAE_MODEL,
-            torch_dtype=torch.float32
-        ).to(self.device)
-        self.vae.eval()
-        
-        # Create U-Net model
-        print("Creating U-Net model...")
-        self.model = self._create_unet()
+        if bundle_path is not None:
+            # Both models from local memory-mapped weights
+            self.load_bundle(bundle_path)
+            model_path = Path(bundle_path) / "unet.safetensors"
+        else:
+            # Load VAE (pre-trained encoder/decoder)
+            print("Loading VAE...")
+            with self._timed("vae"):
+                if pretrained_vae:
+                    self.vae = AutoencoderKL.from_pretrained(
+                        self.config.VAE_MODEL,
+                        torch_dtype=torch.float32
+                    )
+                else:
+                    self.vae = AutoencoderKL(**self.config.VAE_CONFIG)
+                self.vae = self.vae.to(self.device)
+                self.vae.eval()
+            self.pretrained_vae = pretrained_vae
+            
+            # Create U-Net model
+            print("Creating U-Net model...")
+            with self._timed("unet"):
+                self.model = self._create_unet()
+                
+                # Load trained weights if provided
+                if model_path:
+                    self.load_checkpoint(model_path)
         
-        # Load trained weights if provided
-        if model_path:
-            self.load_checkpoint(model_path)
+        # Latent decoders; the tiny decoder is loaded on first use
+        self.decoders = {"vae": VAEDecoder(self.vae)}
+        self.tiny_decoder_path = Path(tiny_decoder_path or self.config.TINY_DECODER_PATH)
+        self._decoder_lock = threading.Lock()
+        self.decoder = self._resolve_decoder(decoder)
+        self.encoder = ImageEncoder()  # Writes image files off the generation thread
 
-        # Initialize noise scheduler
+        # Initialize noise scheduler (training schedule, shared by all samplers)
         self.noise_scheduler = DDPMScheduler(
             num_train_timesteps=self.config.TIMESTEPS
         )
+        self.guidance_scale = self._resolve_guidance_scale(guidance_scale)
+        
+        # Quantize the trained U-Net (CPU inference only)
+        if self.quantization != "none":
+            print(f"Quantizing U-Net ({self.quantization} INT8)...")
+            with self._timed("quantize"):
+                self.model = quantize_unet(
+                    self.model, self.quantization, self.calibration_batches()
+                )
         
+        # NHWC weights for channels-last convolutions
+        if self.memory_format == "channels_last":
+            with self._timed("layout"):
+                self.model = self.model.to(memory_format=torch.channels_last)
+                self.vae = self.vae.to(memory_format=torch.channels_last)
+        
+        # Run the U-Net and VAE decoder through the selected engine
+        with self._timed("engines"):
+            self._build_engines(model_path)
+        
+        print(f"Default sampler: {self.sampler}")
+        if self.num_class_embeds is not None:
+            print(f"Class-conditional U-Net: {', '.join(self.config.CLASS_NAMES)} "
+                  f"(guidance scale {self.guidance_scale})")
+        print("Startup phases: " + ", ".join(
+            f"{phase} {seconds:.2f}s" for phase, seconds in self.load_timings.items()
+        ))
         print("Model initialized successfully!")
     
-    def _create_unet(self):
-        """Create the U-Net architecture"""
-        model = UNet2DModel(
-            sample_size=self.config.LATENT_SIZE,
-            in_channels=self.config.LATENT_CHANNELS,
-            out_channels=self.config.LATENT_CHANNELS,
-            layers_per_block=2,
-            block_out_channels=(128, 256, 512, 512),
-            down_block_types=(
-                "DownBlock2D",
-                "DownBlock2D",
-                "AttnDownBlock2D",
-                "DownBlock2D",
-            ),
-            up_block_types=(
-                "UpBlock2D",
-                "AttnUpBlock2D",
-                "UpBlock2D",
-                "UpBlock2D",
-            ),
+    @contextmanager
+    def _timed(self, phase):
+        """Record the wall time of a startup phase in self.load_timings"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.load_timings[phase] = time.perf_counter() - start
+    
+    def _resolve_sampler(self, sampler):
+        """Return a validated sampler name, falling back to the default"""
+        if sampler is None:
+            sampler = getattr(self, 'sampler', self.config.DEFAULT_SAMPLER)
+        sampler = sampler.lower()
+        if sampler not in SAMPLERS:
+            raise ValueError(
+                f"Unknown sampler '{sampler}'. Choose from: {', '.join(SAMPLERS)}"
+            )
+        return sampler
+    
+    def _resolve_decode_mode(self, decode_mode):
+        """Return a validated decode mode, falling back to the default"""
+        if decode_mode is None:
+            decode_mode = getattr(self, 'decode_mode', self.config.DECODE_MODE)
+        if decode_mode not in self.config.DECODE_MODES:
+            raise ValueError(
+                f"Unknown decode mode '{decode_mode}'. "
+                f"Choose from: {', '.join(self.config.DECODE_MODES)}"
+            )
+        return decode_mode
+    
+    def _resolve_storage(self, storage):
+        """Return a validated storage mode, falling back to the default"""
+        if storage is None:
+            storage = self.config.STORAGE
+        if storage not in self.config.STORAGE_MODES:
+            raise ValueError(
+                f"Unknown storage mode '{storage}'. "
+                f"Choose from: {', '.join(self.config.STORAGE_MODES)}"
+            )
+        return storage
+    
+    def _resolve_quantization(self, quantization):
+        """Return a validated quantization mode, falling back to the default"""
+        if quantization is None:
+            quantization = self.config.QUANTIZATION
+        if quantization not in self.config.QUANTIZATION_MODES:
+            raise ValueError(
+                f"Unknown quantization mode '{quantization}'. "
+                f"Choose from: {', '.join(self.config.QUANTIZATION_MODES)}"
+            )
+        return quantization
+    
+    def _resolve_engine(self, engine):
+        """Return a validated inference engine name, falling back to the default"""
+        if engine is None:
+            engine = self.config.ENGINE
+        if engine not in self.config.ENGINES:
+            raise ValueError(
+                f"Unknown engine '{engine}'. Choose from: {', '.join(self.config.ENGINES)}"
+            )
+        return engine
+    
+    def _resolve_precision(self, precision):
+        """Return a validated precision, falling back to the default"""
+        if precision is None:
+            precision = self.config.PRECISION
+        if precision not in self.config.PRECISIONS:
+            raise ValueError(
+                f"Unknown precision '{precision}'. "
+                f"Choose from: {', '.join(self.config.PRECISIONS)}"
+            )
+        return precision
+    
+    def _resolve_memory_format(self, memory_format):
+        """Return a validated memory format, falling back to the default"""
+        if memory_format is None:
+            memory_format = self.config.MEMORY_FORMAT
+        if memory_format not in self.config.MEMORY_FORMATS:
+            raise ValueError(
+                f"Unknown memory format '{memory_format}'. "
+                f"Choose from: {', '.join(self.config.MEMORY_FORMATS)}"
+            )
+        return memory_format
+    
+    @property
+    def variant(self):
+        """Settings besides the checkpoint that change the generated pixels"""
+        return f"{self.quantization}-{self.precision}-{self.memory_format}"
+    
+    def _autocast(self):
+        """Context running network forward passes in the selected precision"""
+        if self.precision == "bf16":
+            return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16)
+        return nullcontext()
+    
+    def _to_memory_format(self, tensor):
+        """Lay out a network input in the selected memory format"""
+        if self.memory_format == "channels_last":
+            return tensor.contiguous(memory_format=torch.channels_last)
+        return tensor
+    
+    def _build_engines(self, model_path=None):
+        """
+        Export the U-Net and VAE decoder with self.engine
+        
+        Exported graphs are cached next to the checkpoint, named after its hash
+        and the model variant, so they are rebuilt when either changes.
+        Random weights (no checkpoint, or a random VAE) are never cached.
+        
+        Args:
+            model_path: Checkpoint the U-Net weights came from, if any
+        """
+        self.model.eval()
+        unet_artifact = vae_artifact = None
+        if model_path and self.checkpoint_hash:
+            stem = Path(model_path).with_suffix('')
+            prefix = f"{stem}.{self.checkpoint_hash[:12]}.{self.variant}"
+            unet_artifact = f"{prefix}.unet"
+            if self.pretrained_vae:
+                vae_artifact = (f"{stem}.{self.config.VAE_MODEL.replace('/', '--')}."
+                                f"{self.variant}.decoder")
+        
+        if self.engine != "eager":
+            print(f"Building {self.engine} engine...")
+        latent_shape = (self.config.LATENT_CHANNELS, self.config.LATENT_SIZE,
+                        self.config.LATENT_SIZE)
+        unet_inputs = (torch.randn((2, *latent_shape), device=self.device),
+                       torch.tensor(float(self.config.TIMESTEPS - 1), device=self.device))
+        if self.num_class_embeds is not None:
+            unet_inputs += (torch.zeros(2, dtype=torch.long, device=self.device),)
+        self.unet_engine = build_engine(
+            self.engine,
+            UNetForward(self.model),
+            unet_inputs,
+            unet_artifact
         )
+        vae_engine = build_engine(
+            self.engine,
+            VAEDecode(self.vae),
+            (torch.randn((1, *latent_shape), device=self.device),),
+            vae_artifact
+        )
+        self.decoders["vae"] = VAEDecoder(self.vae, vae_engine)
+    
+    def set_unet(self, model):
+        """
+        Swap the U-Net used for denoising, e.g. for a quantized copy
+        
+        The new model runs eagerly; exported graphs belong to the model they
+        were built from.
+        
+        Args:
+            model: U-Net with the same inputs and outputs as self.model
+        """
+        self.model = model
+        self.unet_engine = InferenceEngine(UNetForward(model))
+    
+    def _resolve_decoder(self, decoder):
+        """Return a validated decoder name, falling back to the default"""
+        if decoder is None:
+            decoder = getattr(self, 'decoder', self.config.DECODER)
+        if decoder not in self.decoders and decoder not in self.config.DECODERS:
+            choices = sorted(set(self.decoders) | set(self.config.DECODERS))
+            raise ValueError(
+                f"Unknown decoder '{decoder}'. Choose from: {', '.join(choices)}"
+            )
+        return decoder
+    
+    def add_decoder(self, name, decoder):
+        """
+        Register a latent decoder backend
+        
+        Args:
+            name: Name used to select the decoder per request
+            decoder: LatentDecoder instance
+        """
+        self.decoders[name] = decoder
+    
+    def get_decoder(self, name=None):
+        """
+        Return a latent decoder by name, loading the tiny decoder on first use
+        
+        Args:
+            name: Decoder name. Uses the generator default if None
+            
+        Returns:
+            LatentDecoder instance
+        """
+        name = self._resolve_decoder(name)
+        if name not in self.decoders:
+            with self._decoder_lock:
+                if name not in self.decoders and name == "tiny":
+                    print(f"Loading tiny decoder from: {self.tiny_decoder_path}")
+                    self.decoders[name] = TinyDecoder(self.tiny_decoder_path, self.device)
+        return self.decoders[name]
+    
+    def _resolve_steps(self, sampler, num_inference_steps):
+        """Return a validated step count, falling back to the sampler default"""
+        if num_inference_steps is None:
+            num_inference_steps = self.config.SAMPLER_STEPS.get(
+                sampler, self.config.NUM_INFERENCE_STEPS
+            )
+        num_inference_steps = int(num_inference_steps)
+        if not (self.config.MIN_INFERENCE_STEPS <= num_inference_steps
+                <= self.config.MAX_INFERENCE_STEPS):
+            raise ValueError(
+                f"Steps must be between {self.config.MIN_INFERENCE_STEPS} "
+                f"and {self.config.MAX_INFERENCE_STEPS}"
+            )
+        return num_inference_steps
+    
+    @property
+    def null_class_label(self):
+        """Label of the unconditional embedding (guidance), or None if the U-Net has none"""
+        num_classes = len(self.config.CLASS_NAMES)
+        if self.num_class_embeds is not None and self.num_class_embeds > num_classes:
+            return num_classes
+        return None
+    
+    def _resolve_guidance_scale(self, guidance_scale):
+        """Return a validated guidance scale, falling back to the default"""
+        if guidance_scale is None:
+            guidance_scale = getattr(self, 'guidance_scale', self.config.GUIDANCE_SCALE)
+        guidance_scale = float(guidance_scale)
+        if not (self.config.MIN_GUIDANCE_SCALE <= guidance_scale
+                <= self.config.MAX_GUIDANCE_SCALE):
+            raise ValueError(
+                f"Guidance scale must be between {self.config.MIN_GUIDANCE_SCALE} "
+                f"and {self.config.MAX_GUIDANCE_SCALE}"
+            )
+        if guidance_scale != 1.0 and self.null_class_label is None:
+            raise ValueError(
+                "Guidance needs a class-conditional checkpoint with an unconditional embedding"
+            )
+        return guidance_scale
+    
+    def _class_names(self, disease_type, num_images):
+        """Disease type of every image of a request: one for all, or an explicit list"""
+        if isinstance(disease_type, (list, tuple)):
+            if len(disease_type) != num_images:
+                raise ValueError(f"Expected {num_images} disease types, got {len(disease_type)}")
+            return [str(name) for name in disease_type]
+        return [str(disease_type)] * num_images
+    
+    def _resolve_class_labels(self, class_names):
+        """
+        Class labels of a request's images
+        
+        Args:
+            class_names: Disease type of every image (see _class_names)
+            
+        Returns:
+            List of int labels, or None if the U-Net is unconditional (the
+            names then only name the files)
+        """
+        if self.num_class_embeds is None:
+            return None
+        labels = []
+        for name in class_names:
+            if name.upper() not in self.config.CLASS_NAMES:
+                raise ValueError(
+                    f"Unknown disease type '{name}'. "
+                    f"Choose from: {', '.join(self.config.CLASS_NAMES)}"
+                )
+            labels.append(self.config.CLASS_NAMES.index(name.upper()))
+        return labels
+    
+    def plan_batch_sizes(self):
+        """
+        Pick the UNet and VAE decode batch sizes (probed once, then cached)
+        
+        Explicit batch sizes given to the constructor win; otherwise each stage
+        gets as many samples as fit into Config.MEMORY_BUDGET_FRACTION of the
+        available memory, based on the measured peak of a single-sample pass.
+        Guided runs get a separate U-Net size at twice the per-sample cost.
+        
+        Returns:
+            Dict with the chosen sizes and the measurements behind them
+        """
+        if self.batch_plan is not None:
+            return self.batch_plan
+        
+        plan = {
+            'unet_batch_size': self.batch_size,
+            'decode_batch_size': self.decode_batch_size,
+            'available_bytes': None,
+            'guided_unet_batch_size': None,
+            'unet_bytes_per_sample': None,
+            'decode_bytes_per_sample': None,
+        }
+        
+        if self.batch_size is not None:
+            plan['guided_unet_batch_size'] = max(1, self.batch_size // 2)
+        
+        if self.batch_size is None or self.decode_batch_size is None:
+            available = available_memory(self.device)
+            plan['available_bytes'] = available
+            budget = available * self.config.MEMORY_BUDGET_FRACTION if available else None
+            
+            latents = self._to_memory_format(torch.randn(
+                (1, self.config.LATENT_CHANNELS,
+                 self.config.LATENT_SIZE, self.config.LATENT_SIZE),
+                device=self.device
+            ))
+            timestep = torch.tensor([self.config.TIMESTEPS - 1], device=self.device)
+            class_labels = None
+            if self.num_class_embeds is not None:
+                class_labels = torch.zeros(1, dtype=torch.long, device=self.device)
+            
+            # Probe in the precision used for generation (bf16 halves activations)
+            if self.batch_size is None:
+                self.model.eval()
+                with self._autocast():
+                    per_sample = measure_activation_bytes(
+                        lambda: self.model(latents, timestep, class_labels), self.device
+                    )
+                plan['unet_bytes_per_sample'] = per_sample
+                plan['unet_batch_size'] = self._fit_batch(
+                    budget, per_sample, self.config.MAX_UNET_BATCH_SIZE
+                )
+                # Guided steps run the U-Net on every latent twice (with and
+                # without its class), so each sample costs double
+                if budget and per_sample:
+                    plan['guided_unet_batch_size'] = self._fit_batch(
+                        budget, 2 * per_sample, self.config.MAX_UNET_BATCH_SIZE
+                    )
+                else:
+                    plan['guided_unet_batch_size'] = max(1, plan['unet_batch_size'] // 2)
+            
+            if self.decode_batch_size is None and self.decode_mode != "full":
+                # Sliced and tiled decoding always work on one sample
+                plan['decode_batch_size'] = 1
+            elif self.decode_batch_size is None:
+                self.vae.eval()
+                with self._autocast():
+                    per_sample = measure_activation_bytes(
+                        lambda: self.vae.decode(latents), self.device
+                    )
+                plan['decode_bytes_per_sample'] = per_sample
+                plan['decode_batch_size'] = self._fit_batch(
+                    budget, per_sample, self.config.MAX_DECODE_BATCH_SIZE
+                )
+        
+        self.batch_plan = plan
+        print(f"Batch sizes: UNet {plan['unet_batch_size']} "
+              f"({plan['guided_unet_batch_size']} guided), "
+              f"VAE decode {plan['decode_batch_size']}")
+        return plan
+    
+    @staticmethod
+    def _fit_batch(budget, per_sample, max_batch_size):
+        """Largest batch whose estimated memory fits the budget"""
+        if not budget or not per_sample:
+            # Unknown memory: keep the previous conservative default
+            return min(4, max_batch_size)
+        return max(1, min(int(budget // per_sample), max_batch_size))
+    
+    def make_scheduler(self, sampler=None):
+        """
+        Create a fresh scheduler instance for one generation run
+        
+        Multistep solvers keep state between steps, so every run gets its own
+        instance instead of sharing self.noise_scheduler.
+        
+        Args:
+            sampler: Sampler name (see SAMPLERS). Uses the generator default if None
+            
+        Returns:
+            Scheduler configured with the training noise schedule
+        """
+        sampler = self._resolve_sampler(sampler)
+        return SAMPLERS[sampler].from_config(self.noise_scheduler.config)
+    
+    def _create_unet(self, num_class_embeds=None):
+        """
+        Create the U-Net architecture
+        
+        Args:
+            num_class_embeds: Size of the class embedding table of a class-
+                conditional U-Net (CLASS_NAMES, plus one unconditional label
+                for guidance). None builds an unconditional U-Net
+        """
+        if num_class_embeds is not None and num_class_embeds < len(self.config.CLASS_NAMES):
+            raise ValueError(
+                f"Class-conditional U-Net needs at least {len(self.config.CLASS_NAMES)} "
+                f"class embeddings, got {num_class_embeds}"
+            )
+        model = UNet2DModel(**self.config.UNET_CONFIG, num_class_embeds=num_class_embeds)
+        self.num_class_embeds = num_class_embeds
         return model.to(self.device)
     
     def load_checkpoint(self, checkpoint_path):
-        """Load trained model weights"""
+        """Load trained model weights (unconditional or class-conditional)"""
         print(f"Loading checkpoint from: {checkpoint_path}")
         checkpoint_path = Path(checkpoint_path)
         
@@ -111,111 +831,633 @@ class MedicalImageGenerator:
             raise FileNotFoundError(f"Checkpoint not found: {checkpoint_path}")
         
         state_dict = torch.load(checkpoint_path, map_location=self.device)
+        
+        # Class-conditional checkpoints carry a class embedding table
+        class_embedding = state_dict.get('class_embedding.weight')
+        num_class_embeds = class_embedding.shape[0] if class_embedding is not None else None
+        if num_class_embeds != self.num_class_embeds:
+            self.model = self._create_unet(num_class_embeds)
         self.model.load_state_dict(state_dict)
         self.model.eval()
+        self.checkpoint_hash = file_sha256(checkpoint_path)
         print("Checkpoint loaded successfully!")
     
-    def generate_images(self, num_images=1, disease_type="NORMAL", save_path=None):
+    def export_bundle(self, bundle_path):
         """
-        Generate synthetic medical images
+        Write the float U-Net and VAE as an offline weight bundle
+        
+        The bundle holds unet.safetensors, vae.safetensors and bundle.json with
+        both model configs and the checkpoint hash, so load_bundle can rebuild
+        the generator without the hub, the .pth checkpoint or hashing it again.
         
         Args:
-            num_images: Number of images to generate
-            disease_type: Type of disease (for naming purposes)
-            save_path: Directory to save generated images. If None, returns PIL images
+            bundle_path: Output directory (created if missing)
+        """
+        from safetensors.torch import save_file
+        
+        if self.quantization != "none":
+            raise ValueError("Export the bundle from the float model (quantization='none')")
+        
+        bundle_path = Path(bundle_path)
+        bundle_path.mkdir(parents=True, exist_ok=True)
+        for name, model in (("unet", self.model), ("vae", self.vae)):
+            # safetensors stores dense row-major tensors (channels-last weights are strided)
+            state_dict = {
+                key: tensor.detach().contiguous().cpu()
+                for key, tensor in model.state_dict().items()
+            }
+            save_file(state_dict, str(bundle_path / f"{name}.safetensors"))
+        
+        manifest = {
+            'format': 1,
+            'checkpoint_hash': self.checkpoint_hash,
+            'vae_model': self.config.VAE_MODEL if self.pretrained_vae else None,
+            'unet_config': dict(self.model.config),
+            'vae_config': dict(self.vae.config),
+        }
+        (bundle_path / "bundle.json").write_text(json.dumps(manifest, indent=2))
+        print(f"Bundle written to: {bundle_path}")
+    
+    def load_bundle(self, bundle_path):
+        """
+        Load the U-Net and VAE from a bundle written by export_bundle
+        
+        The models are built on the meta device (no weight allocation or random
+        init) and their parameters are then assigned the safetensors tensors,
+        which are memory-mapped from the files rather than read and copied.
+        
+        Args:
+            bundle_path: Bundle directory
+        """
+        from safetensors.torch import load_file
+        
+        bundle_path = Path(bundle_path)
+        print(f"Loading bundle from: {bundle_path}")
+        manifest_path = bundle_path / "bundle.json"
+        if not manifest_path.exists():
+            raise FileNotFoundError(f"Bundle not found: {manifest_path}")
+        manifest = json.loads(manifest_path.read_text())
+        
+        for name, model_class in (("vae", AutoencoderKL), ("unet", UNet2DModel)):
+            with self._timed(name):
+                with torch.device("meta"):
+                    model = model_class.from_config(manifest[f"{name}_config"])
+                state_dict = load_file(
+                    str(bundle_path / f"{name}.safetensors"), device=str(self.device)
+                )
+                model.load_state_dict(state_dict, assign=True)
+                # Buffers missing from the state dict would still be meta tensors
+                for key, tensor in list(model.named_parameters()) + list(model.named_buffers()):
+                    if tensor.is_meta:
+                        raise ValueError(f"Bundle {name} weights do not cover {key}")
+                model.eval()
+            setattr(self, "model" if name == "unet" else "vae", model)
+        
+        self.num_class_embeds = self.model.config.num_class_embeds
+        self.pretrained_vae = manifest['vae_model'] is not None
+        self.checkpoint_hash = manifest['checkpoint_hash']
+        print("Bundle loaded successfully!")
+    
+    def calibration_batches(self, num_batches=None, batch_size=None, seed=0):
+        """
+        U-Net inputs for static quantization calibration
+        
+        Random latents at timesteps spread over the whole training schedule, so
+        the observed activation ranges cover every noise level a sampler visits.
+        
+        Args:
+            num_batches: Number of batches. Uses Config.CALIBRATION_BATCHES if None
+            batch_size: Latents per batch. Uses Config.CALIBRATION_BATCH_SIZE if None
+            seed: Seed of the random latents
             
         Returns:
-            List of PIL Image objects or list of saved file paths
+            List of (latents, timestep) tuples, with random class labels
+            appended for a class-conditional U-Net
+        """
+        num_batches = num_batches or self.config.CALIBRATION_BATCHES
+        batch_size = batch_size or self.config.CALIBRATION_BATCH_SIZE
+        generator = torch.Generator().manual_seed(seed)
+        timesteps = torch.linspace(self.config.TIMESTEPS - 1, 0, num_batches).long()
+        
+        batches = []
+        for timestep in timesteps:
+            latents = torch.randn(
+                (batch_size, self.config.LATENT_CHANNELS,
+                 self.config.LATENT_SIZE, self.config.LATENT_SIZE),
+                generator=generator
+            ).to(self.device)
+            batch = (latents, timestep.to(self.device))
+            if self.num_class_embeds is not None:
+                labels = torch.randint(0, self.num_class_embeds, (batch_size,), generator=generator)
+                batch += (labels.to(self.device),)
+            batches.append(batch)
+        return batches
+    
+    def sample_latents(self, num_samples, scheduler, generators=None):
         """
-        print(f"Generating {num_images} {disease_type} images...")
+        Draw the initial noise for a denoising run
         
+        Args:
+            num_samples: Number of latents to draw
+            scheduler: Scheduler of the run (scales the noise to its first sigma)
+            generators: Optional list of one torch.Generator per sample (see
+                make_generators). Unseeded global RNG if None
+            
+        Returns:
+            Latent tensor of shape (num_samples, C, H, W)
+        """
+        latents = randn_tensor(
+            (num_samples, self.config.LATENT_CHANNELS, 
+             self.config.LATENT_SIZE, self.config.LATENT_SIZE),
+            generator=generators,
+            device=self.device
+        )
+        return latents * scheduler.init_noise_sigma
+    
+    @staticmethod
+    def make_generators(seeds):
+        """
+        Create one CPU random generator per sample
+        
+        Every sample draws its initial noise and its sampler noise from its own
+        generator, so an image depends only on its seed and not on which batch
+        (or which device) it was generated in.
+        
+        Args:
+            seeds: Per-sample integer seeds
+            
+        Returns:
+            List of seeded torch.Generator objects
+        """
+        return [torch.Generator().manual_seed(int(seed)) for seed in seeds]
+    
+    @staticmethod
+    def _resolve_seeds(seed, num_images):
+        """Per-image seeds for a request: seed, seed + 1, ... or an explicit list"""
+        if seed is None:
+            return None
+        if isinstance(seed, (list, tuple)):
+            if len(seed) != num_images:
+                raise ValueError(f"Expected {num_images} seeds, got {len(seed)}")
+            return [int(s) for s in seed]
+        return [int(seed) + index for index in range(num_images)]
+    
+    def denoise(self, latents, scheduler, num_inference_steps, step_callback=None,
+                desc="Denoising", generators=None, class_labels=None, guidance_scale=1.0):
+        """
+        Run the reverse diffusion loop on a batch of latents
+        
+        With guidance, every step runs the U-Net once on the batch twice over,
+        with the class labels and with the unconditional label, and moves the
+        prediction guidance_scale times the difference away from the
+        unconditional one.
+        
+        Args:
+            latents: Initial noise from sample_latents
+            scheduler: Scheduler for this run (from make_scheduler)
+            num_inference_steps: Number of denoising steps
+            step_callback: Optional callable step_callback(step) called after each
+                step. Disables the tqdm bar when given
+            desc: tqdm bar label
+            generators: Per-sample generators used for the sampler's noise
+                (the ones passed to sample_latents)
+            class_labels: Class label per latent (see _resolve_class_labels),
+                None for an unconditional U-Net. Labels may differ within a batch
+            guidance_scale: Classifier-free guidance scale (1 disables guidance)
+            
+        Returns:
+            Denoised latents
+        """
         self.model.eval()
-        self.vae.eval()
+        DENOISE_BATCH_SIZE.observe(latents.shape[0])
         
-        # Generate in batches to avoid memory issues
-        batch_size = min(4, num_images)
-        all_images = []
+        guided = class_labels is not None and guidance_scale != 1.0
+        if class_labels is not None:
+            class_labels = torch.as_tensor(class_labels, dtype=torch.long, device=self.device)
+            if guided:
+                unconditional = torch.full_like(class_labels, self.null_class_label)
+                class_labels = torch.cat([class_labels, unconditional])
         
-        with torch.no_grad():
-            for batch_idx in range(0, num_images, batch_size):
-                current_batch_size = min(batch_size, num_images - batch_idx)
-                
-                # 1. Start with random noise in latent space
-                latents = torch.randn(
-                    (current_batch_size, self.config.LATENT_CHANNELS, 
-                     self.config.LATENT_SIZE, self.config.LATENT_SIZE),
-                    device=self.device
-                )
-                
-                # 2. Denoising loop
-                self.noise_scheduler.set_timesteps(self.config.NUM_INFERENCE_STEPS)
-                
-                for t in tqdm(self.noise_scheduler.timesteps, 
-                            desc=f"Batch {batch_idx//batch_size + 1}", 
-                            leave=False):
-                    # Predict noise
-                    noise_pred = self.model(latents, t).sample
-                    
-                    # Remove predicted noise
-                    latents = self.noise_scheduler.step(
-                        noise_pred, t, latents
-                    ).prev_sample
+        with torch.no_grad(), DENOISE_SECONDS.time(scheduler=type(scheduler).__name__):
+            for step, t in enumerate(tqdm(scheduler.timesteps, 
+                        desc=desc, 
+                        leave=False,
+                        disable=step_callback is not None)):
+                # Predict noise
+                model_input = scheduler.scale_model_input(latents, t)
+                if guided:
+                    model_input = torch.cat([model_input, model_input])
+                model_input = self._to_memory_format(model_input)
+                with self._autocast():
+                    if class_labels is None:
+                        noise_pred = self.unet_engine(model_input, t)
+                    else:
+                        noise_pred = self.unet_engine(model_input, t, class_labels)
                 
-                # 3. Decode latents to images
-                latents = latents / self.config.VAE_SCALE_FACTOR
-                images = self.vae.decode(latents).sample
+                # Remove predicted noise (scheduler math stays in float32)
+                noise_pred = noise_pred.float()
+                if guided:
+                    conditional, unconditional = noise_pred.chunk(2)
+                    noise_pred = unconditional + guidance_scale * (conditional - unconditional)
+                latents = scheduler.step(
+                    noise_pred, t, latents, generator=generators
+                ).prev_sample
                 
-                # 4. Denormalize from [-1, 1] to [0, 1]
-                images = (images / 2 + 0.5).clamp(0, 1)
-                
-                # 5. Convert to PIL Images
-                for i in range(current_batch_size):
-                    # Convert tensor to numpy
-                    img_array = images[i].cpu().permute(1, 2, 0).numpy()
-                    
-                    # Convert RGB to grayscale (medical images are typically grayscale)
-                    img_array = np.mean(img_array, axis=2)
-                    
-                    # Convert to 8-bit
-                    img_array = (img_array * 255).astype(np.uint8)
-                    
-                    # Create PIL Image
-                    pil_image = Image.fromarray(img_array, mode='L')
-                    all_images.append(pil_image)
-        
-        # Save or return images
-        if save_path:
-            save_path = Path(save_path)
-            save_path.mkdir(parents=True, exist_ok=True)
+                if step_callback is not None:
+                    step_callback(step + 1)
+        
+        return latents
+    
+    def decode_latents(self, latents, decode_batch_size=None, decode_mode=None,
+                       decoder=None, bit_depth=8):
+        """
+        Decode denoised latents to grayscale PIL images
+        
+        Args:
+            latents: Denoised latents from denoise
+            decode_batch_size: Latents decoded per VAE call. Uses the batch plan if None
+            decode_mode: "full", "sliced" or "tiled". Uses the generator default if None
+            decoder: Latent decoder name (see Config.DECODERS). Uses the generator default if None
+            bit_depth: 8, or 16 for 16-bit images (e.g. for "png16" files)
             
-            saved_paths = []
-            for idx, img in enumerate(all_images):
-                filename = f"{disease_type.lower()}_{idx+1}.png"
-                full_path = save_path / filename
-                img.save(full_path)
-                saved_paths.append(str(full_path))
+        Returns:
+            List of PIL Image objects (mode 'L', or 'I;16' for 16 bits)
+        """
+        decode_mode = self._resolve_decode_mode(decode_mode)
+        decoder = self._resolve_decoder(decoder)
+        latent_decoder = self.get_decoder(decoder)
+        if decode_mode != "full":
+            # Slice along the batch so peak memory does not grow with it
+            decode_batch_size = 1
+        elif decode_batch_size is None:
+            decode_batch_size = self.plan_batch_sizes()['decode_batch_size']
+        
+        pil_images = []
+        with DECODE_SECONDS.time(decoder=decoder):
+            for start in range(0, latents.shape[0], decode_batch_size):
+                pil_images.extend(self._decode_chunk(
+                    latents[start:start + decode_batch_size], decode_mode, latent_decoder,
+                    bit_depth
+                ))
+        return pil_images
+    
+    def _decode_chunk(self, latents, decode_mode, latent_decoder, bit_depth=8):
+        """Decode one batch of latents to PIL images"""
+        with torch.no_grad():
+            # 3. Decode latents to images (post-processing runs in float32)
+            with self._autocast():
+                images = latent_decoder.decode(self._to_memory_format(latents), decode_mode)
+            images = images.float()
             
-            print(f"✓ Saved {len(saved_paths)} images to {save_path}")
-            return saved_paths
-        else:
-            return all_images
+            # 4. Denormalize, convert to grayscale and quantize on the device
+            pixels = self.postprocess(images, bit_depth)
+        
+        # 5. Wrap each row of the uint8 array as a PIL Image
+        return [Image.fromarray(pixels[i]) for i in range(pixels.shape[0])]
+    
+    def postprocess(self, images, bit_depth=8):
+        """
+        Convert decoded VAE output to 8- or 16-bit grayscale pixels for a whole batch
+        
+        Runs as a few in-place tensor ops on the decode device and moves a
+        single contiguous integer array to the host, instead of copying every
+        image to numpy in float first.
+        
+        Args:
+            images: Decoder output of shape (N, 3, H, W) in [-1, 1]. Modified in place
+            bit_depth: 8 for uint8 pixels (0-255), or 16 for uint16 pixels (0-65535)
+            
+        Returns:
+            numpy array of shape (N, H, W), uint8 with bit_depth=8 and uint16
+            with bit_depth=16
+        """
+        # Denormalize from [-1, 1] to [0, 1]
+        images = images.mul_(0.5).add_(0.5).clamp_(0, 1)
+        
+        # Convert RGB to grayscale (medical images are typically grayscale)
+        gray = images.mean(dim=1)
+        
+        if bit_depth == 16:
+            # torch has few uint16 kernels: quantize in int32, narrow on the host
+            gray = gray.mul_(65535).to(torch.int32)
+            return gray.cpu().numpy().astype(np.uint16)
+        
+        # Convert to 8-bit (truncating, like numpy's astype)
+        gray = gray.mul_(255).to(torch.uint8)
+        
+        return gray.cpu().numpy()
+    
+    def image_file(self, disease_type, save_path, index, image_format=None):
+        """Path of the numbered file of one image (creates save_path)"""
+        save_path = Path(save_path)
+        save_path.mkdir(parents=True, exist_ok=True)
+        
+        suffix = FILE_SUFFIXES[resolve_format(image_format)]
+        return save_path / f"{disease_type.lower()}_{index+1}{suffix}"
+    
+    def save_image(self, image, disease_type, save_path, index, image_format=None,
+                   thumbnail=False):
+        """
+        Save one generated image as a numbered file
+        
+        Args:
+            image: PIL Image object
+            disease_type: Type of disease (for naming purposes)
+            save_path: Directory to save the image to
+            index: Zero-based position of the image in its request
+            image_format: "png", "webp" or "png16" (see Config.IMAGE_FORMATS).
+                Uses Config.IMAGE_FORMAT if None
+            thumbnail: Also write a preview to thumbs/ (see encoding.thumbnail_path)
+            
+        Returns:
+            Saved file path
+        """
+        image_format = resolve_format(image_format)
+        full_path = self.image_file(disease_type, save_path, index, image_format)
+        return encode_image(image, full_path, image_format, thumbnail)
+    
+    def submit_save(self, image, disease_type, save_path, index, image_format=None,
+                    thumbnail=False):
+        """
+        save_image on the encoder thread pool
+        
+        Returns:
+            Future resolving to the saved file path
+        """
+        image_format = resolve_format(image_format)
+        full_path = self.image_file(disease_type, save_path, index, image_format)
+        return self.encoder.submit(image, full_path, image_format, thumbnail)
+    
+    def save_images(self, images, disease_type, save_path, image_format=None):
+        """
+        Save generated images as numbered files, encoded in parallel
+        
+        Args:
+            images: List of PIL Image objects
+            disease_type: Type of disease (for naming purposes)
+            save_path: Directory to save the images to
+            image_format: File format (see Config.IMAGE_FORMATS). Uses Config.IMAGE_FORMAT if None
+            
+        Returns:
+            List of saved file paths
+        """
+        futures = [
+            self.submit_save(img, disease_type, save_path, idx, image_format)
+            for idx, img in enumerate(images)
+        ]
+        saved_paths = [future.result() for future in futures]
+        
+        print(f"✓ Saved {len(saved_paths)} images to {save_path}")
+        return saved_paths
     
-    def generate_single_sample(self, disease_type="NORMAL"):
+    def latent_metadata(self, disease_type, decoder=None, image_format=None):
+        """What decode_saved needs to know about stored latents (see latents.latent_file_name)"""
+        if isinstance(disease_type, (list, tuple)):
+            # Mixed classes: one name per request position
+            disease_type = [str(name) for name in disease_type]
+        return {
+            'disease': disease_type,
+            'decoder': self._resolve_decoder(decoder),
+            'format': resolve_format(image_format),
+            'checkpoint_hash': self.checkpoint_hash,
+            'variant': self.variant,
+        }
+    
+    def decode_saved(self, save_path, indices=None):
+        """
+        Decode images from the latent file of a folder (see storage="latents")
+        
+        Args:
+            save_path: Folder holding the latent file
+            indices: Request positions to decode. Decodes every stored latent if None
+            
+        Returns:
+            Tuple of (dict mapping request position to PIL image in the stored
+            format's bit depth, latent metadata). Positions without a stored
+            latent are left out; the metadata is None without a latent file
+        """
+        stored = load_latents(save_path)
+        if stored is None:
+            return {}, None
+        latents, metadata = stored
+        if indices is None:
+            indices = sorted(latents)
+        indices = [index for index in indices if index in latents]
+        if not indices:
+            return {}, metadata
+        
+        batch = torch.from_numpy(np.stack([latents[index] for index in indices])).to(self.device)
+        images = self.decode_latents(
+            batch, decoder=metadata['decoder'],
+            bit_depth=BIT_DEPTHS[resolve_format(metadata['format'])]
+        )
+        return dict(zip(indices, images)), metadata
+    
+    def iter_images(self, num_images=1, disease_type="NORMAL", save_path=None,
+                    sampler=None, num_inference_steps=None, progress_callback=None,
+                    batch_size=None, decode_batch_size=None, decode_mode=None,
+                    decoder=None, seed=None, image_format=None, storage=None,
+                    guidance_scale=None):
+        """
+        Generate synthetic medical images, yielding each one as soon as its
+        batch is decoded (and saved)
+        
+        Takes the same arguments as generate_images.
+        
+        Yields:
+            (index, image) tuples, where image is a PIL Image object, or the
+            saved file path if save_path is given. With storage="latents",
+            image is the denoised latent (float32 CPU tensor) instead
+        """
+        sampler = self._resolve_sampler(sampler)
+        num_inference_steps = self._resolve_steps(sampler, num_inference_steps)
+        scheduler = self.make_scheduler(sampler)
+        self.get_decoder(decoder)  # Fail before denoising if it cannot be loaded
+        seeds = self._resolve_seeds(seed, num_images)
+        image_format = resolve_format(image_format)
+        storage = self._resolve_storage(storage)
+        class_names = self._class_names(disease_type, num_images)
+        class_labels = self._resolve_class_labels(class_names)
+        guidance_scale = self._resolve_guidance_scale(guidance_scale)
+        guided = class_labels is not None and guidance_scale != 1.0
+        stored = []
+        
+        print(f"Generating {num_images} {'/'.join(dict.fromkeys(class_names))} images "
+              f"({sampler}, {num_inference_steps} steps"
+              f"{f', guidance {guidance_scale}' if guided else ''})...")
+        
+        # Generate in batches sized to the available memory
+        if batch_size is None:
+            # Guided steps run the U-Net on twice the latents
+            plan = self.plan_batch_sizes()
+            batch_size = plan['guided_unet_batch_size' if guided else 'unet_batch_size']
+        batch_size = min(batch_size, num_images)
+        num_batches = (num_images + batch_size - 1) // batch_size
+        images_done = 0
+        
+        def report(stage, batch, step):
+            if progress_callback is not None:
+                progress_callback({
+                    'stage': stage,
+                    'batch': batch,
+                    'num_batches': num_batches,
+                    'step': step,
+                    'num_steps': num_inference_steps,
+                    'images_done': images_done,
+                    'num_images': num_images,
+                })
+        
+        for batch_idx in range(0, num_images, batch_size):
+            current_batch_size = min(batch_size, num_images - batch_idx)
+            batch_number = batch_idx // batch_size + 1
+            
+            # 1. Start with random noise in latent space
+            # (set_timesteps first: it also resets multistep solver state)
+            scheduler.set_timesteps(num_inference_steps, device=self.device)
+            generators = None
+            if seeds is not None:
+                generators = self.make_generators(
+                    seeds[batch_idx:batch_idx + current_batch_size]
+                )
+            latents = self.sample_latents(current_batch_size, scheduler, generators)
+            
+            # 2. Denoising loop
+            step_callback = None
+            if progress_callback is not None:
+                step_callback = lambda step: report('denoising', batch_number, step)
+            latents = self.denoise(
+                latents, scheduler, num_inference_steps,
+                step_callback=step_callback,
+                desc=f"Batch {batch_number}",
+                generators=generators,
+                class_labels=(class_labels[batch_idx:batch_idx + current_batch_size]
+                              if class_labels is not None else None),
+                guidance_scale=guidance_scale
+            )
+            
+            if storage == "latents":
+                # Keep the latents; save_latents rewrites the file per batch so
+                # images already denoised can be decoded meanwhile
+                latents = list(latents.float().cpu())
+                images_done += len(latents)
+                report('denoised', batch_number, num_inference_steps)
+                if save_path:
+                    stored.extend(latents)
+                    save_latents(
+                        save_path, torch.stack(stored).numpy(), range(len(stored)),
+                        self.latent_metadata(disease_type, decoder, image_format)
+                    )
+                for offset, latent in enumerate(latents):
+                    yield batch_idx + offset, latent
+                continue
+            
+            # 3-5. Decode latents to PIL images
+            images = self.decode_latents(latents, decode_batch_size, decode_mode, decoder,
+                                         BIT_DEPTHS[image_format])
+            images_done += len(images)
+            report('decoded', batch_number, num_inference_steps)
+            
+            # Save (optionally, the whole batch in parallel) and hand out the batch
+            if save_path:
+                images = [
+                    self.submit_save(image, class_names[batch_idx + offset], save_path,
+                                     batch_idx + offset, image_format)
+                    for offset, image in enumerate(images)
+                ]
+            for offset, image in enumerate(images):
+                if save_path:
+                    image = image.result()
+                yield batch_idx + offset, image
+    
+    def generate_images(self, num_images=1, disease_type="NORMAL", save_path=None,
+                        sampler=None, num_inference_steps=None, progress_callback=None,
+                        batch_size=None, decode_batch_size=None, decode_mode=None,
+                        decoder=None, seed=None, image_format=None, storage=None,
+                        guidance_scale=None):
+        """
+        Generate synthetic medical images
+        
+        Args:
+            num_images: Number of images to generate
+            disease_type: Disease class (see Config.CLASS_NAMES), or a list with
+                one class per image to mix classes in one batch. Only names the
+                files if the U-Net is unconditional
+            save_path: Directory to save generated images. If None, returns PIL images
+            sampler: Sampler name (see SAMPLERS). Uses the generator default if None
+            num_inference_steps: Denoising steps. Uses the sampler default if None
+            progress_callback: Optional callable receiving a progress dict after
+                every denoising step and decoded batch. Replaces the tqdm bar
+            batch_size: UNet batch size for this call. Uses the batch plan if None
+            decode_batch_size: VAE decode batch size for this call. Uses the batch plan if None
+            decode_mode: "full", "sliced" or "tiled" VAE decoding. Uses the generator default if None
+            decoder: Latent decoder, e.g. "tiny" for fast previews. Uses the generator default if None
+            seed: Optional integer seed; image i is generated from seed + i, so it
+                is reproducible regardless of batching. A list gives every
+                image's seed explicitly
+            image_format: File format of saved images (see Config.IMAGE_FORMATS);
+                "png16" also returns 16-bit images. Uses Config.IMAGE_FORMAT if None
+            storage: "images", or "latents" to skip decoding: returns the denoised
+                latents and, with save_path, writes them as a float16 latent file
+                (see latents.py) to be decoded later with decode_saved.
+                Uses Config.STORAGE if None
+            guidance_scale: Classifier-free guidance scale of a class-conditional
+                U-Net (1 disables guidance). Uses the generator default if None
+            
+        Returns:
+            List of PIL Image objects, saved file paths or latents
+        """
+        results = [
+            image for _, image in self.iter_images(
+                num_images=num_images,
+                disease_type=disease_type,
+                save_path=save_path,
+                sampler=sampler,
+                num_inference_steps=num_inference_steps,
+                progress_callback=progress_callback,
+                batch_size=batch_size,
+                decode_batch_size=decode_batch_size,
+                decode_mode=decode_mode,
+                decoder=decoder,
+                seed=seed,
+                image_format=image_format,
+                storage=storage,
+                guidance_scale=guidance_scale
+            )
+        ]
+        
+        if save_path:
+            print(f"✓ Saved {len(results)} images to {save_path}")
+        return results
+    
+    def generate_single_sample(self, disease_type="NORMAL", sampler=None,
+                               num_inference_steps=None, seed=None, guidance_scale=None):
         """
         Quick method to generate a single image
         
         Args:
-            disease_type: Disease type for naming
+            disease_type: Disease class to generate
+            sampler: Sampler name (see SAMPLERS). Uses the generator default if None
+            num_inference_steps: Denoising steps. Uses the sampler default if None
+            seed: Optional integer seed
+            guidance_scale: Classifier-free guidance scale. Uses the generator default if None
             
         Returns:
             PIL Image object
         """
-        images = self.generate_images(num_images=1, disease_type=disease_type)
+        images = self.generate_images(
+            num_images=1,
+            disease_type=disease_type,
+            sampler=sampler,
+            num_inference_steps=num_inference_steps,
+            seed=seed,
+            guidance_scale=guidance_scale
+        )
         return images[0]
 
 
 # Convenience function for Flask integration
-def generate_medical_images(disease_type, count, model_path=None, output_dir=None):
+def generate_medical_images(disease_type, count, model_path=None, output_dir=None,
+                            sampler=None, num_inference_steps=None, seed=None):
     """
     Generate medical images for Flask endpoint
     
@@ -224,6 +1466,9 @@ def generate_medical_images(disease_type, count, model_path=None, output_dir=Non
         count: Number of images to generate
         model_path: Path to model checkpoint
         output_dir: Where to save generated images
+        sampler: Sampler name (see SAMPLERS). Uses Config.DEFAULT_SAMPLER if None
+        num_inference_steps: Denoising steps. Uses the sampler default if None
+        seed: Optional integer seed for reproducible images
         
     Returns:
         List of relative paths to generated images
@@ -232,13 +1477,15 @@ def generate_medical_images(disease_type, count, model_path=None, output_dir=Non
         output_dir = Config.OUTPUT_DIR
     
     # Initialize generator (will cache this in production)
-    generator = MedicalImageGenerator(model_path=model_path)
+    generator = MedicalImageGenerator(model_path=model_path, sampler=sampler)
     
     # Generate images
     saved_paths = generator.generate_images(
         num_images=count,
         disease_type=disease_type,
-        save_path=output_dir
+        save_path=output_dir,
+        num_inference_steps=num_inference_steps,
+        seed=seed
     )
     
     # Convert absolute paths to relative web paths
@@ -260,14 +1507,19 @@ if __name__ == "__main__":
     if checkpoint_path.exists():
         generator = MedicalImageGenerator(model_path=checkpoint_path)
         
-        # Generate a test image
-        test_images = generator.generate_images(
-            num_images=2,
-            disease_type="TEST",
-            save_path=Config.OUTPUT_DIR
-        )
+        # Generate test images of every class (class-conditional checkpoints
+        # reject unknown classes); with guidance where the checkpoint supports it
+        guidance_scale = 3.0 if generator.null_class_label is not None else 1.0
+        test_images = []
+        for disease_type in Config.CLASS_NAMES:
+            test_images.extend(generator.generate_images(
+                num_images=2,
+                disease_type=disease_type,
+                save_path=Config.OUTPUT_DIR,
+                guidance_scale=guidance_scale
+            ))
         
-        print(f"Generated {len(test_images)} test images!")
+        print(f"Generated {len(test_images)} test images (guidance scale {guidance_scale})!")
     else:
         print(f"No checkpoint found at {checkpoint_path}")
         print("Please train the model first or provide a valid checkpoint path.")
@@ -0,0 +1,117 @@
+"""
+INT8 quantization of the U-Net for CPU inference
+Dynamic (Linear layers) and static (Conv2d and Linear layers, calibrated) modes
+"""
+
+import torch
+import torch.nn as nn
+from torch.ao import quantization as tq
+
+from config import QUANTIZATION_MODES
+
+
+class QuantizedLayer(nn.Module):
+    """
+    Runs one layer in INT8 between float32 neighbours
+
+    The diffusers U-Net mixes layers with functional ops (GroupNorm, SiLU,
+    residual adds, attention) that have no quantized kernels, so instead of
+    quantizing the whole graph every Conv2d/Linear is wrapped in its own
+    quantize -> INT8 layer -> dequantize island. The quantize step's scale and
+    zero point come from calibration.
+    """
+
+    def __init__(self, layer):
+        super().__init__()
+        self.quant = tq.QuantStub()
+        self.layer = layer
+        self.dequant = tq.DeQuantStub()
+
+    def forward(self, x):
+        return self.dequant(self.layer(self.quant(x)))
+
+
+def _wrap_layers(module, layer_types):
+    """Replace every layer of the given types with a QuantizedLayer, in place"""
+    for name, child in module.named_children():
+        if isinstance(child, layer_types):
+            setattr(module, name, QuantizedLayer(child))
+        else:
+            _wrap_layers(child, layer_types)
+
+
+def quantize_dynamic(model):
+    """
+    Dynamic INT8 quantization
+
+    Weights of the Linear layers (attention projections, time embedding) are
+    stored in INT8; activations are quantized on the fly per batch. PyTorch has
+    no dynamic Conv2d kernel, so convolutions stay float32.
+
+    Args:
+        model: Float U-Net in eval mode
+
+    Returns:
+        Quantized model
+    """
+    return tq.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration_batches):
+    """
+    Static INT8 quantization of the Conv2d and Linear layers
+
+    Args:
+        model: Float U-Net in eval mode (modified in place)
+        calibration_batches: Iterable of (latents, timestep) inputs, plus class
+            labels for class-conditional U-Nets. Observers record the
+            activation ranges on them
+
+    Returns:
+        Quantized model
+    """
+    engine = torch.backends.quantized.engine
+    _wrap_layers(model, (nn.Conv2d, nn.Linear))
+    qconfig = tq.get_default_qconfig(engine)
+    for module in model.modules():
+        if isinstance(module, QuantizedLayer):
+            module.qconfig = qconfig
+    tq.prepare(model, inplace=True)
+
+    # Calibration: record activation ranges
+    with torch.no_grad():
+        for inputs in calibration_batches:
+            model(*inputs)
+
+    tq.convert(model, inplace=True)
+    return model
+
+
+def quantize_unet(model, mode, calibration_batches=None):
+    """
+    Quantize a U-Net for CPU inference
+
+    Args:
+        model: Float U-Net in eval mode, on the CPU
+        mode: One of QUANTIZATION_MODES
+        calibration_batches: (latents, timestep[, class_labels]) inputs, required for "static"
+
+    Returns:
+        The quantized model (the float model itself for "none")
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(
+            f"Unknown quantization mode '{mode}'. Choose from: {', '.join(QUANTIZATION_MODES)}"
+        )
+    if mode == "none":
+        return model
+
+    device = next(model.parameters()).device
+    if device.type != "cpu":
+        raise ValueError(f"INT8 quantization runs on the CPU only, model is on {device}")
+
+    if mode == "dynamic":
+        return quantize_dynamic(model)
+    if calibration_batches is None:
+        raise ValueError("Static quantization needs calibration batches")
+    return quantize_static(model, calibration_batches)
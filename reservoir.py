@@ -0,0 +1,153 @@
+"""
+Pre-generated image reservoir
+Keeps a small pool of ready-made images per disease class, refilled in the
+background while the server is idle
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from encoding import BIT_DEPTHS, resolve_format
+
+
+class ImageReservoir:
+    """
+    Bounded per-class pools of images generated ahead of time
+
+    A pool is refilled once it drops below low_watermark and then topped up to
+    high_watermark. Refills only run while no live generation is in flight, one
+    small chunk at a time, so a request that arrives during a refill waits for
+    at most one chunk. Pooled images are generated with the generator defaults
+    (sampler, steps, decoder and guidance scale) and no seed, so only unseeded requests using
+    the defaults draw from the pool.
+    """
+
+    def __init__(self, backend_factory, disease_types, low_watermark=2, high_watermark=4,
+                 chunk_size=2, idle_seconds=2.0, retry_seconds=30.0):
+        """
+        Initialize the reservoir
+
+        Args:
+            backend_factory: Callable returning the object that generates images
+                (a MedicalImageGenerator or a BatchScheduler)
+            disease_types: Disease classes to keep pools for
+            low_watermark: Refill a pool once it holds fewer images than this
+            high_watermark: Number of images a refill tops a pool up to
+            chunk_size: Images generated per refill step
+            idle_seconds: Quiet time after the last live generation before refilling
+            retry_seconds: Pause after a failed refill step
+        """
+        if not 0 <= low_watermark <= high_watermark:
+            raise ValueError("Expected 0 <= low_watermark <= high_watermark")
+
+        self.backend_factory = backend_factory
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.chunk_size = max(1, chunk_size)
+        self.idle_seconds = idle_seconds
+        self.retry_seconds = retry_seconds
+
+        self._pools = {disease: deque() for disease in disease_types}
+        # Pools being topped up to the high watermark
+        self._refilling = set(self._pools) if high_watermark > 0 else set()
+        self._active = 0
+        self._last_activity = time.monotonic()
+        self._lock = threading.Condition()
+        self._thread = None
+
+    @staticmethod
+    def accepts(options):
+        """Whether a validated request can be served with pooled (default) images"""
+        # Pooled images are 8-bit, so any 8-bit file format can use them
+        return all(
+            options.get(name) is None
+            for name in ('sampler', 'steps', 'decoder', 'seed', 'guidance_scale')
+        ) and BIT_DEPTHS[resolve_format(options.get('format'))] == 8
+
+    def take(self, disease_type, count):
+        """
+        Remove up to count pooled images of a class
+
+        Args:
+            disease_type: Disease class of the request
+            count: Number of images wanted
+
+        Returns:
+            List of PIL images, possibly shorter than count (or empty)
+        """
+        with self._lock:
+            pool = self._pools.get(disease_type)
+            if pool is None:
+                return []
+            images = [pool.popleft() for _ in range(min(count, len(pool)))]
+            if len(pool) < self.low_watermark:
+                self._refilling.add(disease_type)
+                self._lock.notify_all()
+            return images
+
+    @contextmanager
+    def live(self):
+        """Mark a live generation as in flight; refills pause until it is done"""
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._last_activity = time.monotonic()
+                self._lock.notify_all()
+
+    def stats(self):
+        """Number of pooled images per class"""
+        with self._lock:
+            return {disease: len(pool) for disease, pool in self._pools.items()}
+
+    def start(self):
+        """Start the background filler (idempotent)"""
+        with self._lock:
+            # Started lazily so the thread lives in the process that serves
+            # requests (threads do not survive a fork)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._worker, name='image-reservoir', daemon=True
+                )
+                self._thread.start()
+
+    def _worker(self):
+        while True:
+            disease_type, count = self._next_refill()
+            try:
+                images = self.backend_factory().generate_images(
+                    num_images=count,
+                    disease_type=disease_type
+                )
+            except Exception as e:
+                print(f"Reservoir refill for {disease_type} failed: {e}")
+                time.sleep(self.retry_seconds)
+                continue
+
+            with self._lock:
+                pool = self._pools[disease_type]
+                pool.extend(images)
+                if len(pool) >= self.high_watermark:
+                    self._refilling.discard(disease_type)
+
+    def _next_refill(self):
+        """Wait until the server is idle and a pool needs images"""
+        with self._lock:
+            while True:
+                if self._refilling and self._active == 0:
+                    quiet = time.monotonic() - self._last_activity
+                    if quiet >= self.idle_seconds:
+                        break
+                    self._lock.wait(self.idle_seconds - quiet)
+                else:
+                    self._lock.wait()
+
+            # Top up the emptiest pool first
+            disease_type = min(self._refilling, key=lambda name: len(self._pools[name]))
+            missing = self.high_watermark - len(self._pools[disease_type])
+            return disease_type, max(1, min(self.chunk_size, missing))
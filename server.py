@@ -1,15 +1,29 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, session
-import requests
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, send_from_directory
 import json
 import os
 from pathlib import Path
-import base64
-from io import BytesIO
-import zipfile
 import time
+import threading
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from functools import wraps
-from database import db, User
+from contextlib import nullcontext
+from concurrent.futures import Future
+import numpy as np
+from database import db, User, GenerationRecord, configure_sqlite
+from jobs import JobManager, JobStore
+from batching import BatchScheduler
+from reservoir import ImageReservoir
+from cache import GenerationCache
+from zipstream import ZipStream
+from chat_client import DEFAULT_BASE_URL, DEFAULT_MODEL, ChatError, GeminiClient
+from werkzeug.exceptions import NotFound
+from storage import StorageManager
+from history import HistoryWriter
+from encoding import BIT_DEPTHS, FILE_SUFFIXES, THUMBNAIL_DIR, encode_bytes, resolve_format, thumbnail_path
+from latents import DecodedCache, latent_file_name, load_latents, save_latents
+from config import Config
+import metrics
 
 # Load environment variables
 load_dotenv()
@@ -22,16 +36,93 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Initialize database
 db.init_app(app)
 
-# Create tables
+# Create tables (WAL journal, so history inserts do not block readers)
 with app.app_context():
+    configure_sqlite(db.engine)
     db.create_all()
 
-# Model generator (lazy loaded)
+# Generation history, inserted in batches of HISTORY_BATCH_SIZE records at
+# most HISTORY_FLUSH_SECONDS after a request finishes
+history_writer = HistoryWriter(
+    app, db, GenerationRecord,
+    batch_size=int(os.getenv('HISTORY_BATCH_SIZE', '50')),
+    flush_seconds=float(os.getenv('HISTORY_FLUSH_SECONDS', '2'))
+)
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Model generator (lazy loaded, or built at import time with PRELOAD_MODEL=1 so
+# that forked gunicorn workers share one copy of the weights, see gunicorn.conf.py)
 model_generator = None
+model_load_error = None
+model_lock = threading.Lock()
+PRELOAD_MODEL = os.getenv('PRELOAD_MODEL', '0').lower() in ('1', 'true', 'yes')
+# Offline weight bundle (see export_bundle.py), used instead of the checkpoint
+# and the hub VAE when present
+MODEL_BUNDLE = Path(os.getenv('MODEL_BUNDLE', str(Config.BUNDLE_DIR)))
+startup_timings = {}  # Seconds per model load phase, reported by /health
+
+# Background generation jobs. Jobs running at once are co-batched into shared
+# U-Net runs by the batch scheduler, so one worker would batch nothing. Their
+# state is shared through JOB_STATE_DIR, so any gunicorn worker can answer
+# status and event requests for a job another worker runs
+JOB_STATE_DIR = Path(os.getenv('JOB_STATE_DIR', os.path.join(app.instance_path, 'jobs')))
+job_manager = JobManager(
+    max_workers=int(os.getenv('GENERATION_WORKERS', '4')),
+    store=JobStore(JOB_STATE_DIR)
+)
+SSE_KEEPALIVE_SECONDS = 15
+
+# Generated images and how many of them the page previews
+GENERATED_DIR = Path('./static/generated')
+MAX_DISPLAY_IMAGES = 6
+
+# Session folders are deleted after STORAGE_TTL_HOURS, oldest first beyond
+# STORAGE_QUOTA_MB (0 disables either limit)
+STORAGE_INDEX_DIR = Path(os.getenv('STORAGE_INDEX_DIR', './cache/sessions'))
+STORAGE_TTL_HOURS = float(os.getenv('STORAGE_TTL_HOURS', '24'))
+STORAGE_QUOTA_MB = int(os.getenv('STORAGE_QUOTA_MB', '2048'))
+STORAGE_SWEEP_SECONDS = float(os.getenv('STORAGE_SWEEP_SECONDS', '300'))
+# "latents" keeps live generated images as latents, decoded when first
+# requested; DECODED_CACHE_MB bounds the decoded files kept in memory
+IMAGE_STORAGE = os.getenv('IMAGE_STORAGE', Config.STORAGE)
+DECODED_CACHE_MB = int(os.getenv('DECODED_CACHE_MB', '64'))
+decoded_cache = DecodedCache(max_bytes=DECODED_CACHE_MB * 2**20)
+storage = StorageManager(
+    GENERATED_DIR,
+    STORAGE_INDEX_DIR,
+    ttl_seconds=STORAGE_TTL_HOURS * 3600,
+    max_bytes=STORAGE_QUOTA_MB * 2**20,
+    sweep_seconds=STORAGE_SWEEP_SECONDS
+)
+
+# Cross-request batching of concurrent generations (BATCH_WINDOW_MS=0 disables it)
+BATCH_WINDOW_MS = int(os.getenv('BATCH_WINDOW_MS', '50'))
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '0')) or None  # None: sized from memory
+
+# Pools of pre-generated images per disease class (RESERVOIR_SIZE=0 disables them)
+DISEASE_TYPES = Config.CLASS_NAMES
+RESERVOIR_SIZE = int(os.getenv('RESERVOIR_SIZE', '4'))
+RESERVOIR_LOW = int(os.getenv('RESERVOIR_LOW', str(RESERVOIR_SIZE // 2)))
+RESERVOIR_IDLE_SECONDS = float(os.getenv('RESERVOIR_IDLE_SECONDS', '2'))
+
+# On-disk cache of seeded images (GENERATION_CACHE_MB=0 disables it)
+GENERATION_CACHE_DIR = Path(os.getenv('GENERATION_CACHE_DIR', './cache/generated'))
+GENERATION_CACHE_MB = int(os.getenv('GENERATION_CACHE_MB', '512'))
+MAX_SEED = 2**32 - 1
+
+# Generation history: short label of each generation route (endpoint column)
+HISTORY_ENDPOINTS = {
+    'generate': 'generate',
+    'generate_stream': 'stream',
+    'create_generation_job': 'job'
+}
 
 # Google Gemini API configuration
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GOOGLE_API_KEY}"
+# GEMINI_BASE_URL can point at a local stand-in server (see mock_gemini.py)
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL', DEFAULT_BASE_URL)
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', DEFAULT_MODEL)
 
 USE_GEMINI = True
 
@@ -60,83 +151,45 @@ Key symptoms:
 
 Be professional, clear, and helpful."""
 
+# Answer when the API returns no text (e.g. a blocked prompt)
+EMPTY_ANSWER = "I received your message but couldn't generate a proper response. Could you please rephrase your question?"
+
+# Pooled connections, cached answers, coalesced identical questions
+chat_client = GeminiClient(
+    GOOGLE_API_KEY,
+    base_url=GEMINI_BASE_URL,
+    model=GEMINI_MODEL,
+    system_context=SYSTEM_CONTEXT,
+    timeout=float(os.getenv('GEMINI_TIMEOUT', '20')),
+    max_retries=int(os.getenv('GEMINI_RETRIES', '2')),
+    cache_size=int(os.getenv('CHAT_CACHE_SIZE', '256')),
+    cache_ttl=float(os.getenv('CHAT_CACHE_TTL', '3600'))
+)
+
 def get_ai_response(user_message):
-    """Get response from Google Gemini API using REST"""
+    """Get response from Google Gemini API, falling back to canned answers"""
     
     if not USE_GEMINI:
         return get_fallback_response(user_message)
     
+    outcome = 'error'
+    start = time.perf_counter()
     try:
-        # Create a prompt with context
-        prompt = f"{SYSTEM_CONTEXT}\n\nUser question: {user_message}\n\nAssistant:"
-        
-        # Prepare the request payload
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": prompt
-                }]
-            }],
-            "generationConfig": {
-                "temperature": 0.7,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 1024,
-            },
-            "safetySettings": [
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                }
-            ]
-        }
-        
-        # Make the API request
-        response = requests.post(
-            GEMINI_API_URL,
-            headers={'Content-Type': 'application/json'},
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Extract the text from the response
-            if 'candidates' in data and len(data['candidates']) > 0:
-                candidate = data['candidates'][0]
-                if 'content' in candidate and 'parts' in candidate['content']:
-                    parts = candidate['content']['parts']
-                    if len(parts) > 0 and 'text' in parts[0]:
-                        return parts[0]['text']
-            
-            # If we couldn't extract text, check for safety issues
-            if 'promptFeedback' in data:
-                print(f"Prompt feedback: {data['promptFeedback']}")
-            
-            return "I received your message but couldn't generate a proper response. Could you please rephrase your question?"
-        else:
-            print(f"API Error: {response.status_code} - {response.text}")
-            return get_fallback_response(user_message)
-            
-    except requests.exceptions.Timeout:
-        print("API request timed out")
+        answer, outcome = chat_client.ask(user_message)
+        if answer is None:
+            return EMPTY_ANSWER
+        return answer
+    except ChatError as e:
+        print(f"Error getting AI response: {e}")
+        if e.details:
+            print(e.details)
+        outcome = e.outcome
         return get_fallback_response(user_message)
     except Exception as e:
         print(f"Error getting AI response: {e}")
         return get_fallback_response(user_message)
+    finally:
+        metrics.CHAT_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
 
 def get_fallback_response(user_message):
     """Fallback responses when API fails"""
@@ -254,46 +307,22 @@ def test_api():
         })
     
     try:
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": "Say 'Hello' in one word"
-                }]
-            }]
-        }
-        
-        response = requests.post(
-            GEMINI_API_URL,
-            headers={'Content-Type': 'application/json'},
-            json=payload,
-            timeout=10
-        )
+        response_text = chat_client.complete("Say 'Hello' in one word")
         
-        if response.status_code == 200:
-            data = response.json()
-            response_text = "No text in response"
-            
-            if 'candidates' in data and len(data['candidates']) > 0:
-                candidate = data['candidates'][0]
-                if 'content' in candidate and 'parts' in candidate['content']:
-                    parts = candidate['content']['parts']
-                    if len(parts) > 0 and 'text' in parts[0]:
-                        response_text = parts[0]['text']
-            
-            return jsonify({
-                'status': 'success',
-                'message': 'API is working',
-                'gemini_enabled': True,
-                'test_response': response_text
-            })
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': f"API returned status {response.status_code}",
-                'gemini_enabled': False,
-                'details': response.text
-            }), 500
-            
+        return jsonify({
+            'status': 'success',
+            'message': 'API is working',
+            'gemini_enabled': True,
+            'test_response': response_text or "No text in response"
+        })
+    
+    except ChatError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'gemini_enabled': False,
+            'details': e.details
+        }), 500
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -315,93 +344,775 @@ def chat():
     
     return jsonify({'response': ai_response})
 
-@app.route('/generate', methods=['POST'])
-def generate():
-    """Handle image generation requests"""
-    global model_generator
-    
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream the chat answer as server-sent events while Gemini writes it"""
     data = request.get_json()
+    user_message = data.get('message', '')
+    
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+    
+    def event_stream():
+        if not USE_GEMINI:
+            yield sse_event('fallback', {'text': get_fallback_response(user_message)})
+            yield sse_event('done', {'outcome': 'fallback'})
+            return
+        
+        start = time.perf_counter()
+        outcome = 'error'
+        try:
+            answer = chat_client.cached(user_message)
+            if answer is not None:
+                outcome = 'cached'
+                yield sse_event('delta', {'text': answer})
+            else:
+                received = False
+                for text in chat_client.stream(user_message):
+                    if not received:
+                        received = True
+                        metrics.CHAT_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start)
+                    yield sse_event('delta', {'text': text})
+                outcome = 'ok' if received else 'empty'
+                if not received:
+                    yield sse_event('delta', {'text': EMPTY_ANSWER})
+        except ChatError as e:
+            # Before or mid-answer: the canned answer replaces what was sent
+            print(f"Error streaming AI response: {e}")
+            outcome = e.outcome
+            yield sse_event('fallback', {'text': get_fallback_response(user_message)})
+        except Exception as e:
+            print(f"Error streaming AI response: {e}")
+            yield sse_event('fallback', {'text': get_fallback_response(user_message)})
+        finally:
+            metrics.CHAT_SECONDS.observe(time.perf_counter() - start, outcome=outcome)
+        yield sse_event('done', {'outcome': outcome})
+    
+    return Response(event_stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def parse_generation_request(data):
+    """
+    Validate the options of an image generation request
+    
+    Returns:
+        (options, None) on success or (None, error_message) on invalid input
+    """
     disease = data.get('disease', '')
     count = data.get('num_images', data.get('count', 1))
+    sampler = data.get('sampler')
+    steps = data.get('steps', data.get('num_inference_steps'))
+    decoder = data.get('decoder')
+    seed = data.get('seed')
+    guidance_scale = data.get('guidance_scale')
+    image_format = data.get('format')
+    storage_mode = data.get('storage', IMAGE_STORAGE)
     
     if not disease:
-        return jsonify({'success': False, 'error': 'No disease specified'}), 400
+        return None, 'No disease specified'
+    if str(disease).upper() not in DISEASE_TYPES:
+        return None, f"Disease must be one of: {', '.join(name.lower() for name in DISEASE_TYPES)}"
     
     # Validate count
-    count = int(count)
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        return None, 'Count must be an integer'
     if count < 1 or count > 20:
-        return jsonify({'success': False, 'error': 'Count must be between 1 and 20'}), 400
+        return None, 'Count must be between 1 and 20'
     
-    # Limit display to maximum 6 samples
-    display_count = min(count, 6)
+    # Validate sampler (every sampler has a default step count)
+    if sampler is not None:
+        sampler = str(sampler).lower()
+        if sampler not in Config.SAMPLER_STEPS:
+            return None, f"Sampler must be one of: {', '.join(Config.SAMPLER_STEPS)}"
     
-    try:
-        # Lazy load model generator
+    # Validate step count
+    if steps is not None:
+        try:
+            steps = int(steps)
+        except (TypeError, ValueError):
+            return None, 'Steps must be an integer'
+        if steps < Config.MIN_INFERENCE_STEPS or steps > Config.MAX_INFERENCE_STEPS:
+            return None, (f'Steps must be between {Config.MIN_INFERENCE_STEPS} '
+                          f'and {Config.MAX_INFERENCE_STEPS}')
+    
+    # Validate latent decoder ("tiny" for fast previews, "vae" for full quality)
+    if decoder is not None and decoder not in Config.DECODERS:
+        return None, f"Decoder must be one of: {', '.join(Config.DECODERS)}"
+    
+    # Validate seed (image i of the request uses seed + i)
+    if seed is not None:
+        if isinstance(seed, bool):
+            return None, 'Seed must be an integer'
+        try:
+            seed = int(seed)
+        except (TypeError, ValueError):
+            return None, 'Seed must be an integer'
+        if seed < 0 or seed > MAX_SEED:
+            return None, f'Seed must be between 0 and {MAX_SEED}'
+    
+    # Validate guidance scale (class-conditional checkpoints; 1 disables guidance)
+    if guidance_scale is not None:
+        if isinstance(guidance_scale, bool):
+            return None, 'Guidance scale must be a number'
+        try:
+            guidance_scale = float(guidance_scale)
+        except (TypeError, ValueError):
+            return None, 'Guidance scale must be a number'
+        if not Config.MIN_GUIDANCE_SCALE <= guidance_scale <= Config.MAX_GUIDANCE_SCALE:
+            return None, (f'Guidance scale must be between {Config.MIN_GUIDANCE_SCALE} '
+                          f'and {Config.MAX_GUIDANCE_SCALE}')
+        # Checked against the model only if it is loaded already; otherwise
+        # at generation time (see check_model_support), not worth a load here
+        if model_generator is not None:
+            try:
+                check_model_support({'guidance_scale': guidance_scale}, model_generator)
+            except UnsupportedRequestError as e:
+                return None, str(e)
+    
+    # Validate output format ("png16" for 16-bit research images)
+    if image_format is not None:
+        image_format = str(image_format).lower()
+        if image_format not in Config.IMAGE_FORMATS:
+            return None, f"Format must be one of: {', '.join(Config.IMAGE_FORMATS)}"
+    
+    # Validate storage ("latents" decodes images only when they are requested)
+    storage_mode = str(storage_mode).lower()
+    if storage_mode not in Config.STORAGE_MODES:
+        return None, f"Storage must be one of: {', '.join(Config.STORAGE_MODES)}"
+    
+    return {
+        'disease': disease,
+        'count': count,
+        'sampler': sampler,
+        'steps': steps,
+        'decoder': decoder,
+        'seed': seed,
+        'guidance_scale': guidance_scale,
+        'format': image_format,
+        'storage': storage_mode,
+        'owner': session.get('user_id'),
+        # For the history record: route and arrival (jobs may wait in the queue)
+        'endpoint': HISTORY_ENDPOINTS.get(request.endpoint, request.endpoint),
+        'received_at': datetime.utcnow()
+    }, None
+
+class UnsupportedRequestError(ValueError):
+    """A valid request the loaded model cannot serve (answered with 400)"""
+
+def check_model_support(options, generator):
+    """
+    Reject options the loaded checkpoint does not support
+    
+    Raises:
+        UnsupportedRequestError: Guidance on a checkpoint without an unconditional embedding
+    """
+    guidance_scale = options['guidance_scale']
+    if guidance_scale not in (None, 1.0) and generator.null_class_label is None:
+        raise UnsupportedRequestError(
+            'Guidance scale must be 1: the loaded checkpoint is not '
+            'class-conditional with an unconditional embedding'
+        )
+
+def get_model_generator():
+    """Return the shared model generator, loading it on first use"""
+    global model_generator, model_load_error
+    
+    if model_generator is not None:
+        return model_generator
+    
+    # Only one thread loads the model; the others wait for it
+    with model_lock:
         if model_generator is None:
+            # torch and diffusers are only imported here, on first model use
+            start = time.perf_counter()
             from model_inference import MedicalImageGenerator
+            import_seconds = time.perf_counter() - start
+            
+            # Prefer the offline bundle (memory-mapped, no hub access)
             checkpoint_path = Path('./checkpoints/final_unet_model.pth')
+            bundle_path = MODEL_BUNDLE if (MODEL_BUNDLE / 'bundle.json').exists() else None
             
             # Check if checkpoint exists
-            if not checkpoint_path.exists():
-                return jsonify({
-                    'success': False,
-                    'error': 'Model checkpoint not found. Please train the model first or download the trained weights.'
-                }), 500
+            if bundle_path is None and not checkpoint_path.exists():
+                model_load_error = 'Model checkpoint not found. Please train the model first or download the trained weights.'
+                raise FileNotFoundError(model_load_error)
             
-            print("Loading model... (this may take a minute)")
-            model_generator = MedicalImageGenerator(model_path=checkpoint_path)
-            print("Model loaded successfully!")
-        
-        # Generate images
-        output_dir = Path('./static/generated').resolve()
-        output_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Create a unique session folder
-        session_id = f"{disease}_{int(time.time())}"
-        session_dir = output_dir / session_id
-        session_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Generate images
-        saved_paths = model_generator.generate_images(
-            num_images=count,
-            disease_type=disease,
-            save_path=session_dir
+            print(f"Loading model from {bundle_path or checkpoint_path}...")
+            try:
+                model_generator = MedicalImageGenerator(
+                    model_path=None if bundle_path else checkpoint_path,
+                    bundle_path=bundle_path,
+                    decode_mode=os.getenv('VAE_DECODE_MODE'),
+                    quantization=os.getenv('UNET_QUANTIZATION'),
+                    engine=os.getenv('INFERENCE_ENGINE'),
+                    precision=os.getenv('INFERENCE_PRECISION'),
+                    memory_format=os.getenv('MEMORY_FORMAT'),
+                    guidance_scale=os.getenv('GUIDANCE_SCALE')
+                )
+            except Exception as e:
+                model_load_error = str(e)
+                raise
+            model_load_error = None
+            startup_timings['import'] = import_seconds
+            startup_timings.update(model_generator.load_timings)
+            startup_timings['total'] = time.perf_counter() - start
+            for phase, seconds in startup_timings.items():
+                metrics.MODEL_LOAD_SECONDS.set(seconds, phase=phase)
+            print(f"Model loaded successfully in {startup_timings['total']:.2f}s!")
+    
+    return model_generator
+
+def preload_model():
+    """Build the model generator eagerly (before gunicorn forks its workers)"""
+    try:
+        get_model_generator()
+    except Exception as e:
+        print(f"Error preloading model: {e}")
+        return
+    
+    # Move the model objects to the permanent GC generation so the collector
+    # never touches (and copies) their pages in forked workers
+    import gc
+    gc.collect()
+    gc.freeze()
+
+batch_scheduler = None
+if BATCH_WINDOW_MS > 0:
+    batch_scheduler = BatchScheduler(
+        get_model_generator,
+        max_batch_size=BATCH_MAX_SIZE,
+        window_ms=BATCH_WINDOW_MS
+    )
+
+def get_generation_backend():
+    """Return the object that runs generations: the batch scheduler or the model"""
+    generator = get_model_generator()
+    if batch_scheduler is not None:
+        # Share denoising runs with concurrent requests
+        return batch_scheduler
+    return generator
+
+reservoir = None
+if RESERVOIR_SIZE > 0:
+    reservoir = ImageReservoir(
+        get_generation_backend,
+        DISEASE_TYPES,
+        low_watermark=min(RESERVOIR_LOW, RESERVOIR_SIZE),
+        high_watermark=RESERVOIR_SIZE,
+        idle_seconds=RESERVOIR_IDLE_SECONDS
+    )
+
+def take_pooled_images(options):
+    """Take ready-made images for a request from the reservoir, if it can use them"""
+    if reservoir is None:
+        return []
+    # The model is loaded by now, so the filler can start
+    reservoir.start()
+    if not reservoir.accepts(options):
+        return []
+    # The page sends lower-case class names
+    return reservoir.take(options['disease'].upper(), options['count'])
+
+def live_generation():
+    """Context manager marking a live generation, which pauses reservoir refills"""
+    return reservoir.live() if reservoir is not None else nullcontext()
+
+generation_cache = None
+if GENERATION_CACHE_MB > 0:
+    generation_cache = GenerationCache(
+        GENERATION_CACHE_DIR,
+        max_bytes=GENERATION_CACHE_MB * 2**20
+    )
+
+def cache_keys(options, generator):
+    """Cache key of every image of a seeded request, or None if it is not cacheable"""
+    if generation_cache is None or options['seed'] is None:
+        return None
+    # Random (untrained) weights have no checkpoint hash and are never cached
+    if generator.checkpoint_hash is None:
+        return None
+    
+    sampler = generator._resolve_sampler(options['sampler'])
+    steps = generator._resolve_steps(sampler, options['steps'])
+    decoder = generator._resolve_decoder(options['decoder'])
+    bit_depth = BIT_DEPTHS[resolve_format(options['format'])]
+    guidance_scale = generator._resolve_guidance_scale(options['guidance_scale'])
+    return [
+        generation_cache.make_key(
+            generator.checkpoint_hash, sampler, steps, options['seed'] + index,
+            options['disease'], decoder, variant=generator.variant, bit_depth=bit_depth,
+            guidance_scale=guidance_scale, decode_mode=generator.decode_mode
         )
+        for index in range(options['count'])
+    ]
+
+def iter_request_images(options, backend, generator, progress_callback=None):
+    """
+    Produce the images of a request: reservoir first, then cache, then live generation
+    
+    Yields:
+        (index, PIL image, source) tuples, source being 'reservoir', 'cache'
+        or 'generated'. Indexes are not necessarily in order. With latent
+        storage, generated images are latents (see save_request_image)
+    """
+    count = options['count']
+    
+    # 1. Ready-made images (unseeded default requests only)
+    pooled = take_pooled_images(options)
+    for index, image in enumerate(pooled):
+        metrics.IMAGES.inc(source='reservoir')
+        yield index, image, 'reservoir'
+    
+    # 2. Seeded images generated before
+    keys = cache_keys(options, generator)
+    missing = []
+    for index in range(len(pooled), count):
+        image = generation_cache.get(keys[index]) if keys else None
+        if keys:
+            metrics.CACHE_LOOKUPS.inc(result='miss' if image is None else 'hit')
+        if image is None:
+            missing.append(index)
+        else:
+            metrics.IMAGES.inc(source='cache')
+            yield index, image, 'cache'
+    
+    if not missing:
+        return
+    
+    # 3. Generate the rest, each image with its own seed
+    seeds = None
+    if options['seed'] is not None:
+        seeds = [options['seed'] + index for index in missing]
+    with live_generation():
+        images = backend.iter_images(
+            num_images=len(missing),
+            disease_type=options['disease'],
+            sampler=options['sampler'],
+            num_inference_steps=options['steps'],
+            progress_callback=progress_callback,
+            decoder=options['decoder'],
+            seed=seeds,
+            image_format=options['format'],
+            storage=options['storage'],
+            guidance_scale=options['guidance_scale']
+        )
+        for offset, image in images:
+            index = missing[offset]
+            # Latents are not cached: the cache holds decoded images
+            if keys and options['storage'] == 'images':
+                generation_cache.put(keys[index], image)
+            metrics.IMAGES.inc(source='generated')
+            yield index, image, 'generated'
+
+def create_session_dir(options):
+    """Create the output folder for one generation request"""
+    # The sweeper runs in the process that serves requests
+    storage.start()
+    return storage.create_session(options['disease'], owner=options['owner'])
+
+def save_request_image(options, generator, session_dir, index, image, source, latents):
+    """
+    Queue the file of one request image, or store a live latent in the latent file
+    
+    Args:
+        options: Options returned by parse_generation_request
+        generator: The model generator
+        session_dir: Session folder
+        index: Position of the image in the request
+        image: PIL image, or a latent for generated images with latent storage
+        source: Where the image came from (see iter_request_images)
+        latents: Dict of the request's latents so far, updated here
         
-        # Convert to web-accessible paths
-        web_paths = []
-        for path in saved_paths:
-            # Get the absolute path and ensure it's within static/generated
-            abs_path = Path(path).resolve()
-            
-            # Verify the path is within our allowed directory
-            if not str(abs_path).startswith(str(output_dir)):
-                raise ValueError(f"Generated file path is not in allowed directory")
-            
-            # Create web path: /static/generated/session_id/filename.png
-            # Get relative path from project root to the image
-            project_root = Path.cwd()
-            rel_path = abs_path.relative_to(project_root)
-            web_path = '/' + str(rel_path).replace('\\', '/')
-            web_paths.append(web_path)
+    Returns:
+        Future resolving to the image's file path. Latent images are decoded
+        when the path is first requested (see generated_file)
+    """
+    disease = options['disease']
+    if options['storage'] == 'latents' and source == 'generated':
+        # Rewritten per image so the page can load the first ones meanwhile
+        latents[index] = image.numpy()
+        save_latents(session_dir, np.stack(list(latents.values())), list(latents),
+                     generator.latent_metadata(disease, options['decoder'], options['format']))
+        future = Future()
+        future.set_result(str(generator.image_file(disease, session_dir, index, options['format'])))
+        return future
+    return generator.submit_save(
+        image, disease, session_dir, index, options['format'],
+        thumbnail=index < MAX_DISPLAY_IMAGES
+    )
+
+def record_generation(options, generator, session_id, sources, started_at, error=None):
+    """
+    Queue the history record of a generation request (inserted in batches, see history.py)
+    
+    Args:
+        options: Options returned by parse_generation_request
+        generator: The model generator (resolves the default sampler, steps and decoder)
+        session_id: Id of the request's session folder
+        sources: Number of images per source (see iter_request_images)
+        started_at: UTC time the generation started
+        error: Error message if the generation failed
+    """
+    sampler = generator._resolve_sampler(options['sampler'])
+    history_writer.add({
+        'user_id': options['owner'],
+        'created_at': options['received_at'],
+        'endpoint': options['endpoint'],
+        'status': 'failed' if error else 'done',
+        'error': error,
+        'disease': options['disease'].upper(),
+        'count': options['count'],
+        'sampler': sampler,
+        'steps': generator._resolve_steps(sampler, options['steps']),
+        'decoder': generator._resolve_decoder(options['decoder']),
+        'seed': options['seed'],
+        'image_format': resolve_format(options['format']),
+        'storage': options['storage'],
+        'session_id': session_id,
+        'from_reservoir': sources['reservoir'],
+        'from_cache': sources['cache'],
+        'generated': sources['generated'],
+        'queue_seconds': (started_at - options['received_at']).total_seconds(),
+        'duration_seconds': (datetime.utcnow() - started_at).total_seconds()
+    })
+
+def to_web_path(path):
+    """Convert a generated file path to its /static/generated/... URL"""
+    # Get the absolute path and ensure it's within static/generated
+    abs_path = Path(path).resolve()
+    output_dir = GENERATED_DIR.resolve()
+    
+    # Verify the path is within our allowed directory
+    if not str(abs_path).startswith(str(output_dir)):
+        raise ValueError(f"Generated file path is not in allowed directory")
+    
+    # Create web path: /static/generated/session_id/filename.png
+    # Get relative path from project root to the image
+    project_root = Path.cwd()
+    rel_path = abs_path.relative_to(project_root)
+    return '/' + str(rel_path).replace('\\', '/')
+
+def run_generation(options, progress_callback=None):
+    """
+    Generate and save images for a validated request
+    
+    Args:
+        options: Options returned by parse_generation_request
+        progress_callback: Optional callable receiving progress dicts
+        
+    Returns:
+        Response payload with display image paths and the session id
+    """
+    disease = options['disease']
+    count = options['count']
+    
+    started_at = datetime.utcnow()
+    backend = get_generation_backend()
+    generator = get_model_generator()
+    check_model_support(options, generator)
+    session_id, session_dir = create_session_dir(options)
+    
+    # Serve what the reservoir and the cache have, generate only the rest.
+    # Files are written by the encoder pool while later images are generated
+    saved = {}
+    latents = {}
+    sources = {'reservoir': 0, 'cache': 0, 'generated': 0}
+    error = None
+    try:
+        with metrics.GENERATION_SECONDS.time():
+            for index, image, source in iter_request_images(options, backend, generator,
+                                                            progress_callback):
+                saved[index] = save_request_image(
+                    options, generator, session_dir, index, image, source, latents
+                )
+                sources[source] += 1
+            saved_paths = [saved[index].result() for index in sorted(saved)]
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        # Record the size, also of a partial session, so the quota counts it
+        storage.finish_session(session_id)
+        record_generation(options, generator, session_id, sources, started_at, error)
+    
+    print(f"✓ Saved {len(saved_paths)} images to {session_dir} "
+          f"({sources['reservoir']} from the reservoir, {sources['cache']} from the cache)")
+    
+    # Convert to web-accessible paths
+    web_paths = [to_web_path(path) for path in saved_paths]
+    
+    # Limit displayed images to maximum 6 samples, shown as previews
+    display_paths = web_paths[:MAX_DISPLAY_IMAGES]
+    thumbnails = [to_web_path(thumbnail_path(path)) for path in saved_paths[:MAX_DISPLAY_IMAGES]]
+    
+    return {
+        'success': True,
+        'images': display_paths,
+        'thumbnails': thumbnails,
+        'disease': disease,
+        'count': count,
+        'session_id': session_id,
+        'seed': options['seed'],
+        'format': resolve_format(options['format']),
+        'storage': options['storage'],
+        'from_reservoir': sources['reservoir'],
+        'from_cache': sources['cache']
+    }
+
+def sse_event(event, payload):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/generate', methods=['POST'])
+def generate():
+    """Handle image generation requests"""
+    data = request.get_json()
+    options, error = parse_generation_request(data)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    
+    try:
+        return jsonify(run_generation(options))
+    
+    except UnsupportedRequestError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error generating images: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_stream():
+    """Generate images and stream each one as server-sent events as it is saved"""
+    data = request.get_json()
+    options, error = parse_generation_request(data)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    
+    disease = options['disease']
+    count = options['count']
+    
+    started_at = datetime.utcnow()
+    try:
+        backend = get_generation_backend()
+        generator = get_model_generator()
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    try:
+        check_model_support(options, generator)
+    except UnsupportedRequestError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    session_id, session_dir = create_session_dir(options)
+    
+    def event_stream():
+        yield sse_event('start', {
+            'session_id': session_id,
+            'disease': disease,
+            'count': count
+        })
+        def image_event(index, path):
+            display = index < MAX_DISPLAY_IMAGES
+            return sse_event('image', {
+                'index': index,
+                'url': to_web_path(path),
+                'thumbnail': to_web_path(thumbnail_path(path)) if display else None,
+                'display': display
+            })
         
-        # Limit displayed images to maximum 6 samples
-        display_paths = web_paths[:display_count]
+        sources = {'reservoir': 0, 'cache': 0, 'generated': 0}
+        error = None
+        try:
+            # Pooled and cached images go out immediately, then the live ones;
+            # each event is sent once the encoder pool has written its file
+            with metrics.GENERATION_SECONDS.time():
+                saving = {}
+                latents = {}
+                for index, image, source in iter_request_images(options, backend, generator):
+                    saving[index] = save_request_image(
+                        options, generator, session_dir, index, image, source, latents
+                    )
+                    sources[source] += 1
+                    for saved in [saved for saved, future in saving.items() if future.done()]:
+                        yield image_event(saved, saving.pop(saved).result())
+                for index, future in saving.items():
+                    yield image_event(index, future.result())
+        except Exception as e:
+            print(f"Error generating images: {e}")
+            import traceback
+            traceback.print_exc()
+            error = str(e)
+            yield sse_event('error', {'success': False, 'error': str(e)})
+            return
+        finally:
+            storage.finish_session(session_id)
+            record_generation(options, generator, session_id, sources, started_at, error)
         
-        return jsonify({
+        yield sse_event('done', {
             'success': True,
-            'images': display_paths,
+            'session_id': session_id,
             'disease': disease,
-            'count': count,
-            'session_id': session_id
+            'count': count
         })
     
+    return Response(event_stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/generate/jobs', methods=['POST'])
+def create_generation_job():
+    """Queue an image generation job and return its id immediately"""
+    data = request.get_json()
+    options, error = parse_generation_request(data)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    
+    job = job_manager.submit(run_generation, options, owner=session.get('user_id'))
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('get_generation_job', job_id=job.id),
+        'events_url': url_for('generation_job_events', job_id=job.id)
+    }), 202
+
+def find_job(job_id):
+    """Return the job if it exists and belongs to the current user"""
+    job = job_manager.get(job_id)
+    if job is None or (job.owner is not None and job.owner != session.get('user_id')):
+        return None
+    return job
+
+@app.route('/generate/jobs/<job_id>', methods=['GET'])
+def get_generation_job(job_id):
+    """Poll the status, progress and result of a generation job"""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    return jsonify({'success': True, **job.to_dict()})
+
+@app.route('/generate/jobs/<job_id>/events', methods=['GET'])
+def generation_job_events(job_id):
+    """Stream job progress as server-sent events until the job finishes"""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    
+    def event_stream():
+        version = -1
+        while True:
+            new_version = job.wait_for_change(version, timeout=SSE_KEEPALIVE_SECONDS)
+            if new_version == version:
+                # Comment line keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
+                continue
+            version = new_version
+            snapshot = job.to_dict()
+            event = snapshot['status'] if job.finished else 'progress'
+            yield sse_event(event, snapshot)
+            if job.finished:
+                break
+    
+    return Response(event_stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+def decoded_file(session_id, session_dir, filename):
+    """
+    Contents of an image (or preview) of a latent session, decoded on first request
+    
+    Returns:
+        The encoded file, or None if the session stores no latent for it
+    """
+    key = (session_id, filename)
+    data = decoded_cache.get(key)
+    if data is not None:
+        return data
+    
+    stored = load_latents(session_dir)
+    if stored is None:
+        return None
+    latents, metadata = stored
+    
+    # Only the names the request's files would have had
+    names = {}
+    for index in latents:
+        name = latent_file_name(metadata, index)
+        names[name] = (index, False)
+        names[f"{THUMBNAIL_DIR}/{Path(name).stem}.webp"] = (index, True)
+    if filename not in names:
+        return None
+    index, thumbnail = names[filename]
+    
+    images, _ = get_model_generator().decode_saved(session_dir, [index])
+    data = encode_bytes(images[index], resolve_format(metadata['format']), thumbnail)
+    decoded_cache.put(key, data)
+    return data
+
+@app.route('/static/generated/<session_id>/<path:filename>', methods=['GET'])
+def generated_file(session_id, filename):
+    """Serve a generated file, decoding images of latent sessions on first request"""
+    # Validates the id and hides other users' sessions
+    session_dir = storage.get_session(session_id, owner=session.get('user_id'))
+    if session_dir is None:
+        return jsonify({'success': False, 'error': 'Session not found'}), 404
+    
+    try:
+        return send_from_directory(session_dir, filename)
+    except NotFound:
+        pass
+    
+    try:
+        data = decoded_file(session_id, session_dir, filename)
     except Exception as e:
-        print(f"Error generating images: {e}")
-        import traceback
-        traceback.print_exc()
+        print(f"Error decoding {session_id}/{filename}: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
+    if data is None:
+        return jsonify({'success': False, 'error': 'File not found'}), 404
+    mimetype = 'image/webp' if filename.endswith('.webp') else 'image/png'
+    return Response(data, mimetype=mimetype)
 
+def zip_response(session_id, session_dir):
+    """Stream the images of a session directory as a ZIP attachment"""
+    # Every output format; previews in thumbs/ are left out
+    suffixes = set(FILE_SUFFIXES.values())
+    members = {
+        img_file.name: img_file for img_file in session_dir.iterdir()
+        if img_file.is_file() and img_file.suffix in suffixes
+    }
+    # Images of a latent session are decoded while the archive streams
+    stored = load_latents(session_dir)
+    if stored is not None:
+        latents, metadata = stored
+        for index in latents:
+            name = latent_file_name(metadata, index)
+            members.setdefault(
+                name, lambda name=name: decoded_file(session_id, session_dir, name)
+            )
+    archive = ZipStream((members[name], name) for name in sorted(members))
+    download_name = f'{session_id}_images.zip'
+    
+    def stream():
+        # Streaming time, from the first to the last byte sent
+        with metrics.ZIP_SECONDS.time():
+            yield from archive
+    
+    headers = {'Content-Disposition': f'attachment; filename="{download_name}"'}
+    if archive.content_length is not None:
+        headers['Content-Length'] = str(archive.content_length)
+    return Response(stream(), mimetype='application/zip', headers=headers,
+                    direct_passthrough=True)
 
 @app.route('/download-batch', methods=['POST'])
 def download_batch():
@@ -413,25 +1124,13 @@ def download_batch():
         return jsonify({'success': False, 'error': 'No session ID provided'}), 400
     
     try:
-        session_dir = Path('./static/generated') / session_id
+        # Validates the id and hides other users' sessions
+        session_dir = storage.get_session(session_id, owner=session.get('user_id'))
         
-        if not session_dir.exists():
+        if session_dir is None:
             return jsonify({'success': False, 'error': 'Session not found'}), 404
         
-        # Create zip file in memory
-        memory_file = BytesIO()
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for img_file in session_dir.glob('*.png'):
-                zf.write(img_file, img_file.name)
-        
-        memory_file.seek(0)
-        
-        return send_file(
-            memory_file,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f'{session_id}_images.zip'
-        )
+        return zip_response(session_id, session_dir)
     
     except Exception as e:
         print(f"Error creating zip: {e}")
@@ -446,29 +1145,181 @@ def download_all(session_id):
         return jsonify({'success': False, 'error': 'No session ID provided'}), 400
     
     try:
-        session_dir = Path('./static/generated') / session_id
+        # Validates the id and hides other users' sessions
+        session_dir = storage.get_session(session_id, owner=session.get('user_id'))
         
-        if not session_dir.exists():
+        if session_dir is None:
             return jsonify({'success': False, 'error': 'Session not found'}), 404
         
-        # Create zip file in memory
-        memory_file = BytesIO()
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for img_file in session_dir.glob('*.png'):
-                zf.write(img_file, img_file.name)
-        
-        memory_file.seek(0)
-        
-        return send_file(
-            memory_file,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f'{session_id}_images.zip'
-        )
+        return zip_response(session_id, session_dir)
     
     except Exception as e:
         print(f"Error creating zip: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def parse_history_time(value):
+    """
+    Parse an ISO 8601 time query parameter to naive UTC (as stored)
+    
+    Raises:
+        ValueError: The value is not an ISO 8601 time
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def history_range(default_days=None):
+    """
+    Time range of a history query from its since/until parameters
+    
+    Returns:
+        ((since, until), None) on success or (None, error_message); since
+        defaults to default_days ago (None: no lower bound), until to no bound
+    """
+    bounds = {}
+    for name in ('since', 'until'):
+        value = request.args.get(name)
+        if value is None:
+            bounds[name] = None
+            continue
+        try:
+            bounds[name] = parse_history_time(value)
+        except ValueError:
+            return None, f"{name.capitalize()} must be an ISO 8601 time"
+    if bounds['since'] is None and default_days is not None:
+        bounds['since'] = datetime.utcnow() - timedelta(days=default_days)
+    return (bounds['since'], bounds['until']), None
+
+@app.route('/api/history', methods=['GET'])
+@login_required
+def generation_history():
+    """Generation history of the current user, newest first, one page at a time"""
+    time_range, error = history_range()
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    since, until = time_range
+    
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Limit must be an integer'}), 400
+    if limit < 1 or limit > HISTORY_MAX_PAGE_SIZE:
+        return jsonify({'success': False,
+                        'error': f'Limit must be between 1 and {HISTORY_MAX_PAGE_SIZE}'}), 400
+    
+    # Served by the (user_id, created_at) index; until is exclusive, so the
+    # oldest time of a page fetches the next one
+    query = GenerationRecord.query.filter(GenerationRecord.user_id == session['user_id'])
+    if since is not None:
+        query = query.filter(GenerationRecord.created_at >= since)
+    if until is not None:
+        query = query.filter(GenerationRecord.created_at < until)
+    records = query.order_by(GenerationRecord.created_at.desc()).limit(limit).all()
+    
+    return jsonify({
+        'success': True,
+        'jobs': [record.to_dict() for record in records],
+        'next_until': records[-1].to_dict()['created_at'] if len(records) == limit else None
+    })
+
+@app.route('/api/history/summary', methods=['GET'])
+@login_required
+def generation_history_summary():
+    """Requests, images and timings per disease class over a time range (all users)"""
+    time_range, error = history_range(default_days=7)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    since, until = time_range
+    
+    # Served by the created_at index
+    query = db.session.query(
+        GenerationRecord.disease,
+        db.func.count(GenerationRecord.id),
+        db.func.sum(db.case((GenerationRecord.status == 'failed', 1), else_=0)),
+        db.func.sum(GenerationRecord.count),
+        db.func.sum(GenerationRecord.generated),
+        db.func.avg(GenerationRecord.queue_seconds),
+        db.func.avg(GenerationRecord.duration_seconds),
+        db.func.max(GenerationRecord.duration_seconds)
+    ).filter(GenerationRecord.created_at >= since)
+    if until is not None:
+        query = query.filter(GenerationRecord.created_at < until)
+    
+    fields = ('requests', 'failed', 'images', 'generated', 'avg_queue_seconds',
+              'avg_duration_seconds', 'max_duration_seconds')
+    diseases = {}
+    for disease, *values in query.group_by(GenerationRecord.disease).all():
+        diseases[disease] = dict(zip(fields, values))
+    
+    return jsonify({
+        'success': True,
+        'since': since.isoformat() + 'Z',
+        'until': until.isoformat() + 'Z' if until is not None else None,
+        'diseases': diseases
+    })
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Readiness of this worker: model loaded (or loadable on demand)"""
+    if model_generator is not None:
+        status, code = 'ready', 200
+    elif model_load_error is not None:
+        status, code = 'error', 503
+    elif model_lock.locked():
+        status, code = 'loading', 503
+    elif PRELOAD_MODEL:
+        status, code = 'not_loaded', 503
+    else:
+        # Lazy mode: the model is loaded by the first generation request
+        status, code = 'ready', 200
+    
+    return jsonify({
+        'status': status,
+        'model_loaded': model_generator is not None,
+        'preload': PRELOAD_MODEL,
+        'error': model_load_error,
+        'pid': os.getpid(),
+        'batch_plan': model_generator.batch_plan if model_generator is not None else None,
+        'engine': model_generator.unet_engine.active if model_generator is not None else None,
+        'class_conditional': (model_generator.num_class_embeds is not None
+                              if model_generator is not None else None),
+        'startup': startup_timings or None,
+        'reservoir': reservoir.stats() if reservoir is not None else None,
+        'cache': generation_cache.stats() if generation_cache is not None else None,
+        'storage': storage.stats(),
+        'decoded_cache': decoded_cache.stats(),
+        'history': history_writer.stats()
+    }), code
+
+# Values read at scrape time
+metrics.QUEUE_DEPTH.set_function(lambda: {
+    ('jobs',): job_manager.pending_count(),
+    ('batch',): batch_scheduler.queue_depth() if batch_scheduler is not None else None,
+})
+if reservoir is not None:
+    metrics.RESERVOIR_IMAGES.set_function(
+        lambda: {(disease,): size for disease, size in reservoir.stats().items()}
+    )
+metrics.STORAGE_BYTES.set_function(lambda: storage.stats()['bytes'])
+metrics.HISTORY_PENDING.set_function(lambda: history_writer.stats()['pending'])
+if generation_cache is not None:
+    metrics.CACHE_BYTES.set_function(lambda: generation_cache.stats()['bytes'])
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint: pipeline latencies, counters and queue depths
+    
+    The metrics are those of the worker serving the scrape (labelled with its
+    pid), so totals and rates are only complete with WEB_CONCURRENCY=1.
+    """
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+# Eager preload: runs once in the gunicorn master when preload_app is enabled
+if PRELOAD_MODEL:
+    preload_model()
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # The reloader would import (and preload) the app twice
+    app.run(debug=True, use_reloader=not PRELOAD_MODEL)
\ No newline at end of file
@@ -0,0 +1,277 @@
+"""
+Generated image storage
+Creates the per-request session folders under static/generated, keeps an index
+of them (owner, size, age) and evicts old sessions in the background
+"""
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+
+# "<disease>_<unix time>_<random hex>"; ids without the random part come from
+# older versions and are still served
+SESSION_ID_PATTERN = re.compile(r'^[a-z0-9]+_\d+(_[0-9a-f]{8})?$')
+
+
+class SessionInfo:
+    """Index record of one session folder"""
+
+    def __init__(self, session_id, owner=None, created_at=None, size=0, complete=False):
+        self.session_id = session_id
+        self.owner = owner
+        self.created_at = time.time() if created_at is None else created_at
+        self.size = size
+        self.complete = complete
+
+    def to_dict(self):
+        return {
+            'session_id': self.session_id,
+            'owner': self.owner,
+            'created_at': self.created_at,
+            'size': self.size,
+            'complete': self.complete,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['session_id'], data.get('owner'), data.get('created_at'),
+                   data.get('size', 0), data.get('complete', False))
+
+
+class StorageManager:
+    """
+    Session folders with time-to-live and total-size quota eviction
+
+    Every session gets a collision-free id and an index record (owner, creation
+    time, size in bytes) stored as a small JSON file in index_dir, outside the
+    publicly served folder. Worker processes sharing the folder see each
+    other's sessions through these records. A background sweeper deletes
+    sessions older than ttl_seconds, then the oldest finished sessions until
+    the total fits max_bytes. A sweep lists only the top level of the two
+    folders; sizes are measured once, when a session is finished.
+    """
+
+    def __init__(self, root, index_dir, ttl_seconds=24 * 3600, max_bytes=2 * 2**30,
+                 sweep_seconds=300):
+        """
+        Initialize the storage
+
+        Args:
+            root: Folder holding the session folders (created if missing)
+            index_dir: Folder holding the index records (created if missing)
+            ttl_seconds: Age after which a session is deleted (0 keeps sessions)
+            max_bytes: Total size sessions are trimmed back to (0 for no quota)
+            sweep_seconds: Pause between two background sweeps
+        """
+        self.root = Path(root).resolve()
+        self.index_dir = Path(index_dir)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sweep_seconds = sweep_seconds
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.sweep()
+
+    def create_session(self, disease, owner=None):
+        """
+        Create the folder for one generation request
+
+        Args:
+            disease: Disease class, used as the readable prefix of the id
+            owner: Id of the user the images belong to, if any
+
+        Returns:
+            Tuple of (session id, session folder)
+        """
+        prefix = re.sub(r'[^a-z0-9]+', '', str(disease).lower()) or 'session'
+        while True:
+            session_id = f"{prefix}_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+            session_dir = self.root / session_id
+            try:
+                session_dir.mkdir()
+                break
+            except FileExistsError:
+                continue
+
+        info = SessionInfo(session_id, owner)
+        with self._lock:
+            self._sessions[session_id] = info
+        self._write_record(info)
+        return session_id, session_dir
+
+    def finish_session(self, session_id):
+        """Record the final size of a session once its files are written"""
+        with self._lock:
+            info = self._sessions.get(session_id)
+        if info is None:
+            return
+        info.size = self._folder_size(self.root / session_id)
+        info.complete = True
+        self._write_record(info)
+
+    def get_session(self, session_id, owner=None):
+        """
+        Look up the folder of a session
+
+        Args:
+            session_id: Id from the request (validated here)
+            owner: Id of the requesting user; sessions of other users are hidden
+
+        Returns:
+            The session folder, or None if the id is malformed, the session does
+            not exist or belongs to someone else
+        """
+        if not isinstance(session_id, str) or not SESSION_ID_PATTERN.match(session_id):
+            return None
+        session_dir = self.root / session_id
+        if not session_dir.is_dir():
+            return None
+
+        info = self._lookup(session_id)
+        if info is not None and info.owner is not None and info.owner != owner:
+            return None
+        return session_dir
+
+    def stats(self):
+        """Number and total size of the indexed sessions"""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'bytes': sum(info.size for info in self._sessions.values()),
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+            }
+
+    def start(self):
+        """Start the background sweeper (idempotent)"""
+        with self._lock:
+            # Started lazily so the thread lives in the process that serves
+            # requests (threads do not survive a fork)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._worker, name='storage-sweeper', daemon=True
+                )
+                self._thread.start()
+
+    def _worker(self):
+        while True:
+            time.sleep(self.sweep_seconds)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Storage sweep failed: {e}")
+
+    def sweep(self):
+        """
+        Sync the index with the disk and evict expired and over-quota sessions
+
+        Returns:
+            Number of sessions deleted
+        """
+        self._sync()
+        now = time.time()
+        with self._lock:
+            sessions = sorted(self._sessions.values(), key=lambda info: info.created_at)
+
+        # 1. Sessions past their time-to-live (unfinished ones too: their
+        #    request died long ago)
+        evicted = []
+        if self.ttl_seconds:
+            evicted = [info for info in sessions if now - info.created_at > self.ttl_seconds]
+
+        # 2. Oldest finished sessions until the rest fits the quota
+        if self.max_bytes:
+            kept = [info for info in sessions if info not in evicted]
+            total = sum(info.size for info in kept)
+            for info in kept:
+                if total <= self.max_bytes:
+                    break
+                if info.complete:
+                    evicted.append(info)
+                    total -= info.size
+
+        for info in evicted:
+            self._delete(info.session_id)
+        if evicted:
+            print(f"Storage: evicted {len(evicted)} session(s)")
+        return len(evicted)
+
+    def _sync(self):
+        """Pick up sessions of other workers and drop sessions deleted elsewhere"""
+        on_disk = {entry.name for entry in os.scandir(self.root)
+                   if entry.is_dir() and SESSION_ID_PATTERN.match(entry.name)}
+        with self._lock:
+            known = set(self._sessions)
+        for session_id in known - on_disk:
+            with self._lock:
+                self._sessions.pop(session_id, None)
+            self._record_path(session_id).unlink(missing_ok=True)
+        for session_id in on_disk:
+            info = self._lookup(session_id)
+            # Records of other workers change when they finish a session
+            if info is None or not info.complete:
+                self._lookup(session_id, reload=True)
+
+    def _lookup(self, session_id, reload=False):
+        """Index record of a session, read from disk if this process does not know it"""
+        with self._lock:
+            info = self._sessions.get(session_id)
+        if info is not None and not reload:
+            return info
+
+        try:
+            info = SessionInfo.from_dict(json.loads(self._record_path(session_id).read_text()))
+        except (OSError, ValueError, KeyError):
+            session_dir = self.root / session_id
+            if info is not None or not session_dir.is_dir():
+                return info
+            # Folder without a record (older versions): measure it once
+            info = SessionInfo(session_id, created_at=session_dir.stat().st_mtime,
+                               size=self._folder_size(session_dir), complete=True)
+            self._write_record(info)
+        with self._lock:
+            self._sessions[session_id] = info
+        return info
+
+    def _delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        shutil.rmtree(self.root / session_id, ignore_errors=True)
+        self._record_path(session_id).unlink(missing_ok=True)
+
+    def _record_path(self, session_id):
+        return self.index_dir / f"{session_id}.json"
+
+    def _write_record(self, info):
+        """Write an index record atomically, so other workers never read a partial one"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(info.to_dict(), f)
+            os.replace(tmp_path, self._record_path(info.session_id))
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    @staticmethod
+    def _folder_size(path):
+        """Bytes of the files in a session folder and its subfolders (thumbs/)"""
+        size = 0
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue
+        return size
@@ -0,0 +1,44 @@
+"""
+Test configuration
+Makes the top-level modules of the repository importable from the tests and
+builds generators with small random-weight models for the model tests
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Small stand-ins for the VAE and U-Net architectures: same latent shape,
+# random weights, fast enough on a CPU
+TINY_VAE_CONFIG = {
+    "block_out_channels": (16, 16, 32, 32),
+    "layers_per_block": 1,
+    "norm_num_groups": 8,
+}
+TINY_UNET_CONFIG = {
+    "block_out_channels": (32, 32, 64, 64),
+    "layers_per_block": 1,
+    "norm_num_groups": 8,
+}
+
+
+@pytest.fixture
+def make_generator(monkeypatch):
+    """Factory of MedicalImageGenerators with small random-weight models (no download)"""
+    torch = pytest.importorskip('torch')
+    pytest.importorskip('diffusers')
+    from config import Config
+    monkeypatch.setattr(Config, 'VAE_CONFIG', {**Config.VAE_CONFIG, **TINY_VAE_CONFIG})
+    monkeypatch.setattr(Config, 'UNET_CONFIG', {**Config.UNET_CONFIG, **TINY_UNET_CONFIG})
+    from model_inference import MedicalImageGenerator
+
+    def make(**options):
+        options.setdefault('device', 'cpu')
+        options.setdefault('pretrained_vae', False)
+        torch.manual_seed(0)
+        return MedicalImageGenerator(**options)
+
+    return make
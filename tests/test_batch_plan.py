@@ -0,0 +1,88 @@
+"""Tests for the memory-based batch size plan"""
+
+import pytest
+
+from config import Config
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    """Fixes the available memory and the probed per-sample costs"""
+    import model_inference
+    costs = {}
+
+    def fake_measure(run, device):
+        return costs['bytes_per_sample']
+
+    def set_budget(available, bytes_per_sample):
+        monkeypatch.setattr(model_inference, 'available_memory', lambda device: available)
+        costs['bytes_per_sample'] = bytes_per_sample
+
+    monkeypatch.setattr(model_inference, 'measure_activation_bytes', fake_measure)
+    return set_budget
+
+
+def test_plan_fits_budget(make_generator, budget):
+    budget(200 * MB, 10 * MB)
+    plan = make_generator(decode_mode="full").plan_batch_sizes()
+
+    # Half of 200 MB at 10 MB per sample
+    assert plan['unet_batch_size'] == 10
+    assert plan['guided_unet_batch_size'] == 5
+    assert plan['decode_batch_size'] == 10
+    assert plan['unet_bytes_per_sample'] == 10 * MB
+
+
+def test_plan_is_capped(make_generator, budget):
+    budget(100_000 * MB, 1 * MB)
+    plan = make_generator(decode_mode="full").plan_batch_sizes()
+
+    assert plan['unet_batch_size'] == Config.MAX_UNET_BATCH_SIZE
+    assert plan['guided_unet_batch_size'] == Config.MAX_UNET_BATCH_SIZE
+    assert plan['decode_batch_size'] == Config.MAX_DECODE_BATCH_SIZE
+
+
+def test_plan_without_memory_info(make_generator, budget):
+    budget(None, 10 * MB)
+    plan = make_generator(decode_mode="full").plan_batch_sizes()
+
+    assert plan['unet_batch_size'] == 4
+    assert plan['guided_unet_batch_size'] == 2
+
+
+def test_explicit_batch_size_wins(make_generator, budget):
+    budget(200 * MB, 10 * MB)
+    plan = make_generator(batch_size=6, decode_batch_size=3).plan_batch_sizes()
+
+    assert plan['unet_batch_size'] == 6
+    assert plan['guided_unet_batch_size'] == 3
+    assert plan['decode_batch_size'] == 3
+    assert plan['unet_bytes_per_sample'] is None
+
+
+def test_probe_sees_skip_activations(make_generator):
+    torch = pytest.importorskip('torch')
+    from model_inference import measure_activation_bytes
+    generator = make_generator()
+    generator.model.eval()
+    latents = torch.randn(1, Config.LATENT_CHANNELS, Config.LATENT_SIZE, Config.LATENT_SIZE)
+    timestep = torch.tensor([Config.TIMESTEPS - 1])
+
+    # Largest single layer output of the pass
+    largest = 0
+
+    def record(module, inputs, output):
+        nonlocal largest
+        if isinstance(output, torch.Tensor):
+            largest = max(largest, output.numel() * output.element_size())
+
+    handles = [module.register_forward_hook(record) for module in generator.model.modules()]
+    with torch.no_grad():
+        generator.model(latents, timestep)
+    for handle in handles:
+        handle.remove()
+
+    peak = measure_activation_bytes(lambda: generator.model(latents, timestep), 'cpu')
+    assert peak / Config.ACTIVATION_SAFETY_FACTOR > 2 * largest
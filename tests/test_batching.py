@@ -0,0 +1,277 @@
+"""Tests of cross-request batching, with a stand-in for the model generator"""
+
+import inspect
+import threading
+
+import pytest
+
+from batching import BatchScheduler
+
+CLASS_LABELS = {'NORMAL': 0, 'PNEUMONIA': 1, 'TUBERCULOSIS': 2}
+
+
+class FakeLatents(list):
+    """Batch of latents: a list, plus the tensor methods the scheduler uses"""
+
+    def __getitem__(self, index):
+        item = super().__getitem__(index)
+        return FakeLatents(item) if isinstance(index, slice) else item
+
+    def float(self):
+        return self
+
+    def cpu(self):
+        return self
+
+
+class FakeScheduler:
+    def set_timesteps(self, num_inference_steps, device=None):
+        self.num_inference_steps = num_inference_steps
+
+
+class FakeGenerator:
+    """
+    Records the runs of the scheduler instead of denoising
+
+    A latent is the seed it was drawn from; a decoded image is the string
+    "<seed>:<class label>:<decoder>", so tests can tell where every image
+    came from.
+    """
+
+    device = 'cpu'
+
+    def __init__(self, class_conditional=False, fail=False):
+        self.class_conditional = class_conditional
+        self.fail = fail
+        self.runs = []  # (sampler steps, latents, class labels, guidance scale) per run
+        self.decodes = []  # (latents, decode batch size, decode mode) per decode call
+        self._labels = {}
+
+    def _resolve_sampler(self, sampler):
+        return sampler or 'ddim'
+
+    def _resolve_steps(self, sampler, num_inference_steps):
+        return num_inference_steps or 50
+
+    def _resolve_decoder(self, decoder):
+        return decoder or 'vae'
+
+    def get_decoder(self, decoder=None):
+        return decoder
+
+    def _resolve_seeds(self, seed, num_images):
+        return None if seed is None else [seed + index for index in range(num_images)]
+
+    def _resolve_storage(self, storage):
+        return storage or 'images'
+
+    def _class_names(self, disease_type, num_images):
+        if isinstance(disease_type, (list, tuple)):
+            return list(disease_type)
+        return [disease_type] * num_images
+
+    def _resolve_class_labels(self, class_names):
+        if not self.class_conditional:
+            return None
+        return [CLASS_LABELS[name.upper()] for name in class_names]
+
+    def _resolve_guidance_scale(self, guidance_scale):
+        return 1.0 if guidance_scale is None else float(guidance_scale)
+
+    def _resolve_decode_mode(self, decode_mode):
+        return decode_mode or 'full'
+
+    def make_scheduler(self, sampler):
+        return FakeScheduler()
+
+    def make_generators(self, seeds):
+        return list(seeds)
+
+    def sample_latents(self, num_samples, scheduler, generators=None):
+        if generators is None:
+            return FakeLatents(f'random{index}' for index in range(num_samples))
+        return FakeLatents(generators)
+
+    def denoise(self, latents, scheduler, num_inference_steps, step_callback=None, desc=None,
+                generators=None, class_labels=None, guidance_scale=1.0):
+        if self.fail:
+            raise RuntimeError('out of memory')
+        self.runs.append((num_inference_steps, list(latents), class_labels, guidance_scale))
+        for latent, label in zip(latents, class_labels or [None] * len(latents)):
+            self._labels[latent] = label
+        if step_callback is not None:
+            step_callback(num_inference_steps)
+        return latents
+
+    def decode_latents(self, latents, decode_batch_size=None, decode_mode=None, decoder=None,
+                       bit_depth=8):
+        self.decodes.append((list(latents), decode_batch_size, decode_mode))
+        return [f'{latent}:{self._labels[latent]}:{decoder}' for latent in latents]
+
+
+def make_scheduler(generator, max_batch_size=8, window_ms=200):
+    return BatchScheduler(lambda: generator, max_batch_size=max_batch_size, window_ms=window_ms)
+
+
+def test_concurrent_requests_share_one_run():
+    generator = FakeGenerator()
+    scheduler = make_scheduler(generator)
+
+    first = scheduler.submit(num_images=2, disease_type='NORMAL', seed=10)
+    second = scheduler.submit(num_images=3, disease_type='NORMAL', seed=20, decoder='taesd')
+
+    assert first.result(timeout=5) == ['10:None:vae', '11:None:vae']
+    assert second.result(timeout=5) == ['20:None:taesd', '21:None:taesd', '22:None:taesd']
+    assert [run[1] for run in generator.runs] == [[10, 11, 20, 21, 22]]
+
+
+def test_requests_are_split_into_runs_of_max_batch_size():
+    generator = FakeGenerator()
+    scheduler = make_scheduler(generator, max_batch_size=2, window_ms=0)
+
+    images = scheduler.generate_images(num_images=5, seed=0)
+
+    assert images == [f'{seed}:None:vae' for seed in range(5)]
+    assert [run[1] for run in generator.runs] == [[0, 1], [2, 3], [4]]
+
+
+def test_requests_with_different_sampling_do_not_share_a_run():
+    generator = FakeGenerator()
+    scheduler = make_scheduler(generator)
+
+    fast = scheduler.submit(num_images=1, seed=0, num_inference_steps=10)
+    slow = scheduler.submit(num_images=1, seed=5, num_inference_steps=50)
+    fast.result(timeout=5)
+    slow.result(timeout=5)
+
+    assert sorted((run[0], run[1]) for run in generator.runs) == [(10, [0]), (50, [5])]
+
+
+def test_classes_mix_in_one_run_of_a_class_conditional_unet():
+    generator = FakeGenerator(class_conditional=True)
+    scheduler = make_scheduler(generator)
+
+    normal = scheduler.submit(num_images=2, disease_type='NORMAL', seed=0)
+    mixed = scheduler.submit(num_images=2, disease_type=['PNEUMONIA', 'TUBERCULOSIS'], seed=5)
+
+    assert normal.result(timeout=5) == ['0:0:vae', '1:0:vae']
+    assert mixed.result(timeout=5) == ['5:1:vae', '6:2:vae']
+    assert [run[2] for run in generator.runs] == [[0, 0, 1, 2]]
+
+
+def test_guided_runs_take_half_the_batch():
+    generator = FakeGenerator(class_conditional=True)
+    scheduler = make_scheduler(generator, max_batch_size=4, window_ms=0)
+
+    scheduler.generate_images(num_images=4, seed=0, guidance_scale=3.0)
+
+    assert [(run[1], run[3]) for run in generator.runs] == [([0, 1], 3.0), ([2, 3], 3.0)]
+
+
+def test_seeded_images_do_not_depend_on_their_batch():
+    alone = make_scheduler(FakeGenerator()).generate_images(num_images=3, seed=7)
+
+    scheduler = make_scheduler(FakeGenerator(), max_batch_size=2)
+    other = scheduler.submit(num_images=1, seed=100)
+    batched = scheduler.generate_images(num_images=3, seed=7)
+    other.result(timeout=5)
+
+    assert batched == alone
+
+
+def test_latent_storage_hands_out_latents():
+    generator = FakeGenerator()
+    scheduler = make_scheduler(generator)
+
+    latents = scheduler.submit(num_images=2, seed=3, storage='latents')
+    images = scheduler.submit(num_images=1, seed=9)
+
+    assert latents.result(timeout=5) == [3, 4]
+    assert images.result(timeout=5) == ['9:None:vae']
+    assert [run[1] for run in generator.runs] == [[3, 4, 9]]
+
+
+def test_iter_images_yields_every_run_in_order():
+    scheduler = make_scheduler(FakeGenerator(), max_batch_size=2, window_ms=0)
+
+    indexed = list(scheduler.iter_images(num_images=3, seed=0))
+
+    assert indexed == [(0, '0:None:vae'), (1, '1:None:vae'), (2, '2:None:vae')]
+
+
+def test_progress_is_reported_per_run():
+    scheduler = make_scheduler(FakeGenerator(), max_batch_size=2, window_ms=0)
+    reports = []
+
+    scheduler.generate_images(num_images=3, seed=0, progress_callback=reports.append)
+
+    decoded = [report for report in reports if report['stage'] == 'decoded']
+    assert [report['images_done'] for report in decoded] == [2, 3]
+    assert decoded[-1]['num_images'] == 3
+
+
+def test_failed_run_fails_its_requests():
+    scheduler = make_scheduler(FakeGenerator(fail=True), window_ms=0)
+
+    with pytest.raises(RuntimeError, match='out of memory'):
+        scheduler.submit(num_images=2).result(timeout=5)
+    with pytest.raises(RuntimeError, match='out of memory'):
+        list(scheduler.iter_images(num_images=2))
+
+
+def test_queue_depth_counts_unscheduled_images():
+    started = threading.Event()
+    release = threading.Event()
+    generator = FakeGenerator()
+    denoise = generator.denoise
+
+    def blocking_denoise(*args, **kwargs):
+        started.set()
+        release.wait(5)
+        return denoise(*args, **kwargs)
+
+    generator.denoise = blocking_denoise
+    scheduler = make_scheduler(generator, max_batch_size=2, window_ms=0)
+
+    future = scheduler.submit(num_images=5, seed=0)
+    assert started.wait(5)
+    assert scheduler.queue_depth() == 3
+    release.set()
+    future.result(timeout=5)
+    assert scheduler.queue_depth() == 0
+
+
+def test_decode_options_apply_to_each_requests_own_images():
+    generator = FakeGenerator()
+    scheduler = make_scheduler(generator)
+
+    tiled = scheduler.submit(num_images=2, seed=0, decode_mode='tiled', decode_batch_size=1)
+    full = scheduler.submit(num_images=1, seed=10)
+    tiled.result(timeout=5)
+    full.result(timeout=5)
+
+    assert [run[1] for run in generator.runs] == [[0, 1, 10]]
+    assert generator.decodes == [([0, 1], 1, 'tiled'), ([10], None, 'full')]
+
+
+def test_batch_size_caps_the_runs_a_request_joins():
+    generator = FakeGenerator()
+    scheduler = make_scheduler(generator, max_batch_size=8)
+
+    small = scheduler.submit(num_images=3, seed=0, batch_size=2)
+    large = scheduler.submit(num_images=3, seed=10)
+    small.result(timeout=5)
+    large.result(timeout=5)
+
+    assert all(len(run[1]) <= 2 for run in generator.runs[:2])
+    assert sorted(seed for run in generator.runs for seed in run[1]) == [0, 1, 2, 10, 11, 12]
+
+
+def test_signatures_match_the_generator():
+    model_inference = pytest.importorskip('model_inference')
+    generator_class = model_inference.MedicalImageGenerator
+
+    for name in ('iter_images', 'generate_images'):
+        expected = inspect.signature(getattr(generator_class, name))
+        actual = inspect.signature(getattr(BatchScheduler, name))
+        assert list(actual.parameters) == list(expected.parameters)
@@ -0,0 +1,67 @@
+"""Tests of the offline weight bundle"""
+
+import json
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def exported(make_generator, tmp_path):
+    """A generator with random weights and the bundle exported from it"""
+    pytest.importorskip('safetensors')
+    generator = make_generator()
+    bundle_path = tmp_path / 'bundle'
+    generator.export_bundle(bundle_path)
+    return generator, bundle_path
+
+
+def test_bundle_round_trip(exported, make_generator):
+    torch = pytest.importorskip('torch')
+    generator, bundle_path = exported
+    assert sorted(path.name for path in bundle_path.iterdir()) == [
+        'bundle.json', 'unet.safetensors', 'vae.safetensors'
+    ]
+
+    bundled = make_generator(bundle_path=bundle_path)
+    for original, loaded in ((generator.model, bundled.model), (generator.vae, bundled.vae)):
+        expected = original.state_dict()
+        actual = loaded.state_dict()
+        assert expected.keys() == actual.keys()
+        assert all(torch.equal(expected[key], actual[key]) for key in expected)
+    assert bundled.checkpoint_hash == generator.checkpoint_hash
+    assert bundled.num_class_embeds == generator.num_class_embeds
+    assert not bundled.pretrained_vae
+
+    # Same weights, same seed: same pixels
+    options = {'num_images': 1, 'disease_type': 'NORMAL', 'num_inference_steps': 2, 'seed': 3}
+    [expected_image] = generator.generate_images(**options)
+    [bundled_image] = bundled.generate_images(**options)
+    assert np.array_equal(np.asarray(expected_image), np.asarray(bundled_image))
+
+
+def test_missing_bundle(make_generator, tmp_path):
+    pytest.importorskip('safetensors')
+    with pytest.raises(FileNotFoundError):
+        make_generator(bundle_path=tmp_path / 'missing')
+
+
+def test_incomplete_bundle_is_rejected(exported, make_generator):
+    from safetensors.torch import load_file, save_file
+    _, bundle_path = exported
+    weights = load_file(str(bundle_path / 'unet.safetensors'))
+    weights.pop(next(iter(weights)))
+    save_file(weights, str(bundle_path / 'unet.safetensors'))
+
+    with pytest.raises((ValueError, RuntimeError)):
+        make_generator(bundle_path=bundle_path)
+
+
+def test_manifest_records_configs(exported):
+    generator, bundle_path = exported
+    manifest = json.loads((bundle_path / 'bundle.json').read_text())
+
+    assert manifest['vae_model'] is None  # Random VAE weights
+    assert manifest['unet_config']['block_out_channels'] == list(
+        generator.model.config.block_out_channels
+    )
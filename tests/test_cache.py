@@ -0,0 +1,93 @@
+"""Tests of the content-addressed generation cache"""
+
+import os
+
+import numpy as np
+from PIL import Image
+
+from cache import GenerationCache
+
+KEY_ARGS = ('checkpoint', 'ddim', 50, 7, 'normal', 'vae')
+
+
+def make_image(value, size=64):
+    """Grey noise image, different for every value"""
+    rng = np.random.default_rng(value)
+    return Image.fromarray(rng.integers(0, 256, (size, size), dtype=np.uint8), mode='L')
+
+
+def test_key_depends_on_every_field():
+    base = GenerationCache.make_key(*KEY_ARGS)
+    variants = [
+        GenerationCache.make_key('other', 'ddim', 50, 7, 'normal', 'vae'),
+        GenerationCache.make_key('checkpoint', 'dpm', 50, 7, 'normal', 'vae'),
+        GenerationCache.make_key('checkpoint', 'ddim', 20, 7, 'normal', 'vae'),
+        GenerationCache.make_key('checkpoint', 'ddim', 50, 8, 'normal', 'vae'),
+        GenerationCache.make_key('checkpoint', 'ddim', 50, 7, 'pneumonia', 'vae'),
+        GenerationCache.make_key('checkpoint', 'ddim', 50, 7, 'normal', 'taesd'),
+        GenerationCache.make_key(*KEY_ARGS, variant='dynamic-fp32-nchw'),
+        GenerationCache.make_key(*KEY_ARGS, bit_depth=16),
+        GenerationCache.make_key(*KEY_ARGS, guidance_scale=3.0),
+        GenerationCache.make_key(*KEY_ARGS, decode_mode='tiled'),
+    ]
+    assert len({base, *variants}) == len(variants) + 1
+
+
+def test_key_defaults_keep_existing_keys():
+    base = GenerationCache.make_key(*KEY_ARGS)
+
+    assert GenerationCache.make_key(*KEY_ARGS, bit_depth=8, guidance_scale=1.0,
+                                    decode_mode='full') == base
+    # The class name is case-insensitive
+    assert GenerationCache.make_key('checkpoint', 'ddim', 50, 7, 'NORMAL', 'vae') == base
+
+
+def test_put_then_get(tmp_path):
+    cache = GenerationCache(tmp_path)
+    key = GenerationCache.make_key(*KEY_ARGS)
+    image = make_image(1)
+
+    assert cache.get(key) is None
+    cache.put(key, image)
+
+    cached = cache.get(key)
+    assert np.array_equal(np.asarray(cached), np.asarray(image))
+    assert cache.stats()['bytes'] == os.path.getsize(cache._path(key))
+    assert not list(tmp_path.glob('*/*.tmp'))
+
+
+def test_size_is_recovered_on_startup(tmp_path):
+    cache = GenerationCache(tmp_path)
+    cache.put('a' * 64, make_image(1))
+
+    assert GenerationCache(tmp_path).stats()['bytes'] == cache.stats()['bytes']
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = GenerationCache(tmp_path)
+    keys = [f'{index:064x}' for index in range(3)]
+    for index, key in enumerate(keys):
+        cache.put(key, make_image(0))  # Same PNG, same size
+        # Distinct, increasing last-use stamps
+        os.utime(cache._path(key), (1000 + index, 1000 + index))
+    entry_size = os.path.getsize(cache._path(keys[0]))
+
+    # Reading the oldest entry makes it the most recently used
+    assert cache.get(keys[0]) is not None
+
+    cache.max_bytes = 3 * entry_size
+    cache.put(f'{3:064x}', make_image(0))
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+
+def test_unreadable_entry_is_a_miss(tmp_path):
+    cache = GenerationCache(tmp_path)
+    key = 'b' * 64
+    cache._path(key).parent.mkdir(parents=True)
+    cache._path(key).write_bytes(b'not a png')
+
+    assert cache.get(key) is None
@@ -0,0 +1,215 @@
+"""Tests of the Gemini chat client against the local stand-in server"""
+
+import threading
+import time
+
+import pytest
+
+import chat_client
+from chat_client import ChatError, GeminiClient, ResponseCache, normalize_question
+from mock_gemini import make_server
+
+
+@pytest.fixture
+def gemini():
+    """Factory starting stand-in servers; they are shut down after the test"""
+    servers = []
+
+    def start(**options):
+        server = make_server(port=0, quiet=True, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        host, port = server.server_address[:2]
+        return server, f"http://{host}:{port}/v1beta"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def make_client(base_url, **options):
+    options.setdefault('backoff_seconds', 0.01)
+    return GeminiClient('test-key', base_url=base_url, **options)
+
+
+def test_normalize_question():
+    assert normalize_question('  What is  PNEUMONIA?? ') == 'what is pneumonia'
+    assert normalize_question('What is pneumonia') == normalize_question('what is pneumonia.')
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.put('a', 'answer a')
+    cache.put('b', 'answer b')
+    assert cache.get('a') == 'answer a'  # Now the most recently used
+
+    cache.put('c', 'answer c')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 'answer a'
+    assert len(cache) == 2
+
+
+def test_response_cache_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(chat_client.time, 'monotonic', lambda: now[0])
+    cache = ResponseCache(ttl=10)
+    cache.put('a', 'answer a')
+
+    now[0] += 9
+    assert cache.get('a') == 'answer a'
+    now[0] += 2
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_disabled_response_cache_keeps_nothing():
+    cache = ResponseCache(max_entries=0)
+    cache.put('a', 'answer a')
+
+    assert cache.get('a') is None
+
+
+def test_ask_answers_then_serves_from_cache(gemini):
+    server, base_url = gemini()
+    client = make_client(base_url)
+
+    answer, outcome = client.ask('What is tuberculosis?')
+    assert outcome == 'ok'
+    assert 'What is tuberculosis?' in answer
+
+    assert client.ask('what is  tuberculosis') == (answer, 'cached')
+    assert client.cached('WHAT IS TUBERCULOSIS') == answer
+    assert server.requests == 1
+
+
+def test_identical_concurrent_questions_share_one_call(gemini):
+    server, base_url = gemini(delay=0.3)
+    client = make_client(base_url)
+    results = []
+
+    def ask():
+        results.append(client.ask('Is pneumonia contagious?'))
+
+    threads = [threading.Thread(target=ask) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert server.requests == 1
+    assert len(results) == 5
+    assert len({answer for answer, _ in results}) == 1
+    assert client.stats() == {'cached_answers': 1, 'inflight': 0}
+
+
+def test_retryable_failures_are_retried_then_raised(gemini):
+    server, base_url = gemini(fail_rate=1.0)
+    client = make_client(base_url, max_retries=2)
+
+    with pytest.raises(ChatError) as error:
+        client.ask('What is a chest X-ray?')
+
+    assert error.value.status == 503
+    assert error.value.outcome == 'error'
+    assert server.requests == 3
+    assert client.stats()['inflight'] == 0
+
+
+def test_client_errors_are_not_retried(gemini):
+    server, base_url = gemini()
+    client = make_client(base_url.replace('/v1beta', '/v0'), max_retries=2)
+
+    with pytest.raises(ChatError) as error:
+        client.ask('What is a chest X-ray?')
+
+    assert error.value.status == 404
+    assert server.requests == 0
+
+
+def test_timeouts_are_not_retried(gemini):
+    server, base_url = gemini(delay=0.5)
+    client = make_client(base_url, timeout=0.1, max_retries=2)
+
+    start = time.perf_counter()
+    with pytest.raises(ChatError) as error:
+        client.ask('What is a chest X-ray?')
+
+    assert error.value.outcome == 'timeout'
+    assert time.perf_counter() - start < 0.5
+    assert server.requests == 1
+
+
+def test_unreachable_api_raises():
+    # Nothing listens on port 9 (discard) here
+    client = make_client('http://127.0.0.1:9/v1beta', max_retries=1)
+
+    with pytest.raises(ChatError) as error:
+        client.ask('What is a chest X-ray?')
+
+    assert error.value.outcome == 'error'
+    assert error.value.status is None
+
+
+def test_backoff_honours_retry_after_up_to_the_limit():
+    client = GeminiClient('test-key', backoff_seconds=1, max_backoff_seconds=4)
+
+    assert client._backoff(0, '2') == 2
+    assert client._backoff(0, '60') == 4
+    assert 0.5 <= client._backoff(0) <= 1
+    assert 2 <= client._backoff(5, 'Wed, 21 Oct 2026 07:28:00 GMT') <= 4
+
+
+def test_stream_yields_the_answer_in_pieces_and_caches_it(gemini):
+    server, base_url = gemini()
+    client = make_client(base_url)
+
+    pieces = list(client.stream('How is tuberculosis diagnosed?'))
+
+    assert len(pieces) > 1
+    answer = ''.join(pieces)
+    assert 'How is tuberculosis diagnosed?' in answer
+    assert client.cached('how is tuberculosis diagnosed') == answer
+    # The same text as the non-streaming endpoint
+    assert client.complete(client._prompt('How is tuberculosis diagnosed?')) == answer
+    assert server.requests == 2
+
+
+def test_stream_pieces_arrive_before_the_answer_is_finished(gemini):
+    _, base_url = gemini(chunk_delay=0.1)
+    client = make_client(base_url)
+
+    start = time.perf_counter()
+    stream = client.stream('How is tuberculosis diagnosed?')
+    next(stream)
+    first_piece = time.perf_counter() - start
+    list(stream)
+    total = time.perf_counter() - start
+
+    assert first_piece < total / 2
+
+
+def test_stream_cut_off_midway_is_interrupted_and_not_cached(gemini):
+    _, base_url = gemini(stream_fail_rate=1.0)
+    client = make_client(base_url)
+    pieces = []
+
+    with pytest.raises(ChatError) as error:
+        for piece in client.stream('How is tuberculosis diagnosed?'):
+            pieces.append(piece)
+
+    assert error.value.outcome == 'interrupted'
+    assert pieces  # The first half arrived
+    assert client.cached('How is tuberculosis diagnosed?') is None
+
+
+def test_stream_retries_failures_before_the_first_piece(gemini):
+    server, base_url = gemini(fail_rate=1.0)
+    client = make_client(base_url, max_retries=1)
+
+    with pytest.raises(ChatError) as error:
+        list(client.stream('How is tuberculosis diagnosed?'))
+
+    assert error.value.status == 503
+    assert server.requests == 2
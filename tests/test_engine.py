@@ -0,0 +1,77 @@
+"""Tests of the exported-graph inference engines and their eager fallback"""
+
+import sys
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import engine  # noqa: E402
+from engine import InferenceEngine, TorchScriptEngine, build_engine  # noqa: E402
+
+
+class Scale(torch.nn.Module):
+    def forward(self, x):
+        return x * 2 + 1
+
+
+def failing_build(self, example_inputs, artifact_path=None):
+    raise RuntimeError("export not supported")
+
+
+def test_failed_build_falls_back_to_eager(monkeypatch):
+    monkeypatch.setattr(TorchScriptEngine, 'build', failing_build)
+    module = Scale()
+    built = build_engine("torchscript", module, (torch.ones(1, 3),))
+
+    assert type(built) is InferenceEngine
+    assert built.active == "eager"
+    assert torch.equal(built(torch.ones(2, 3)), module(torch.ones(2, 3)))
+
+
+def test_missing_backend_falls_back_to_eager(monkeypatch):
+    # ONNX Runtime is an optional dependency
+    monkeypatch.setitem(sys.modules, 'onnxruntime', None)
+    built = build_engine("onnx", Scale(), (torch.ones(1, 3),))
+
+    assert built.active == "eager"
+
+
+def test_run_failure_switches_to_eager_for_good():
+    module = Scale()
+    built = build_engine("torchscript", module, (torch.ones(1, 3),))
+    assert built.active == "torchscript"
+
+    def failing_run(*inputs):
+        raise RuntimeError("unsupported shape")
+
+    built._run = failing_run
+    assert torch.equal(built(torch.ones(2, 3)), module(torch.ones(2, 3)))
+    assert built.failed and built.active == "eager"
+
+
+def test_torchscript_artifact_is_reused(tmp_path):
+    module = Scale()
+    artifact = tmp_path / "model.unet"
+    first = build_engine("torchscript", module, (torch.ones(1, 3),), artifact)
+    assert (tmp_path / f"model.unet{TorchScriptEngine.suffix}").exists()
+
+    second = build_engine("torchscript", module, (torch.ones(1, 3),), artifact)
+    inputs = torch.randn(4, 3)
+    assert torch.equal(first(inputs), second(inputs))
+    assert torch.equal(second(inputs), module(inputs))
+
+
+def test_unknown_engine_is_rejected():
+    with pytest.raises(ValueError, match="Unknown engine 'tensorrt'"):
+        build_engine("tensorrt", Scale(), (torch.ones(1, 3),))
+
+
+def test_generator_falls_back_to_eager(make_generator, monkeypatch):
+    monkeypatch.setattr(engine.TorchScriptEngine, 'build', failing_build)
+    generator = make_generator(engine="torchscript")
+
+    assert generator.unet_engine.active == "eager"
+    assert generator.decoders["vae"].engine.active == "eager"
+    images = generator.generate_images(num_images=1, disease_type="NORMAL", num_inference_steps=2)
+    assert len(images) == 1
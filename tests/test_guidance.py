@@ -0,0 +1,88 @@
+"""Tests of class-conditional generation and classifier-free guidance"""
+
+import numpy as np
+import pytest
+
+from config import Config
+
+
+@pytest.fixture
+def make_conditional(make_generator, tmp_path):
+    """Generators loading a class-conditional checkpoint with random weights"""
+    torch = pytest.importorskip('torch')
+
+    def make(num_class_embeds=len(Config.CLASS_NAMES) + 1, **options):
+        checkpoint = tmp_path / f"conditional_{num_class_embeds}.pth"
+        if not checkpoint.exists():
+            unet = make_generator()._create_unet(num_class_embeds)
+            torch.save(unet.state_dict(), checkpoint)
+        return make_generator(model_path=checkpoint, **options)
+
+    return make
+
+
+def pixels(images):
+    return [np.asarray(image) for image in images]
+
+
+OPTIONS = {'num_images': 1, 'num_inference_steps': 2, 'seed': 5}
+
+
+def test_checkpoint_with_null_class_supports_guidance(make_conditional):
+    generator = make_conditional()
+
+    assert generator.num_class_embeds == len(Config.CLASS_NAMES) + 1
+    assert generator.null_class_label == len(Config.CLASS_NAMES)
+
+    guided = pixels(generator.generate_images(disease_type='PNEUMONIA', guidance_scale=3.0,
+                                              **OPTIONS))
+    unguided = pixels(generator.generate_images(disease_type='PNEUMONIA', **OPTIONS))
+    other_class = pixels(generator.generate_images(disease_type='NORMAL', guidance_scale=3.0,
+                                                   **OPTIONS))
+    assert not np.array_equal(guided[0], unguided[0])
+    assert not np.array_equal(guided[0], other_class[0])
+
+
+def test_guided_steps_pair_every_latent_with_the_null_class(make_conditional):
+    generator = make_conditional()
+    engine = generator.unet_engine
+    calls = []
+
+    def recording_engine(sample, timestep, class_labels):
+        calls.append((sample.shape[0], class_labels.tolist()))
+        return engine(sample, timestep, class_labels)
+
+    generator.unet_engine = recording_engine
+    generator.generate_images(num_images=2, disease_type=['NORMAL', 'TUBERCULOSIS'],
+                              num_inference_steps=2, guidance_scale=2.0)
+
+    null = generator.null_class_label
+    assert calls == [(4, [0, 2, null, null])] * 2
+
+
+def test_unknown_class_is_rejected(make_conditional):
+    generator = make_conditional()
+
+    with pytest.raises(ValueError, match="Unknown disease type 'MALARIA'"):
+        generator.generate_images(disease_type='MALARIA', **OPTIONS)
+    with pytest.raises(ValueError, match="Unknown disease type 'MALARIA'"):
+        generator.generate_images(num_images=2, disease_type=['NORMAL', 'MALARIA'],
+                                  num_inference_steps=2)
+
+
+def test_guidance_needs_a_null_class(make_generator, make_conditional):
+    for generator in (make_generator(), make_conditional(len(Config.CLASS_NAMES))):
+        assert generator.null_class_label is None
+        with pytest.raises(ValueError, match="Guidance needs a class-conditional checkpoint"):
+            generator.generate_images(disease_type='NORMAL', guidance_scale=3.0, **OPTIONS)
+        # Guidance scale 1 disables guidance
+        assert len(generator.generate_images(disease_type='NORMAL', guidance_scale=1.0,
+                                             **OPTIONS)) == 1
+
+
+def test_guidance_scale_range(make_conditional):
+    generator = make_conditional()
+
+    with pytest.raises(ValueError, match="Guidance scale must be between"):
+        generator.generate_images(disease_type='NORMAL',
+                                  guidance_scale=Config.MAX_GUIDANCE_SCALE + 1, **OPTIONS)
@@ -0,0 +1,120 @@
+"""Tests of the batched generation history writer"""
+
+import time
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+from database import GenerationRecord, configure_sqlite, db
+from history import HistoryWriter
+
+
+@pytest.fixture
+def app(tmp_path):
+    """Flask app with an empty SQLite database"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'history.db'}"
+    db.init_app(app)
+    with app.app_context():
+        configure_sqlite(db.engine)
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+def record(index):
+    return {'endpoint': 'generate', 'status': 'done', 'disease': 'NORMAL', 'count': index + 1}
+
+
+def stored_counts(app):
+    with app.app_context():
+        return [row.count for row in GenerationRecord.query.order_by(GenerationRecord.id)]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_full_batch_is_written_without_waiting(app):
+    writer = HistoryWriter(app, db, GenerationRecord, batch_size=3, flush_seconds=60)
+    for index in range(3):
+        writer.add(record(index))
+
+    assert wait_for(lambda: writer.stats()['written'] == 3)
+    assert stored_counts(app) == [1, 2, 3]
+    assert writer.stats()['pending'] == 0
+
+
+def test_partial_batch_is_written_after_flush_seconds(app):
+    writer = HistoryWriter(app, db, GenerationRecord, batch_size=50, flush_seconds=0.2)
+    start = time.monotonic()
+    writer.add(record(0))
+
+    assert wait_for(lambda: writer.stats()['written'] == 1)
+    assert time.monotonic() - start >= 0.2
+    assert stored_counts(app) == [1]
+
+
+def test_flush_writes_everything_queued(app):
+    writer = HistoryWriter(app, db, GenerationRecord, batch_size=2, flush_seconds=60)
+    # Queue without starting the background thread
+    for index in range(5):
+        writer._pending.append(record(index))
+
+    assert writer.flush() == 5
+    assert stored_counts(app) == [1, 2, 3, 4, 5]
+    assert writer.stats() == {'pending': 0, 'written': 5, 'dropped': 0, 'failed_batches': 0}
+
+
+def test_failed_batch_is_kept_and_retried(app):
+    with app.app_context():
+        db.session.execute(text('ALTER TABLE generation_jobs RENAME TO unavailable'))
+        db.session.commit()
+    writer = HistoryWriter(app, db, GenerationRecord, batch_size=10, flush_seconds=60)
+    for index in range(3):
+        writer._pending.append(record(index))
+
+    assert writer.flush() == 0
+    assert writer.stats()['pending'] == 3
+    assert writer.stats()['failed_batches'] == 1
+
+    with app.app_context():
+        db.session.execute(text('ALTER TABLE unavailable RENAME TO generation_jobs'))
+        db.session.commit()
+    assert writer.flush() == 3
+    assert stored_counts(app) == [1, 2, 3]  # In arrival order
+
+
+def test_oldest_records_are_dropped_beyond_max_pending(app):
+    writer = HistoryWriter(app, db, GenerationRecord, batch_size=10, flush_seconds=60,
+                           max_pending=3)
+    writer.start = lambda: None  # Keep the records queued
+    for index in range(5):
+        writer.add(record(index))
+
+    assert writer.stats()['dropped'] == 2
+    assert writer.flush() == 3
+    assert stored_counts(app) == [3, 4, 5]
+
+
+def test_sqlite_uses_write_ahead_logging(app):
+    with app.app_context():
+        assert db.session.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+
+
+def test_exit_hook_is_registered_once(app, monkeypatch):
+    hooks = []
+    monkeypatch.setattr('history.atexit.register', hooks.append)
+    writer = HistoryWriter(app, db, GenerationRecord, flush_seconds=60)
+    writer.start()
+    writer._thread = None  # As after a fork: the thread is gone
+    writer.start()
+
+    assert hooks == [writer.flush]
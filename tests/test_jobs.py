@@ -0,0 +1,100 @@
+"""Tests of the background generation jobs and their shared job files"""
+
+import threading
+
+import pytest
+
+from jobs import JobManager, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(tmp_path / 'jobs')
+
+
+def blocking_run(release):
+    """Job function that reports progress, then waits until released"""
+    def run(options, progress_callback):
+        progress_callback({'stage': 'denoising', 'step': 1})
+        release.wait(5)
+        return {'count': options['count']}
+    return run
+
+
+def test_job_lifecycle(store):
+    manager = JobManager(max_workers=1, store=store)
+    release = threading.Event()
+    job = manager.submit(blocking_run(release), {'count': 2}, owner=7)
+
+    version = job.wait_for_change(0, timeout=5)
+    assert job.status == 'running' and version > 0
+    assert manager.get(job.id) is job
+    assert manager.pending_count() == 1
+
+    release.set()
+    while not job.finished:
+        job.wait_for_change(job.version, timeout=5)
+    snapshot = job.to_dict()
+    assert snapshot['status'] == 'done'
+    assert snapshot['result'] == {'count': 2}
+    assert snapshot['progress'] == {'stage': 'denoising', 'step': 1}
+    assert snapshot['finished_at'] >= snapshot['started_at'] >= snapshot['created_at']
+    assert manager.pending_count() == 0
+
+
+def test_failed_job(store):
+    manager = JobManager(max_workers=1, store=store)
+
+    def run(options, progress_callback):
+        raise ValueError("Unknown disease type 'X'")
+
+    job = manager.submit(run, {})
+    while not job.finished:
+        job.wait_for_change(job.version, timeout=5)
+    assert job.status == 'failed'
+    assert job.error == "Unknown disease type 'X'"
+    assert store.load(job.id)['status'] == 'failed'
+
+
+def test_other_worker_sees_status_transitions(store):
+    """A second manager on the same directory stands in for another gunicorn worker"""
+    manager = JobManager(max_workers=1, store=store)
+    other = JobManager(max_workers=1, store=store)
+    release = threading.Event()
+    job = manager.submit(blocking_run(release), {'count': 1}, owner=7)
+
+    stored = other.get(job.id)
+    assert stored is not None and stored is not job
+    stored.poll_seconds = 0.01
+    assert stored.owner == 7
+    assert 'owner' not in stored.to_dict()
+
+    statuses = [stored.status]
+    release.set()
+    while not stored.finished:
+        stored.wait_for_change(stored.to_dict()['version'], timeout=5)
+        statuses.append(stored.status)
+    assert statuses[-1] == 'done'
+    assert set(statuses) <= {'queued', 'running', 'done'}
+    assert stored.to_dict()['result'] == {'count': 1}
+
+
+def test_store_rejects_foreign_ids(store):
+    (store.root.parent / 'secret.json').write_text('{}')
+    assert store.load('../secret') is None
+    assert store.load('0' * 32) is None
+
+
+def test_finished_jobs_are_pruned(store):
+    manager = JobManager(max_workers=1, max_jobs=2, store=store)
+    jobs = []
+    for count in range(3):
+        job = manager.submit(lambda options, progress_callback: None, {'count': count})
+        while not job.finished:
+            job.wait_for_change(job.version, timeout=5)
+        jobs.append(job)
+
+    # Room for the third job was made by dropping the oldest finished one
+    assert manager.get(jobs[0].id) is None
+    assert store.load(jobs[0].id) is None
+    assert manager.get(jobs[2].id) is jobs[2]
@@ -0,0 +1,87 @@
+"""Tests of latent storage and lazy decoding"""
+
+import numpy as np
+
+from latents import DecodedCache, latent_file_name, load_latents, save_latents
+
+
+def test_latents_round_trip_as_float16(tmp_path):
+    latents = np.random.default_rng(0).standard_normal((2, 4, 32, 32)).astype(np.float32)
+    metadata = {'disease': 'NORMAL', 'format': 'png', 'decoder': 'vae'}
+
+    save_latents(tmp_path, latents, [3, 5], metadata)
+    stored, loaded_metadata = load_latents(tmp_path)
+
+    assert sorted(stored) == [3, 5]
+    np.testing.assert_allclose(stored[5], latents[1], atol=1e-2)
+    assert loaded_metadata == metadata
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def test_missing_latent_file(tmp_path):
+    assert load_latents(tmp_path) is None
+
+
+def test_file_names_of_one_class():
+    metadata = {'disease': 'TUBERCULOSIS', 'format': 'png16'}
+
+    assert latent_file_name(metadata, 0) == 'tuberculosis_1.png'
+    assert latent_file_name({**metadata, 'format': 'webp'}, 2) == 'tuberculosis_3.webp'
+
+
+def test_mixed_class_latents_name_each_position(tmp_path):
+    metadata = {'disease': ['NORMAL', 'PNEUMONIA', 'TUBERCULOSIS'], 'format': 'png'}
+    save_latents(tmp_path, np.zeros((3, 4, 32, 32)), [0, 1, 2], metadata)
+
+    stored, loaded_metadata = load_latents(tmp_path)
+
+    assert [latent_file_name(loaded_metadata, index) for index in sorted(stored)] == [
+        'normal_1.png', 'pneumonia_2.png', 'tuberculosis_3.png'
+    ]
+
+
+def test_decoded_cache_evicts_least_recently_used():
+    cache = DecodedCache(max_bytes=10)
+    cache.put('a', b'1234')
+    cache.put('b', b'1234')
+    assert cache.get('a') == b'1234'
+
+    cache.put('c', b'1234')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1234'
+    assert cache.stats() == {'files': 2, 'bytes': 8, 'max_bytes': 10}
+
+
+def test_decoded_cache_skips_files_larger_than_the_cache():
+    cache = DecodedCache(max_bytes=4)
+    cache.put('a', b'12345')
+
+    assert cache.get('a') is None
+
+
+def test_latent_save_then_lazy_decode(make_generator, tmp_path):
+    generator = make_generator(batch_size=2, decode_batch_size=2)
+    classes = ['NORMAL', 'PNEUMONIA']
+
+    latents = generator.generate_images(
+        num_images=2, disease_type=classes, save_path=tmp_path, sampler='ddim',
+        num_inference_steps=2, seed=4, storage='latents'
+    )
+    assert len(latents) == 2
+    assert not list(tmp_path.glob('*.png'))  # Nothing decoded yet
+
+    images, metadata = generator.decode_saved(tmp_path)
+    assert metadata['disease'] == classes
+    assert [latent_file_name(metadata, index) for index in sorted(images)] == [
+        'normal_1.png', 'pneumonia_2.png'
+    ]
+
+    # Same pixels as decoding right away, up to the float16 storage
+    direct = generator.generate_images(
+        num_images=2, disease_type=classes, sampler='ddim', num_inference_steps=2, seed=4
+    )
+    for index, image in enumerate(direct):
+        difference = np.abs(np.asarray(images[index], dtype=np.float64)
+                            - np.asarray(image, dtype=np.float64))
+        assert difference.mean() < 1.0
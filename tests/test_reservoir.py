@@ -0,0 +1,123 @@
+"""Tests of the pre-generated image reservoir"""
+
+import threading
+import time
+
+import pytest
+
+from reservoir import ImageReservoir
+
+
+class FakeBackend:
+    """Generates numbered placeholder images and logs every call"""
+
+    def __init__(self):
+        self.calls = []
+        self.counter = 0
+
+    def generate_images(self, num_images, disease_type):
+        self.calls.append((disease_type, num_images))
+        images = [f"{disease_type}-{self.counter + i}" for i in range(num_images)]
+        self.counter += num_images
+        return images
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def backend():
+    return FakeBackend()
+
+
+def make_reservoir(backend, **options):
+    options = {'low_watermark': 2, 'high_watermark': 4, 'chunk_size': 3,
+               'idle_seconds': 0, **options}
+    return ImageReservoir(lambda: backend, ['NORMAL', 'PNEUMONIA'], **options)
+
+
+def test_fills_every_pool_to_the_high_watermark(backend):
+    reservoir = make_reservoir(backend)
+    reservoir.start()
+
+    assert wait_for(lambda: reservoir.stats() == {'NORMAL': 4, 'PNEUMONIA': 4})
+    # In chunks of at most chunk_size
+    assert all(count <= 3 for _, count in backend.calls)
+    assert sum(count for _, count in backend.calls) == 8
+
+
+def test_take_removes_images_in_order(backend):
+    reservoir = make_reservoir(backend)
+    reservoir.start()
+    assert wait_for(lambda: reservoir.stats()['NORMAL'] == 4)
+
+    first = reservoir.take('NORMAL', 1)
+    rest = reservoir.take('NORMAL', 10)
+    assert len(first) == 1 and len(rest) == 3
+    assert all(image.startswith('NORMAL-') for image in first + rest)
+    assert reservoir.take('UNKNOWN', 2) == []
+
+
+def test_refills_below_low_watermark_only(backend):
+    reservoir = make_reservoir(backend)
+    reservoir.start()
+    assert wait_for(lambda: reservoir.stats()['PNEUMONIA'] == 4)
+    calls = len(backend.calls)
+
+    # Still at the low watermark: no refill
+    reservoir.take('PNEUMONIA', 2)
+    time.sleep(0.1)
+    assert len(backend.calls) == calls
+
+    reservoir.take('PNEUMONIA', 1)
+    assert wait_for(lambda: reservoir.stats()['PNEUMONIA'] == 4)
+    assert backend.calls[calls:] == [('PNEUMONIA', 3)]
+
+
+def test_refills_wait_for_live_generation(backend):
+    reservoir = make_reservoir(backend, idle_seconds=0.05)
+    live = reservoir.live()
+    live.__enter__()
+    reservoir.start()
+    time.sleep(0.2)
+    assert backend.calls == []
+
+    live.__exit__(None, None, None)
+    assert wait_for(lambda: reservoir.stats() == {'NORMAL': 4, 'PNEUMONIA': 4})
+
+
+def test_failed_refill_is_retried(backend):
+    failures = threading.Event()
+    generate_images = backend.generate_images
+
+    def flaky(num_images, disease_type):
+        if not failures.is_set():
+            failures.set()
+            raise RuntimeError("out of memory")
+        return generate_images(num_images, disease_type)
+
+    backend.generate_images = flaky
+    reservoir = make_reservoir(backend, retry_seconds=0.01)
+    reservoir.start()
+
+    assert wait_for(lambda: reservoir.stats() == {'NORMAL': 4, 'PNEUMONIA': 4})
+    assert failures.is_set()
+
+
+def test_accepts_only_default_8_bit_requests():
+    assert ImageReservoir.accepts({'disease': 'NORMAL', 'count': 2})
+    assert not ImageReservoir.accepts({'seed': 1})
+    assert not ImageReservoir.accepts({'steps': 10})
+    assert not ImageReservoir.accepts({'guidance_scale': 3.0})
+    assert not ImageReservoir.accepts({'format': 'png16'})
+
+
+def test_rejects_inverted_watermarks(backend):
+    with pytest.raises(ValueError):
+        make_reservoir(backend, low_watermark=5, high_watermark=4)
@@ -0,0 +1,91 @@
+"""Tests of the generated image storage"""
+
+import pytest
+from flask import Flask, send_from_directory
+from werkzeug.exceptions import NotFound
+
+from storage import StorageManager
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return StorageManager(tmp_path / 'generated', tmp_path / 'sessions', sweep_seconds=3600)
+
+
+def test_session_ids_are_validated(storage, tmp_path):
+    session_id, session_dir = storage.create_session('NORMAL', owner=1)
+    assert session_dir.parent == storage.root
+    assert storage.get_session(session_id, owner=1) == session_dir
+
+    # Folders outside the storage root, reached through the session id
+    (tmp_path / 'secret').mkdir()
+    for bad_id in ('..', '../secret', '/tmp', f"{session_id}/..", f"../generated/{session_id}",
+                   'secret', '', None, 123):
+        assert storage.get_session(bad_id, owner=1) is None
+
+
+def test_sessions_of_other_users_are_hidden(storage):
+    session_id, session_dir = storage.create_session('pneumonia', owner=1)
+    assert storage.get_session(session_id, owner=2) is None
+    assert storage.get_session(session_id) is None
+
+    shared_id, shared_dir = storage.create_session('normal')
+    assert storage.get_session(shared_id, owner=2) == shared_dir
+
+
+def test_files_are_served_from_inside_the_session_only(storage, tmp_path):
+    """Mirrors the /static/generated/<session_id>/<path> route"""
+    session_id, session_dir = storage.create_session('normal', owner=1)
+    (session_dir / 'image_0.png').write_bytes(b'image')
+    other_id, other_dir = storage.create_session('normal', owner=2)
+    (other_dir / 'image_0.png').write_bytes(b'other')
+    (tmp_path / 'secret.txt').write_text('secret')
+
+    app = Flask(__name__)
+    with app.test_request_context():
+        session_dir = storage.get_session(session_id, owner=1)
+        response = send_from_directory(session_dir, 'image_0.png')
+        response.direct_passthrough = False
+        assert response.get_data() == b'image'
+        response.close()
+
+        for filename in (f"../{other_id}/image_0.png", '../../secret.txt',
+                         str(tmp_path / 'secret.txt'), '..'):
+            with pytest.raises(NotFound):
+                send_from_directory(session_dir, filename)
+
+
+def backdate(storage, session_id, seconds):
+    """Make a session older, in its index record as well (sweeps reload unfinished ones)"""
+    info = storage._sessions[session_id]
+    info.created_at -= seconds
+    storage._write_record(info)
+
+
+def test_sweep_evicts_expired_and_over_quota_sessions(tmp_path):
+    storage = StorageManager(tmp_path / 'generated', tmp_path / 'sessions',
+                             ttl_seconds=60, max_bytes=10)
+    expired_id, _ = storage.create_session('normal')
+    backdate(storage, expired_id, 120)
+
+    old_id, old_dir = storage.create_session('normal')
+    (old_dir / 'image_0.png').write_bytes(b'x' * 8)
+    storage.finish_session(old_id)
+    new_id, new_dir = storage.create_session('normal')
+    (new_dir / 'image_0.png').write_bytes(b'x' * 8)
+    storage.finish_session(new_id)
+    backdate(storage, old_id, 1)
+
+    assert storage.sweep() == 2
+    assert storage.get_session(expired_id) is None
+    assert storage.get_session(old_id) is None
+    assert storage.get_session(new_id) == new_dir
+    assert not old_dir.exists()
+
+
+def test_workers_share_sessions_through_the_index(storage, tmp_path):
+    session_id, session_dir = storage.create_session('normal', owner=1)
+    other = StorageManager(tmp_path / 'generated', tmp_path / 'sessions', sweep_seconds=3600)
+
+    assert other.get_session(session_id, owner=1) == session_dir
+    assert other.get_session(session_id, owner=2) is None
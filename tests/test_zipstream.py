@@ -0,0 +1,77 @@
+"""Tests of the streaming ZIP writer"""
+
+import io
+import zipfile
+
+from zipstream import ZipStream
+
+
+def build(files, chunk_size=7):
+    """Stream an archive and return its bytes and announced size"""
+    stream = ZipStream(files, chunk_size=chunk_size)
+    return b''.join(stream), stream.content_length
+
+
+def test_stored_and_deflated_members_round_trip(tmp_path):
+    image = tmp_path / 'image.png'
+    image.write_bytes(bytes(range(256)) * 10)
+    notes = tmp_path / 'notes.txt'
+    notes.write_text('pneumonia ' * 500)
+
+    data, _ = build([(image, 'session/image.png'), (notes, 'session/notes.txt')])
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        assert archive.read('session/image.png') == image.read_bytes()
+        assert archive.read('session/notes.txt') == notes.read_bytes()
+        methods = {info.filename: info.compress_type for info in archive.infolist()}
+    assert methods == {
+        'session/image.png': zipfile.ZIP_STORED,
+        'session/notes.txt': zipfile.ZIP_DEFLATED,
+    }
+
+
+def test_content_length_matches_stored_archive(tmp_path):
+    files = []
+    for index in range(3):
+        path = tmp_path / f'{index}.png'
+        path.write_bytes(b'x' * (1000 * index + 1))
+        files.append((path, f'é/{index}.png'))  # Non-ASCII names are UTF-8
+
+    data, content_length = build(files)
+
+    assert content_length == len(data)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == ['é/0.png', 'é/1.png', 'é/2.png']
+
+
+def test_content_length_unknown_for_deflated_members(tmp_path):
+    path = tmp_path / 'report.txt'
+    path.write_text('report')
+
+    assert ZipStream([(path, 'report.txt')]).content_length is None
+
+
+def test_callable_members_are_produced_while_streaming(tmp_path):
+    calls = []
+
+    def produce():
+        calls.append(1)
+        return b'decoded image' * 100
+
+    stream = ZipStream([(produce, 'lazy.png')], chunk_size=16)
+    assert stream.content_length is None
+    assert calls == []  # Nothing is produced before streaming
+
+    data = b''.join(stream)
+    assert calls == [1]
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.read('lazy.png') == b'decoded image' * 100
+
+
+def test_empty_archive():
+    data, content_length = build([])
+
+    assert content_length == len(data)
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == []
@@ -0,0 +1,172 @@
+"""
+Streaming ZIP archives
+Writes a ZIP of files on disk chunk by chunk, so a download never holds the
+archive in memory and starts before the last file is read
+"""
+
+import struct
+import time
+import zlib
+from pathlib import Path
+
+
+# Formats that are compressed already; deflating them costs CPU and saves nothing
+STORED_SUFFIXES = {'.png', '.webp', '.jpg', '.jpeg', '.gif', '.zip', '.gz', '.npz'}
+
+# General purpose flags: sizes and CRC follow the data (bit 3), UTF-8 names (bit 11)
+_FLAGS = 0x0008 | 0x0800
+_VERSION = 20  # 2.0: deflate, data descriptors
+_STORED, _DEFLATED = 0, 8
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_DATA_DESCRIPTOR = struct.Struct('<IIII')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+# Without ZIP64 records sizes and offsets are 32-bit
+_MAX_SIZE = 0xFFFFFFFF
+
+
+def _dos_datetime(mtime):
+    """(time, date) in MS-DOS format; years before 1980 are clamped"""
+    year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return ((hour << 11) | (minute << 5) | (second // 2),
+            ((year - 1980) << 9) | (month << 5) | day)
+
+
+class _Entry:
+    """One archive member and what the central directory needs to know about it"""
+
+    def __init__(self, source, arcname):
+        self.name = arcname.encode('utf-8')
+        if callable(source):
+            # Produced while streaming: size unknown until then
+            self.path = None
+            self.produce = source
+            self.size = None
+            self.mode = 0o100644
+            self.time, self.date = _dos_datetime(time.time())
+        else:
+            self.path = Path(source)
+            self.produce = None
+            stat = self.path.stat()
+            self.size = stat.st_size
+            self.mode = stat.st_mode
+            self.time, self.date = _dos_datetime(stat.st_mtime)
+        suffix = Path(arcname).suffix.lower()
+        self.method = _STORED if suffix in STORED_SUFFIXES else _DEFLATED
+        self.crc = 0
+        self.compressed_size = 0
+        self.offset = 0
+
+
+class ZipStream:
+    """
+    Iterable of the bytes of a ZIP archive of files on disk
+
+    Files are read and written in chunks of chunk_size, so memory use does not
+    depend on the archive size. Already compressed formats (STORED_SUFFIXES)
+    are stored as they are; other files are deflated. When every member is
+    stored, the archive size is known before streaming (content_length) and
+    can be sent as Content-Length. Members can also be callables returning
+    their bytes (e.g. images decoded on demand); they are called while
+    streaming, and the size is then unknown up front. Archives are limited to
+    4 GiB (no ZIP64).
+    """
+
+    def __init__(self, files, chunk_size=64 * 1024):
+        """
+        Prepare the archive (only stats the files)
+
+        Args:
+            files: Iterable of (path or callable returning bytes, archive name) pairs
+            chunk_size: Bytes read from a file at a time
+        """
+        self.entries = [_Entry(source, arcname) for source, arcname in files]
+        self.chunk_size = chunk_size
+
+    @property
+    def content_length(self):
+        """Exact archive size in bytes, or None if a member is deflated or produced"""
+        if any(entry.method != _STORED or entry.size is None for entry in self.entries):
+            return None
+        size = _END_RECORD.size
+        for entry in self.entries:
+            size += (_LOCAL_HEADER.size + _DATA_DESCRIPTOR.size + _CENTRAL_HEADER.size
+                     + 2 * len(entry.name) + entry.size)
+        return size if size <= _MAX_SIZE else None
+
+    def __iter__(self):
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            for chunk in self._member(entry):
+                offset += len(chunk)
+                yield chunk
+
+        central_directory = b''.join(self._central_header(entry) for entry in self.entries)
+        if offset > _MAX_SIZE:
+            raise ValueError("Archive larger than 4 GiB needs ZIP64, which is not supported")
+        yield central_directory + _END_RECORD.pack(
+            0x06054b50, 0, 0, len(self.entries), len(self.entries),
+            len(central_directory), offset, 0
+        )
+
+    def _member(self, entry):
+        """Local header, data and data descriptor of one member"""
+        # CRC and sizes are unknown until the data is written: zero here,
+        # in the data descriptor and central directory after it
+        yield _LOCAL_HEADER.pack(
+            0x04034b50, _VERSION, _FLAGS, entry.method, entry.time, entry.date,
+            0, 0, 0, len(entry.name), 0
+        ) + entry.name
+
+        compressor = None
+        if entry.method == _DEFLATED:
+            # Raw deflate stream, as ZIP expects
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        crc = size = compressed_size = 0
+        for chunk in self._read(entry):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            compressed_size += len(chunk)
+            if chunk:
+                yield chunk
+        if compressor is not None:
+            chunk = compressor.flush()
+            compressed_size += len(chunk)
+            yield chunk
+
+        if entry.size is not None and size != entry.size and entry.method == _STORED:
+            # The announced Content-Length would be wrong
+            raise OSError(f"{entry.path} changed size while being archived")
+        entry.crc, entry.size, entry.compressed_size = crc, size, compressed_size
+        yield _DATA_DESCRIPTOR.pack(0x08074b50, crc, compressed_size, size)
+
+    def _read(self, entry):
+        """Data of a member in chunks of chunk_size"""
+        if entry.produce is not None:
+            data = entry.produce()
+            for start in range(0, len(data), self.chunk_size):
+                yield data[start:start + self.chunk_size]
+            return
+        with open(entry.path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    @staticmethod
+    def _central_header(entry):
+        return _CENTRAL_HEADER.pack(
+            0x02014b50,
+            (3 << 8) | _VERSION,  # Made by: Unix, so external attributes hold the file mode
+            _VERSION, _FLAGS, entry.method, entry.time, entry.date,
+            entry.crc, entry.compressed_size, entry.size,
+            len(entry.name), 0, 0, 0, 0,
+            (entry.mode & 0xFFFF) << 16,
+            entry.offset
+        ) + entry.name